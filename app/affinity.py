@@ -0,0 +1,294 @@
+"""
+Runs several app workers behind a proxy that keeps every game on one worker.
+
+The proxy reads the request head of each incoming connection. WebSocket connections to ``/game/ws/{game_id}`` are
+routed by consistent hashing of the game id, so all sockets of a game end up in the same process together with its
+in-memory state and actor. All other requests (REST) go to the workers round-robin. The proxy then hands the socket
+itself to the worker (``util/handoff.py``) and is out of the connection, it never relays any data.
+
+A game stays on the worker that reported claiming it until that worker reports it saved and released, also when
+workers are added. When a worker dies it is removed from the ring, its claims are dropped and it is restarted. Run
+from the ``app`` directory:
+
+    python affinity.py --workers 4 --port 8070
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import re
+import signal
+import socket
+import sys
+import uuid
+
+from util import handoff
+from util.codec import MAX_FRAME_SIZE
+from util.hashring import HashRing
+from util.logs import setup_logging, shutdown_logging
+
+GAME_SOCKET_PATH = re.compile(rb"^/game/ws/([^/?#]+)")
+CONNECTION_HEADER = re.compile(rb"\r\nconnection:[^\r]*", re.IGNORECASE)
+# Longest request head (request line and headers) the proxy accepts
+MAX_HEAD_SIZE = 64 * 1024
+# Seconds a client has to send its request head
+HEAD_TIMEOUT = 10.0
+
+SERVICE_UNAVAILABLE = b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+BAD_GATEWAY = b"HTTP/1.1 502 Bad Gateway\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+
+logger = logging.getLogger("app.affinity")
+
+
+class AffinityProxy:
+    """Routes connections to backends (``"host:port"``) and pins each game to the backend that holds it."""
+
+    def __init__(self, backends=(), replicas=128):
+        self.ring = HashRing(backends, replicas)
+        self.channels = {}  # {backend: handoff socket}
+        self.pinned = {}  # {game_id: backend}, as reported by the workers
+        self._round_robin = itertools.count()
+
+    def add_backend(self, backend, channel=None):
+        self.ring.add(backend)
+        if channel is not None:
+            self.channels[backend] = channel
+            asyncio.get_running_loop().add_reader(channel, self._receive, backend, channel)
+        logger.info("backend added", extra={"fields": {"backend": backend, "backends": len(self.ring)}})
+
+    def remove_backend(self, backend):
+        self.ring.remove(backend)
+        channel = self.channels.pop(backend, None)
+        if channel is not None:
+            asyncio.get_running_loop().remove_reader(channel)
+            channel.close()
+        for game_id in [game_id for game_id, pinned in self.pinned.items() if pinned == backend]:
+            del self.pinned[game_id]
+        logger.info("backend removed", extra={"fields": {"backend": backend, "backends": len(self.ring)}})
+
+    def route(self, game_id=None):
+        """The backend for a new connection (None if there is none)."""
+        if game_id is None:
+            backends = sorted(self.ring.nodes)
+            return backends[next(self._round_robin) % len(backends)] if backends else None
+        pinned = self.pinned.get(game_id)
+        if pinned is not None and pinned in self.ring:
+            return pinned
+        return self.ring.get(game_id)
+
+    def report(self, backend, message):
+        """Applies a worker's report (``+game_id`` claimed, ``-game_id`` released)."""
+        kind, game_id = message[:1], message[1:].decode()
+        if kind == handoff.CLAIMED:
+            self.pinned[game_id] = backend
+        elif kind == handoff.RELEASED and self.pinned.get(game_id) == backend:
+            # Erst jetzt ist das Spiel gespeichert und darf umziehen
+            del self.pinned[game_id]
+
+    async def handle(self, client):
+        loop = asyncio.get_running_loop()
+        try:
+            try:
+                head = await asyncio.wait_for(_read_head(loop, client), HEAD_TIMEOUT)
+            except (asyncio.TimeoutError, OSError):
+                return
+            if head is None:
+                return
+            end = head.index(b"\r\n\r\n") + 4
+            parts = head[:end].split(b" ", 2)
+            match = GAME_SOCKET_PATH.match(parts[1]) if len(parts) == 3 else None
+            game_id = match.group(1).decode() if match else None
+
+            backend = self.route(game_id)
+            channel = self.channels.get(backend)
+            if channel is None:
+                await loop.sock_sendall(client, SERVICE_UNAVAILABLE)
+                return
+            if game_id is None:
+                head = _close_after_response(head[:end]) + head[end:]
+            try:
+                await handoff.send_message(channel, handoff.CONNECTION + head, [client.fileno()])
+            except OSError:
+                await loop.sock_sendall(client, BAD_GATEWAY)
+        except OSError:
+            pass
+        finally:
+            # Der Worker hat seine eigene Kopie des Sockets
+            client.close()
+
+    async def serve(self, listener):
+        loop = asyncio.get_running_loop()
+        handlers = set()
+        while True:
+            client, _ = await loop.sock_accept(listener)
+            handler = asyncio.create_task(self.handle(client))
+            handlers.add(handler)
+            handler.add_done_callback(handlers.discard)
+
+    def _receive(self, backend, channel):
+        while True:
+            try:
+                message = channel.recv(handoff.MAX_MESSAGE_SIZE)
+            except BlockingIOError:
+                return
+            except OSError:
+                message = b""
+            if not message:
+                asyncio.get_running_loop().remove_reader(channel)
+                return
+            self.report(backend, message)
+
+
+async def _read_head(loop, client):
+    head = b""
+    while b"\r\n\r\n" not in head:
+        if len(head) >= MAX_HEAD_SIZE:
+            return None
+        data = await loop.sock_recv(client, MAX_HEAD_SIZE - len(head))
+        if not data:
+            return None
+        head += data
+    return head
+
+
+def _close_after_response(head):
+    # Nur die erste Anfrage einer Verbindung wird geroutet, ein Keep-Alive könnte sonst später den Socket eines Spiels
+    # zum falschen Worker tragen
+    return CONNECTION_HEADER.sub(b"", head)[:-2] + b"Connection: close\r\n\r\n"
+
+
+class Worker:
+    """One app process on a local port that also serves the connections handed over by the proxy."""
+
+    def __init__(self, port, host="127.0.0.1"):
+        self.host = host
+        self.port = port
+        self.process = None
+        self.channel = None  # proxy end of the handoff socket
+        self.owner = None  # GAME_OWNER_ID of the current process
+
+    @property
+    def backend(self):
+        return f"{self.host}:{self.port}"
+
+    async def start(self):
+        self.channel, worker_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.channel.setblocking(False)
+        self.owner = f"{socket.gethostname()}:{self.backend}:{uuid.uuid4().hex[:8]}"
+        try:
+            self.process = await asyncio.create_subprocess_exec(
+                sys.executable, os.path.abspath(__file__), "--serve-worker", "--host", self.host,
+                "--port", str(self.port), pass_fds=(worker_end.fileno(),),
+                env={**os.environ, "GAME_ROUTING": "affinity", "GAME_OWNER_ID": self.owner,
+                     "AFFINITY_HANDOFF_FD": str(worker_end.fileno())}
+            )
+        finally:
+            worker_end.close()
+        # Warten, bis der Worker Verbindungen annimmt
+        for _ in range(300):
+            if self.process.returncode is not None:
+                self.channel.close()
+                raise RuntimeError(f"Worker {self.backend} exited with {self.process.returncode}")
+            try:
+                _, writer = await asyncio.open_connection(self.host, self.port)
+            except OSError:
+                await asyncio.sleep(0.1)
+                continue
+            writer.close()
+            return
+        self.channel.close()
+        raise RuntimeError(f"Worker {self.backend} did not start")
+
+    async def stop(self):
+        if self.process is not None and self.process.returncode is None:
+            self.process.terminate()
+            await self.process.wait()
+
+
+def release_claims(owner):
+    """Drops the game claims of a dead worker, so its games do not wait for the lease to expire."""
+    from database import engine
+    from util.game_store import RELEASE_ALL
+
+    with engine.begin() as db_conn:
+        db_conn.execute(RELEASE_ALL, {"owner": owner})
+
+
+async def supervise(worker, proxy, restart_delay=1.0):
+    """Keeps a worker in the ring while it runs and restarts it when it dies."""
+    while True:
+        try:
+            await worker.start()
+        except RuntimeError:
+            logger.exception("worker start failed", extra={"fields": {"backend": worker.backend}})
+            await asyncio.sleep(restart_delay)
+            continue
+        proxy.add_backend(worker.backend, worker.channel)
+        await worker.process.wait()
+        proxy.remove_backend(worker.backend)
+        logger.error("worker exited", extra={"fields": {"backend": worker.backend,
+                                                       "returncode": worker.process.returncode}})
+        try:
+            await asyncio.to_thread(release_claims, worker.owner)
+        except Exception:
+            logger.exception("releasing claims failed", extra={"fields": {"backend": worker.backend}})
+        await asyncio.sleep(restart_delay)
+
+
+async def serve(workers, host, port, worker_port):
+    from database import Base, engine
+    import models.game  # noqa: F401 registriert die Tabellen
+    import models.user  # noqa: F401
+
+    # Einmal vorab, sonst legen alle Worker gleichzeitig die Tabellen an
+    Base.metadata.create_all(bind=engine)
+
+    proxy = AffinityProxy()
+    pool = [Worker(worker_port + i) for i in range(workers)]
+    supervisors = [asyncio.create_task(supervise(worker, proxy)) for worker in pool]
+    listener = socket.create_server((host, port), backlog=1024)
+    listener.setblocking(False)
+    server = asyncio.create_task(proxy.serve(listener))
+    logger.info("proxy listening", extra={"fields": {"host": host, "port": port, "workers": workers}})
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        asyncio.get_running_loop().add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        server.cancel()
+        listener.close()
+        for supervisor in supervisors:
+            supervisor.cancel()
+        await asyncio.gather(*(worker.stop() for worker in pool))
+
+
+def serve_worker(host, port):
+    import uvicorn
+
+    config = uvicorn.Config("app:app", host=host, port=port, ws_max_size=MAX_FRAME_SIZE * 4, log_level="warning")
+    handoff.HandoffServer(config, handoff.channel).run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8070)
+    parser.add_argument("--worker-port", type=int, default=9100, help="port of the first worker")
+    parser.add_argument("--serve-worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_worker:
+        serve_worker(args.host, args.port)
+        return
+    setup_logging()
+    try:
+        asyncio.run(serve(args.workers, args.host, args.port, args.worker_port))
+    finally:
+        shutdown_logging()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import logging
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, status
@@ -6,19 +7,33 @@ from sqlalchemy import text
 from sqlalchemy.exc import IntegrityError, NoResultFound, SQLAlchemyError
 from sqlalchemy.orm import sessionmaker
 # noinspection PyPackageRequirements
-from starlette.responses import JSONResponse, RedirectResponse, FileResponse
+from starlette.responses import JSONResponse, RedirectResponse, FileResponse, Response
 # noinspection PyPackageRequirements
 from starlette.staticfiles import StaticFiles
 
-from database import engine, Base
-from routers import user, game, web
+from database import async_engine, engine, Base
+from routers import admin, user, game, web
+from util import codec, metrics
+from util.auth_cache import principal_cache
+from util.broker import broker, check_routing, invalidation_notify_sql
+from util.logs import setup_logging, shutdown_logging
+
+logger = logging.getLogger("app")
 
 
 @asynccontextmanager
 async def lifespan(_):
+    setup_logging()
+    check_routing()
     Base.metadata.create_all(bind=engine)
     setup_cron_job()
+    await broker.start(game.deliver_remote, principal_cache.invalidate_user)
+    game.game_store.start()
     yield
+    await broker.stop()
+    await game.game_store.close()
+    await async_engine.dispose()
+    shutdown_logging()
 
 
 app = FastAPI(
@@ -32,6 +47,12 @@ app = FastAPI(
 )
 
 
+metrics.track_pool(engine, "sync")
+metrics.track_pool(async_engine, "async")
+if metrics.METRICS_ENABLED:
+    app.add_middleware(metrics.HttpMetricsMiddleware)
+
+
 def setup_cron_job():
     with sessionmaker(autocommit=False, autoflush=False, bind=engine)() as session:
         try:
@@ -51,14 +72,19 @@ def setup_cron_job():
                 {
                     "job_name":      "daily_delete_old_guests",
                     "schedule_time": "0 3 * * *",
-                    "job_query":     """
-                        DELETE FROM public.user
-                        WHERE guest = TRUE
-                        AND created < NOW() - INTERVAL '48 hours';
+                    # Die Prozesse verwerfen die Tokens der gelöschten Gäste aus ihrem Cache
+                    "job_query":     f"""
+                        WITH deleted AS (
+                            DELETE FROM public.user
+                            WHERE guest = TRUE
+                            AND created < NOW() - INTERVAL '48 hours'
+                            RETURNING id
+                        )
+                        SELECT {invalidation_notify_sql()} FROM deleted;
                         """,
                 },
             )
-            print("Cron job daily_delete_old_guests scheduled.")
+            logger.info("Cron job daily_delete_old_guests scheduled.")
 
             session.execute(
                 text("DELETE FROM cron.job WHERE jobname = :job_name;"), {"job_name": "daily_delete_old_games"}
@@ -75,11 +101,11 @@ def setup_cron_job():
                         """,
                 },
             )
-            print("Cron job daily_delete_old_games scheduled.")
+            logger.info("Cron job daily_delete_old_games scheduled.")
 
             session.commit()
         except SQLAlchemyError as e:
-            print(f"Error setting up cron job: {str(e)}")
+            logger.error(f"Error setting up cron job: {str(e)}")
 
 
 @app.exception_handler(KeyError)
@@ -125,6 +151,7 @@ async def no_result_found_error_handler(request, exc):
 app.include_router(user.router)
 app.include_router(game.router)
 app.include_router(web.router)
+app.include_router(admin.router)
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -146,6 +173,12 @@ def overridden_redoc():
                           redoc_favicon_url="/static/icon.png")
 
 
+if metrics.METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    async def get_metrics():
+        return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
 @app.get("/", include_in_schema=False)
 async def root():
     return RedirectResponse(url="/docs")
@@ -154,4 +187,5 @@ async def root():
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run(app, host="127.0.0.1", port=8070)
+    # Reject oversized frames already in the protocol layer (UTF-8 needs at most 4 bytes per character)
+    uvicorn.run(app, host="127.0.0.1", port=8070, ws_max_size=codec.MAX_FRAME_SIZE * 4)
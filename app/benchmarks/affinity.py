@@ -0,0 +1,146 @@
+"""
+Load test of the affinity proxy with 1 to N workers.
+
+Starts ``affinity.py`` with each worker count, opens two-player Mau-Mau lobbies through the proxy and lets one player
+of every lobby toggle ``ready`` as fast as the broadcasts come back. Client processes run in parallel so the client
+is not the bottleneck; the result is the number of actions per second the workers handle. Actions only scale with
+the workers as long as there are free CPU cores for them (and for the clients). The proxy only routes and hands over
+the sockets, its CPU time (``proxy cpu``, Linux only) has to stay near zero for that. Run from the ``app`` directory:
+
+    python -m benchmarks.affinity --workers 1 2 4 --games 64 --duration 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+
+import websockets
+
+GAME_SETTINGS = {"type": "maumau", "deck_size": 32, "number_of_start_cards": 5, "gamemode": "gamemode_classic"}
+
+
+def _request(base_url, method, path, body=None, token=None):
+    request = urllib.request.Request(base_url + path, method=method,
+                                     data=None if body is None else json.dumps(body).encode())
+    request.add_header("Content-Type", "application/json")
+    if token is not None:
+        request.add_header("Authorization", token)
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+def create_lobby(base_url):
+    """A new game and two guests, returns ``(game_id, [token, token])``."""
+    tokens = [_request(base_url, "POST", "/user/guest")["jwt_token"] for _ in range(2)]
+    game = _request(base_url, "POST", "/game", GAME_SETTINGS, tokens[0])
+    return game["id"], tokens
+
+
+async def _receive_action(ws, action):
+    while True:
+        message = json.loads(await ws.recv())
+        if message.get("action") == action:
+            return message
+
+
+async def play(ws_url, game_id, tokens, deadline):
+    sockets = [await websockets.connect(f"{ws_url}/game/ws/{game_id}?token={token}") for token in tokens]
+    try:
+        for ws in sockets:
+            await ws.send(json.dumps({"action": "join"}))
+            await _receive_action(ws, "join")
+        # Nur ein Spieler wechselt "ready", das Spiel startet also nie
+        ws, ready, actions = sockets[0], True, 0
+        while time.monotonic() < deadline:
+            await ws.send(json.dumps({"action": "ready", "ready": ready}))
+            await _receive_action(ws, "ready")
+            ready = not ready
+            actions += 1
+        return actions
+    finally:
+        for ws in sockets:
+            await ws.close()
+
+
+def run_client(base_url, games, duration):
+    """One client process: plays ``games`` lobbies concurrently, returns the number of actions."""
+    lobbies = [create_lobby(base_url) for _ in range(games)]
+    ws_url = "ws" + base_url[len("http"):]
+
+    async def main():
+        deadline = time.monotonic() + duration
+        return sum(await asyncio.gather(*(play(ws_url, game_id, tokens, deadline) for game_id, tokens in lobbies)))
+
+    return asyncio.run(main())
+
+
+def _wait_for_port(port, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Port {port} did not open")
+
+
+def _cpu_seconds(pid):
+    """User and system CPU time of a process so far, from ``/proc`` (None where there is none)."""
+    try:
+        with open(f"/proc/{pid}/stat") as stat:
+            fields = stat.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def bench(workers, games, clients, duration, port, worker_port):
+    proxy = subprocess.Popen(
+        [sys.executable, "affinity.py", "--workers", str(workers), "--port", str(port),
+         "--worker-port", str(worker_port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env={**os.environ, "LOG_LEVEL": "WARNING"}
+    )
+    try:
+        for i in range(workers):
+            _wait_for_port(worker_port + i)
+        _wait_for_port(port)
+        time.sleep(0.5)  # der Proxy nimmt die Worker erst nach ihrem Start in den Ring auf
+        base_url = f"http://127.0.0.1:{port}"
+        with ProcessPoolExecutor(clients) as pool:
+            results = pool.map(run_client, [base_url] * clients, [games // clients] * clients,
+                               [duration] * clients)
+            actions = sum(results)
+        return actions / duration, _cpu_seconds(proxy.pid)
+    finally:
+        proxy.terminate()
+        proxy.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--games", type=int, default=64)
+    parser.add_argument("--clients", type=int, default=4, help="client processes")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per worker count")
+    parser.add_argument("--port", type=int, default=8070)
+    parser.add_argument("--worker-port", type=int, default=9100)
+    args = parser.parse_args()
+
+    print(f"{'workers':>7} {'actions/s':>10} {'scaling':>8} {'proxy cpu':>10}")
+    baseline = None
+    for workers in args.workers:
+        rate, proxy_cpu = bench(workers, args.games, args.clients, args.duration, args.port, args.worker_port)
+        baseline = baseline or rate
+        proxy_cpu = "-" if proxy_cpu is None else f"{proxy_cpu:.2f} s"
+        print(f"{workers:>7} {rate:>10.0f} {rate / baseline:>7.2f}x {proxy_cpu:>10}")
+
+
+if __name__ == "__main__":
+    main()
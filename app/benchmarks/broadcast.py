@@ -0,0 +1,86 @@
+"""
+Micro-benchmark for the broadcast fan-out of one message to all players of a table.
+
+Compares the old path (``send_json`` per socket, i.e. one ``json.dumps`` per recipient) with the serialize-once path
+(one ``Frame`` queued for every connection). Run from the ``app`` directory:
+
+    python -m benchmarks.broadcast
+"""
+import asyncio
+import json
+import timeit
+import uuid
+
+from util.connection import Connection
+from util.generic import send_to_all
+from util.cards import generate_card_deck, to_wire
+
+PLAYER_COUNTS = (2, 4, 8)
+REPEAT = 5
+NUMBER = 2000
+
+
+class FakeWebSocket:
+    """Behaves like starlette's WebSocket without any network I/O."""
+
+    async def send_json(self, message):
+        await self.send_text(json.dumps(message, separators=(",", ":"), ensure_ascii=False))
+
+    async def send_text(self, text):
+        pass
+
+
+async def old_send_to_all(websockets, message):
+    for ws in websockets.values():
+        await ws.send_json(message)
+
+
+def typical_messages(player_ids):
+    card = to_wire(generate_card_deck(32)[0])
+    return [
+        {"action": "place_card_on_stack", "card": card, "player": player_ids[0]},
+        {"action": "card_count", "discard_pile_count": 12, "draw_pile_count": 9,
+         "hand_count": {pid: 5 for pid in player_ids}},
+        {"action": "turn", "player": player_ids[1]},
+    ]
+
+
+def bench(players):
+    player_ids = [str(uuid.uuid4()) for _ in range(players)]
+    messages = typical_messages(player_ids)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    websockets = {pid: FakeWebSocket() for pid in player_ids}
+    connections = {pid: Connection(FakeWebSocket(), max_queue=10 ** 9) for pid in player_ids}
+
+    async def old():
+        for message in messages:
+            await old_send_to_all(websockets, message)
+
+    async def new():
+        for message in messages:
+            await send_to_all(connections, message)
+        # Equivalent of the writer tasks: hand every queued frame to the socket
+        for connection in connections.values():
+            while connection.queue:
+                await connection.websocket.send_text(connection.queue.popleft().text)
+
+    def run(coroutine_function):
+        return min(timeit.repeat(lambda: loop.run_until_complete(coroutine_function()), repeat=REPEAT,
+                                 number=NUMBER)) / NUMBER / len(messages)
+
+    result = run(old), run(new)
+    loop.close()
+    return result
+
+
+def main():
+    print(f"{'players':>7} {'old (µs/msg)':>13} {'new (µs/msg)':>13} {'speedup':>8}")
+    for players in PLAYER_COUNTS:
+        old, new = bench(players)
+        print(f"{players:>7} {old * 1e6:>13.2f} {new * 1e6:>13.2f} {old / new:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
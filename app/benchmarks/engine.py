@@ -0,0 +1,234 @@
+"""
+Per-action cost of the rules engines (``logic/maumau.py``, ``logic/lügen.py``) on 104-card games.
+
+Plays complete games with simple bots through ``game_decision``, the same way the game socket does, and reports the
+mean and median time per action type. Every game is played ``REPEAT`` times and each action counts with its fastest
+run, which keeps the numbers stable on a busy machine. The bots only see what a client sees (the messages) and keep
+their hands in a fixed card order, so the same seed plays the same games and the numbers are comparable across changes
+of the internal state representation. Run from the ``app`` directory:
+
+    python -m benchmarks.engine
+"""
+import asyncio
+import json
+import random
+import statistics
+import time
+import traceback
+from collections import defaultdict
+from types import SimpleNamespace
+
+from logic import lügen, maumau
+
+DECK_SIZE = 104
+PLAYERS = 4
+ACTIONS = 20000
+REPEAT = 5
+SEED = 1
+
+SUITS = ("Hearts", "Diamonds", "Clubs", "Spades")
+VALUES = ("7", "8", "9", "10", "J", "Q", "K", "A", "2", "3", "4", "5", "6")
+
+
+def card_order(card):
+    return SUITS.index(card["suit"]), VALUES.index(card["value"])
+
+
+class FakeConnection:
+    """Collects everything the engine sends, the bots read it after the action."""
+
+    def __init__(self):
+        self.frames = []
+        self.messages = []
+
+    def enqueue_frame(self, frame):
+        self.frames.append(frame)
+        return True
+
+    async def send_json(self, message):
+        self.messages.append(message)
+
+    def take(self):
+        # JSON round trip, so the bots never hold a reference into the game state
+        received = [json.loads(frame.text) for frame in self.frames]
+        received += [json.loads(json.dumps(message)) for message in self.messages]
+        self.frames.clear()
+        self.messages.clear()
+        return received
+
+
+class Table:
+    """One game with its players, their connections and what they know about the game."""
+
+    def __init__(self, engine, settings, players=PLAYERS):
+        self.engine = engine
+        self.settings = settings
+        self.state = {"started": False}
+        self.players = {}
+        self.users = [SimpleNamespace(id=f"player-{i}") for i in range(players)]
+        self.connections = {user.id: FakeConnection() for user in self.users}
+        self.hands = {user.id: [] for user in self.users}
+        self.seen = []
+        self.timings = defaultdict(list)
+        self.ended = False
+        self.error = None  # why the game ended early (exception, bot and engine disagree, ...)
+        self.after_action = None  # called with the table after every action, returns an error or None
+
+    def fail(self, error):
+        self.error = error
+        self.ended = True
+
+    async def act(self, user, message):
+        action = message["action"]
+        connection = self.connections[user.id]
+        start = time.perf_counter()
+        try:
+            self.state, self.players = await self.engine.game_decision(
+                connection, self.connections, message, self.state, self.players, self.settings, user
+            )
+        except Exception:
+            # Der Socket würde mit "unknown_error_session" geschlossen, das Spiel ist für den Bot vorbei
+            self.fail(f"{action}: {traceback.format_exc()}")
+            return []
+        self.timings[action].append(time.perf_counter() - start)
+        if self.after_action is not None:
+            error = self.after_action(self)
+            if error:
+                self.fail(f"after {action}: {error}")
+
+        self.seen = []
+        for pid, player_connection in self.connections.items():
+            for received in player_connection.take():
+                if received.get("action") == "hand":
+                    self.hands[pid] = sorted(received["hand"], key=card_order)
+                elif received.get("action") == "end":
+                    self.ended = True
+                if pid == user.id:
+                    self.seen.append(received)
+        return self.seen
+
+    async def start(self):
+        for user in self.users:
+            await self.act(user, {"action": "join"})
+        for user in self.users:
+            await self.act(user, {"action": "ready", "ready": True})
+
+    def current(self):
+        return next(user for user in self.users if user.id == self.state["current_player"])
+
+
+def playable(card, top, j_choice):
+    if card["value"] == "J" and top["value"] == "J":
+        return False
+    if top["value"] == "J":
+        return card["suit"] == j_choice
+    return card["value"] == top["value"] or card["suit"] == top["suit"] or card["value"] == "J"
+
+
+async def play_maumau(table, choose=None):
+    """``choose``: picks one of the playable cards, by default the first one of the hand."""
+    await table.start()
+    top = next(m["discard_pile"] for m in table.seen if m.get("action") == "start")
+    j_choice = ""
+
+    while not table.ended:
+        user = table.current()
+        hand = table.hands[user.id]
+        cards = [card for card in hand if playable(card, top, j_choice)]
+        card = (choose or (lambda candidates: candidates[0]))(cards) if cards else None
+        if card is not None:
+            message = {"action": "place_card_on_stack", "card": card, "mau": True}
+            if card["value"] == "J":
+                message["j_choice"] = random.choice(SUITS)
+            seen = await table.act(user, message)
+            if any(m.get("error") == "has_to_draw_penalty" for m in seen):
+                await table.act(user, {"action": "draw_penalty"})
+                continue
+            placed = next((m for m in seen if m.get("action") == "place_card_on_stack"), None)
+            if placed is None:
+                if not table.ended:
+                    table.fail(f"place_card_on_stack {card} on {top} ({j_choice}) was rejected: {seen}")
+                break  # the bot and the engine disagree, give up this game
+            top, j_choice = placed["card"], placed.get("j_choice", j_choice)
+            if not any(m.get("action") == "hand" for m in seen):
+                hand.remove(card)
+            continue
+        seen = await table.act(user, {"action": "draw_card"})
+        if any(m.get("error") == "has_to_draw_penalty" for m in seen):
+            await table.act(user, {"action": "draw_penalty"})
+        elif not table.ended and table.state.get("current_player") == user.id:
+            await table.act(user, {"action": "skip"})
+
+
+async def play_lügen(table, challenge_rate=0.3):
+    await table.start()
+    pile = 0
+    round_value = None
+    while not table.ended:
+        user = table.current()
+        hand = table.hands[user.id]
+        if pile and random.random() < challenge_rate:
+            await table.act(user, {"action": "challenge"})
+            pile, round_value = 0, None
+            continue
+        if not hand:
+            await table.act(user, {"action": "challenge"})
+            pile, round_value = 0, None
+            continue
+        cards = random.sample(hand, min(len(hand), random.randint(1, 3)))
+        claimed = round_value or cards[0]["value"]
+        if claimed == "A" and table.settings["gamemode"] == "gamemode_classic":
+            claimed = "7"  # im klassischen Modus darf kein Ass angesagt werden, die Lüge schon
+        seen = await table.act(user, {"action": "place_cards", "cards": cards, "claimed_value": claimed})
+        if any("error" in m for m in seen):
+            table.fail(f"place_cards {cards} as {claimed} was rejected: {seen}")
+            break  # the bot and the engine disagree, give up this game
+        for card in cards:
+            hand.remove(card)
+        pile += len(cards)
+        round_value = claimed
+
+
+async def run(engine, play, settings):
+    timings = defaultdict(list)
+    count = 0
+    while count < ACTIONS:
+        table = Table(engine, dict(settings))
+        await play(table)
+        for action, values in table.timings.items():
+            if action not in ("join", "ready"):
+                timings[action].extend(values)
+                count += len(values)
+    return timings
+
+
+def report(name, timings):
+    total = sum(sum(values) for values in timings.values())
+    actions = sum(len(values) for values in timings.values())
+    print(f"{name}: {actions} actions, {total / actions * 1e6:.1f} µs per action")
+    for action, values in sorted(timings.items()):
+        print(f"  {action:<22} {len(values):>6} {sum(values) / len(values) * 1e6:>8.1f} µs mean "
+              f"{statistics.median(values) * 1e6:>8.1f} µs median")
+
+
+def fastest(loop, engine, play, settings):
+    runs = []
+    for _ in range(REPEAT):
+        random.seed(SEED)  # the same games in every run
+        runs.append(loop.run_until_complete(run(engine, play, settings)))
+    return {action: [min(values) for values in zip(*(timings[action] for timings in runs))] for action in runs[0]}
+
+
+def main():
+    loop = asyncio.new_event_loop()
+    maumau_settings = {"max_players": 8, "deck_size": DECK_SIZE, "number_of_start_cards": 5,
+                       "gamemode": "gamemode_classic"}
+    lügen_settings = {"max_players": 8, "deck_size": DECK_SIZE, "number_of_start_cards": 0,
+                      "gamemode": "gamemode_alternative"}
+    report("maumau", fastest(loop, maumau, play_maumau, maumau_settings))
+    report("lügen", fastest(loop, lügen, play_lügen, lügen_settings))
+    loop.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""
+Micro-benchmarks of the hot functions of the rules engines, with baselines and a regression gate.
+
+Times ``can_place_card_on_stack``, ``generate_card_deck``, ``turn_first_card``, ``flip_pile_if_empty`` (reshuffle),
+``get_next_player``, ``get_hand_counts`` and the duplicate check of a Lügen ``challenge`` (``discard_duplicates`` for
+the player who takes the pile) for every deck size and, where the number of players matters, for 2 to 8 players.
+Every case is the fastest of ``REPEAT`` runs in each of ``--rounds`` rounds, in µs per call. The inputs are built
+before the clock starts, the same seed builds the same inputs, and the suite always runs with a fixed
+``PYTHONHASHSEED``.
+
+``--save baseline.json`` writes the results as JSON, ``--compare baseline.json`` compares with such a file and exits
+with status 1 if a case got slower than ``--threshold`` (default 25 %) and ``--min-delta`` µs. Cases that look slower
+are measured again (``--retries``) before they count. Baselines are only comparable on the same machine and Python
+version. Run from the ``app`` directory:
+
+    python -m benchmarks.hotpaths --save baseline.json
+    python -m benchmarks.hotpaths --compare baseline.json --filter lügen
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+from logic import lügen
+from util.cards import HAND_SLOTS, VALUES, add_card, generate_card_deck, new_hand, value_of
+from util.generic import flip_pile_if_empty
+from util.maumau import can_place_card_on_stack, turn_first_card
+from util.outbox import Outbox
+from util.seating import get_next_player, seat_players
+
+DECK_SIZES = (32, 52, 64, 104)
+PLAYER_COUNTS = range(2, 9)
+START_CARDS = 5
+NUMBER = 2000  # calls per run
+REPEAT = 7
+SEED = 1
+HASH_SEED = "0"
+
+
+def timed(function, calls):
+    """µs per call of ``function(*args)`` for every ``args`` in ``calls``, fastest of ``REPEAT`` runs."""
+    best = float("inf")
+    for _ in range(REPEAT):
+        runs = calls() if callable(calls) else calls
+        start = time.perf_counter()
+        for args in runs:
+            function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best / len(runs) * 1e6
+
+
+def deal(deck_size, players, cards_per_player):
+    """A shuffled deck dealt to ``players`` players, returns ``(players, rest of the deck)``."""
+    deck = generate_card_deck(deck_size)
+    table = {}
+    for i in range(players):
+        table[f"player-{i}"] = {"hand": new_hand(deck[:cards_per_player]), "join_sequence": i}
+        deck = deck[cards_per_player:]
+    return table, deck
+
+
+def bench_can_place_card_on_stack(deck_size):
+    deck = generate_card_deck(deck_size)
+    calls = [(deck[i], deck[i + 1], random.choice(("", "Hearts"))) for i in range(len(deck) - 1)]
+    return timed(can_place_card_on_stack, calls * (NUMBER // len(calls)))
+
+
+def bench_generate_card_deck(deck_size):
+    return timed(generate_card_deck, [(deck_size,)] * NUMBER)
+
+
+def bench_turn_first_card(deck_size):
+    # Das Ziehen verändert die Stapel, jeder Aufruf bekommt eigene
+    deck = generate_card_deck(deck_size)
+    return timed(turn_first_card, lambda: [(deck[:], []) for _ in range(NUMBER)])
+
+
+def bench_flip_pile_if_empty(deck_size, players):
+    """The reshuffle: the draw pile is empty, everything but the hands is on the discard pile."""
+    _, discard_pile = deal(deck_size, players, START_CARDS)
+    return timed(flip_pile_if_empty,
+                 lambda: [({"draw_pile": [], "discard_pile": discard_pile[:]},) for _ in range(NUMBER // 10)])
+
+
+def bench_get_next_player(deck_size, players):
+    table, _ = deal(deck_size, players, START_CARDS)
+    state = {}
+    seat_players(state, table)
+    return timed(get_next_player, [(state, table, pid, i % 2) for i, pid in enumerate(table)] * (NUMBER // players))
+
+
+def bench_get_hand_counts(deck_size, players):
+    table, _ = deal(deck_size, players, START_CARDS)
+    return timed(lügen.get_hand_counts, [(table,)] * NUMBER)
+
+
+def bench_lügen_challenge(deck_size, players):
+    """
+    The duplicate check after a challenge: the taker gets 1 to 7 cards of the other players and only the values of
+    these cards are checked, a completed value is removed from the hand.
+    """
+    table, _ = deal(deck_size, players, deck_size // players)
+    settings = {"deck_size": deck_size, "gamemode": "gamemode_alternative"}
+    state = {"removed_pile": []}
+    lügen.discard_duplicates(Outbox(), state, table, settings,
+                             {pid: range(len(VALUES)) for pid in table})  # wie beim Spielstart
+    taker, *others = table
+    pile = [card for pid in others for card in range(HAND_SLOTS) for _ in range(table[pid]["hand"][card])]
+    hands = []
+    for _ in range(NUMBER // 10):
+        hand = table[taker]["hand"][:]
+        taken = set()
+        for card in random.sample(pile, min(len(pile), random.randint(1, 7))):
+            add_card(hand, card)
+            taken.add(value_of(card))
+        hands.append((hand, taken))
+
+    def calls():
+        runs = []
+        for hand, taken in hands:
+            players = {**table, taker: {**table[taker], "hand": hand[:]}}
+            runs.append((Outbox(), {"removed_pile": []}, players, settings, {taker: taken}))
+        return runs
+
+    return timed(lügen.discard_duplicates, calls)
+
+
+def max_players(game, deck_size):
+    """Wie beim Anlegen eines Spiels (``routers/game.py``)."""
+    return min((deck_size - 10) // START_CARDS, 8) if game == "maumau" else min(deck_size // 6, 8)
+
+
+# name: (benchmark, None or the game type whose player limit applies)
+CASES = {
+    "can_place_card_on_stack": (bench_can_place_card_on_stack, None),
+    "generate_card_deck":      (bench_generate_card_deck, None),
+    "turn_first_card":         (bench_turn_first_card, None),
+    "flip_pile_if_empty":      (bench_flip_pile_if_empty, "maumau"),
+    "get_next_player":         (bench_get_next_player, "lügen"),
+    "get_hand_counts":         (bench_get_hand_counts, "lügen"),
+    "lügen_challenge":         (bench_lügen_challenge, "lügen"),
+}
+
+
+def cases(selected=""):
+    """
+    ``{case: (benchmark, deck_size, players)}`` of the cases containing ``selected``, names are
+    ``function[deck_size]`` or ``function[deck_size/players]``.
+    """
+    found = {}
+    for name, (bench, game) in CASES.items():
+        for deck_size in DECK_SIZES:
+            if game is None:
+                found[f"{name}[{deck_size}]"] = (bench, deck_size, None)
+                continue
+            for players in PLAYER_COUNTS:
+                if players <= max_players(game, deck_size):
+                    found[f"{name}[{deck_size}/{players}]"] = (bench, deck_size, players)
+    return {case: spec for case, spec in found.items() if selected in case}
+
+
+def run(selected, rounds, results=None):
+    """
+    µs per call of every case, the fastest of ``rounds`` rounds over all cases (a busy phase of the machine rarely
+    lasts through all rounds). ``results``: earlier measurements, only improved.
+    """
+    results = dict(results or {})
+    for _ in range(rounds):
+        for case, (bench, deck_size, players) in selected.items():
+            random.seed(SEED)
+            value = bench(deck_size) if players is None else bench(deck_size, players)
+            results[case] = min(results.get(case, float("inf")), value)
+    return results
+
+
+def slower_cases(results, baseline, threshold, min_delta):
+    """Cases slower by more than ``threshold`` and by more than ``min_delta`` µs (below that it is noise)."""
+    return [case for case, value in results.items()
+            if case in baseline and value / baseline[case] - 1 > threshold and value - baseline[case] > min_delta]
+
+
+def compare(results, baseline, threshold, min_delta):
+    """Prints every case next to its baseline, returns the slower ones."""
+    slower = slower_cases(results, baseline, threshold, min_delta)
+    print(f"{'case':<34} {'baseline µs':>12} {'now µs':>10} {'change':>8}")
+    for case, value in results.items():
+        before = baseline.get(case)
+        if before is None:
+            print(f"{case:<34} {'-':>12} {value:>10.3f}")
+        else:
+            print(f"{case:<34} {before:>12.3f} {value:>10.3f} {value / before - 1:>+8.1%}"
+                  f"{'  SLOWER' if case in slower else ''}")
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--save", metavar="FILE", help="write the results as a baseline")
+    parser.add_argument("--compare", metavar="FILE", help="compare with a baseline, exit status 1 on a regression")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown, 0.25: 25 %%")
+    parser.add_argument("--filter", default="", help="only cases whose name contains this")
+    parser.add_argument("--min-delta", type=float, default=0.1, help="µs a case may get slower in any case")
+    parser.add_argument("--rounds", type=int, default=3, help="runs over all cases, each case counts with its fastest")
+    parser.add_argument("--retries", type=int, default=3, help="extra rounds for cases that look slower")
+    args = parser.parse_args()
+    if os.environ.get("PYTHONHASHSEED") != HASH_SEED:
+        # Die Hash-Werte von str ändern sich sonst pro Prozess und damit die Zeiten der Dict-Zugriffe
+        os.execve(sys.executable, [sys.executable, "-m", "benchmarks.hotpaths", *sys.argv[1:]],
+                  {**os.environ, "PYTHONHASHSEED": HASH_SEED})
+
+    selected = cases(args.filter)
+    results = run(selected, args.rounds)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            baseline = json.load(file)
+        if baseline.get("python") != platform.python_version():
+            print(f"baseline is from Python {baseline.get('python')}, this is {platform.python_version()}")
+        # Auf einer belasteten Maschine sieht manches langsamer aus, das zählt erst nach weiteren Runden
+        for _ in range(args.retries):
+            suspects = slower_cases(results, baseline["results"], args.threshold, args.min_delta)
+            if not suspects:
+                break
+            results = run({case: selected[case] for case in suspects}, 1, results)
+        slower = compare(results, baseline["results"], args.threshold, args.min_delta)
+    else:
+        print(f"{'case':<34} {'µs':>10}")
+        for case, value in results.items():
+            print(f"{case:<34} {value:>10.3f}")
+        slower = []
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as file:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(), "number": NUMBER,
+                       "repeat": REPEAT, "results": results}, file, indent=2, ensure_ascii=False)
+    if slower:
+        print(f"{len(slower)} of {len(results)} cases are more than {args.threshold:.0%} slower than the baseline")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,512 @@
+"""
+End-to-end load test of the game socket with latency percentiles.
+
+Boots the app with uvicorn (SQLite in a temporary directory, or the database of ``--database-url``), or uses a
+running server (``--url``). Creates guests (``POST /user/guest``) and games (``POST /game``) over HTTP and lets tables
+of bots play over ``/game/ws/{game_id}``, the same messages a browser sends. A table that finished a game joins again
+and plays the next one until the test ends.
+
+Per action type the report shows how many were sent, the errors they got and the latency percentiles:
+
+- ``p50/p95/p99``: action sent until the answer reached the sender
+- ``all p95/p99``: action sent until every player of the table had the broadcast (the ``seq`` of the event)
+
+``connect``/``reconnect`` are the WebSocket handshakes. Each stage of the ramp profile is reported with its
+throughput, so the point where latencies start to rise can be read off directly. Scenarios are JSON files (see
+``benchmarks/scenarios``, missing keys come from ``DEFAULT_SCENARIO``):
+
+- ``games``: game types, assigned to the tables in turn
+- ``players``: bots per table, ``settings``: the body of ``POST /game`` without ``type``
+- ``lobby``: ``play`` (ready up and play) or ``churn`` (join, ready, unready and leave the lobby over and over)
+- ``stages``: ramp profile, ``{"tables": new tables, "ramp": seconds to open them, "hold": seconds afterward}``
+- ``think_time``: mean seconds a bot waits before it acts, ``challenge_rate``: Lügen bots
+- ``reconnect_at``: seconds after the start at which every bot closes its socket and reconnects with ``last_seq``
+
+Client processes run in parallel so the client is not the bottleneck. Run from the ``app`` directory:
+
+    python -m benchmarks.loadtest --scenario full_tables --clients 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import websockets
+
+from benchmarks.affinity import _request, _wait_for_port
+
+SCENARIOS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scenarios")
+DEFAULT_SCENARIO = {
+    "games":          ["maumau"],
+    "players":        4,
+    "settings":       {"deck_size": 104, "number_of_start_cards": 5, "gamemode": "gamemode_alternative"},
+    "lobby":          "play",
+    "stages":         [{"tables": 16, "ramp": 5, "hold": 20}],
+    "think_time":     0.0,
+    "challenge_rate": 0.3,
+    "reconnect_at":   [],
+}
+ACTION_TIMEOUT = 10.0  # seconds without an answer, the action counts as failed with "timeout"
+SETUP_THREADS = 16
+
+SUITS = ("Hearts", "Diamonds", "Clubs", "Spades")
+RESPONSES = {"skip": "turn"}  # answers named differently from the action
+ERROR_KEYS = ("error", "unknown_error", "unknown_error_session")
+
+
+def load_scenario(name):
+    """A scenario from a JSON file or by name from ``benchmarks/scenarios``."""
+    path = name if os.path.exists(name) else os.path.join(SCENARIOS_DIR, f"{name}.json")
+    with open(path, encoding="utf-8") as file:
+        return {**DEFAULT_SCENARIO, **json.load(file)}
+
+
+def schedule(scenario):
+    """``(stages, duration)``: the start and end of every stage and when each of its tables opens."""
+    stages, start = [], 0.0
+    for stage in scenario["stages"]:
+        tables, ramp = stage["tables"], stage.get("ramp", 0)
+        offsets = [start + ramp * i / tables for i in range(tables)]
+        end = start + ramp + stage.get("hold", 0)
+        stages.append((start, end, offsets))
+        start = end
+    return stages, start
+
+
+class Recorder:
+    """What one client process measured, times are seconds since the start of the test."""
+
+    def __init__(self, t0):
+        self.t0 = t0
+        self.samples = []  # (action, time, latency)
+        self.broadcasts = []  # (action, latency until the whole table had the event)
+        self.errors = []  # (action, error, time)
+
+    def now(self):
+        return time.time() - self.t0
+
+    def sample(self, action, latency):
+        self.samples.append((action, self.now(), latency))
+
+    def error(self, action, error):
+        self.errors.append((action, str(error), self.now()))
+
+
+class Bot:
+    """One player: a socket, what the player knows about the game and at most one action waiting for its answer."""
+
+    def __init__(self, table, index, guest):
+        self.table = table
+        self.index = index
+        self.token = guest["jwt_token"]
+        self.user_id = guest["id"]
+        self.ws = None
+        self.last_seq = None
+        self.joined = False  # sent the first join, a new socket resumes with ``last_seq``
+        self.pending = None  # (action, sent)
+        self.reconnecting = False
+        self.deferred = None  # the action the bot wanted to send while it reconnected
+        self.resynced = False  # asked for the game data after an error in this turn
+        self.hand = []
+        self.my_turn = False
+        # Mau Mau
+        self.drawn = False
+        self.sevens = False  # a 7 is on the pile and nobody drew the penalty yet
+        self.draw_pile = 1
+        # Lügen
+        self.pile = 0
+        self.round_value = None
+        self.placed = []
+
+    async def connect(self):
+        url = f"{self.table.ws_url}/game/ws/{self.table.game_id}?token={self.token}"
+        if self.joined and self.last_seq is not None:
+            url += f"&last_seq={self.last_seq}"
+        start = time.perf_counter()
+        self.ws = await websockets.connect(url, max_size=None)
+        self.table.recorder.sample("reconnect" if self.joined else "connect", time.perf_counter() - start)
+
+    async def run(self):
+        while True:
+            try:
+                await self.connect()
+            except Exception as e:
+                self.table.recorder.error("connect", type(e).__name__)
+                return
+            if not self.joined:
+                self.joined = True
+                await self.send({"action": "join"})
+            elif self.deferred is not None:
+                message, self.deferred = self.deferred, None
+                await self.send(message)
+            try:
+                async for frame in self.ws:
+                    await self.handle(json.loads(frame))
+            except websockets.ConnectionClosed:
+                pass
+            if not self.reconnecting:
+                if not self.table.stopped:
+                    self.table.recorder.error("socket", "closed_by_server")
+                return
+            self.reconnecting = False
+
+    async def reconnect(self):
+        """
+        Closes the socket once the bot waits for no answer, ``run`` connects again with ``last_seq``. Actions the bot
+        wants to send in the meantime are sent after the reconnect.
+        """
+        self.reconnecting = True
+        deadline = time.monotonic() + ACTION_TIMEOUT
+        while self.pending is not None and time.monotonic() < deadline:
+            await asyncio.sleep(0.005)
+        self.pending = None
+        await self.ws.close()
+
+    async def send(self, message):
+        if self.table.stopped:
+            return
+        if self.reconnecting:
+            self.deferred = message
+            return
+        if self.table.think_time:
+            self.pending = (message["action"], time.perf_counter())  # reconnect() wartet auch die Bedenkzeit ab
+            await asyncio.sleep(random.expovariate(1 / self.table.think_time))
+        self.pending = (message["action"], time.perf_counter())
+        try:
+            await self.ws.send(json.dumps(message))
+        except websockets.ConnectionClosed:
+            self.pending = None
+
+    def answered(self, message):
+        """Whether ``message`` answers the pending action, records its latency (or error)."""
+        action, sent = self.pending
+        error = next((message[key] for key in ERROR_KEYS if key in message), None)
+        if error is not None:
+            self.table.recorder.error(action, error)
+            self.pending = None
+            return True
+        if message.get("action") != RESPONSES.get(action, action):
+            return False
+        if action not in RESPONSES and message.get("player", self.user_id) != self.user_id:
+            return False  # the same action of another player
+        self.table.recorder.sample(action, time.perf_counter() - sent)
+        if "seq" in message:
+            self.table.expect(message["seq"], action, sent)
+        self.pending = None
+        return True
+
+    async def handle(self, message):
+        failed = False
+        if self.pending is not None:
+            if time.perf_counter() - self.pending[1] > ACTION_TIMEOUT:
+                self.table.recorder.error(self.pending[0], "timeout")
+                self.pending = None
+            else:
+                failed = self.answered(message) and any(key in message for key in ERROR_KEYS)
+        if "seq" in message:
+            self.last_seq = message["seq"]
+            self.table.arrived(message["seq"])
+        if failed:
+            await self.on_error(message.get("error"))
+        else:
+            await self.on_message(message)
+
+    # ------------------------------------------------------------
+    # Lobby
+    # ------------------------------------------------------------
+    async def on_lobby(self, message):
+        action, player = message.get("action"), message.get("player")
+        if self.table.lobby == "churn":
+            if player != self.user_id or self.index == 0:
+                return  # der erste Spieler bleibt in der Lobby und nie ready, das Spiel startet also nie
+            if action == "join":
+                await self.send({"action": "ready", "ready": True})
+            elif action == "ready":
+                await self.send({"action": "ready", "ready": False} if message["ready"] else {"action": "leave_lobby"})
+            elif action == "leave_lobby":
+                await self.send({"action": "join"})
+        elif action == "join" and self.user_id in message["players"]:
+            if len(message["players"]) == len(self.table.bots):
+                await self.send({"action": "ready", "ready": True})  # alle sind da, der Tisch ist voll
+
+    # ------------------------------------------------------------
+    # Game
+    # ------------------------------------------------------------
+    async def on_message(self, message):
+        action = message.get("action")
+        if action in ("join", "ready", "leave_lobby"):
+            await self.on_lobby(message)
+        elif action == "hand":
+            self.hand = message["hand"]
+        elif action == "end":
+            self.my_turn = False
+            await self.send({"action": "join"})
+        elif self.table.game == "maumau":
+            await self.on_maumau(message)
+        else:
+            await self.on_lügen(message)
+
+    async def on_error(self, error):
+        if self.table.game == "maumau" and self.my_turn:
+            if error == "has_to_draw_penalty":
+                return await self.send({"action": "draw_penalty"})
+            if error in ("cant_draw_again", "No cards left to draw"):
+                self.drawn = True
+                return await self.send({"action": "skip"})
+        if self.my_turn and not self.resynced:
+            # Bot und Server sind sich uneinig, einmal pro Zug den Stand vom Server holen
+            self.resynced = True
+            await self.send({"action": "request_game_data"})
+
+    async def on_maumau(self, message):
+        action = message.get("action")
+        if action == "turn":
+            self.my_turn, self.drawn, self.resynced = message["player"] == self.user_id, False, False
+        elif action == "start":
+            self.sevens, self.draw_pile = False, 1
+        elif action == "place_card_on_stack":
+            self.sevens = message["card"]["value"] == "7"
+        elif action == "draw_penalty":
+            self.sevens = False
+        elif action == "draw_card":
+            self.drawn = True
+        elif action == "card_count":
+            self.draw_pile = message["draw_pile_count"]
+        elif action == "game_data":
+            self.my_turn, self.hand = message["current_player"] == self.user_id, message["hand"]
+            self.draw_pile = message["draw_pile"]
+            if self.my_turn:
+                await self.play_maumau(message["playable_cards"])
+        elif action == "playable_cards" and self.my_turn:
+            await self.play_maumau(message["cards"])
+
+    async def play_maumau(self, playable):
+        if playable:
+            card = playable[0]
+            message = {"action": "place_card_on_stack", "card": card, "mau": True}
+            if card["value"] == "J":
+                message["j_choice"] = random.choice(SUITS)
+            await self.send(message)
+        elif self.sevens:
+            await self.send({"action": "draw_penalty"})
+        elif not self.drawn and self.draw_pile:
+            await self.send({"action": "draw_card"})
+        else:
+            await self.send({"action": "skip"})
+
+    async def on_lügen(self, message):
+        action = message.get("action")
+        if action == "place_cards":
+            self.pile += message["n_last"]
+            self.round_value = message["claimed_value"]
+            if message["player"] == self.user_id:
+                for card in self.placed:
+                    if card in self.hand:
+                        self.hand.remove(card)
+        elif action == "challenge":
+            self.pile, self.round_value = 0, None
+        elif action == "discard_duplicates" and message["player"] == self.user_id:
+            self.hand = [card for card in self.hand if card["value"] != message["value"]]
+        elif action == "game_data":
+            self.hand, self.pile = message["hand"], message.get("discard_pile_count", 0)
+            self.round_value = message.get("round_value")
+            self.my_turn = message["current_player"] == self.user_id
+            if self.my_turn:
+                await self.play_lügen()
+        elif action == "turn":
+            self.my_turn, self.resynced = message["player"] == self.user_id, False
+            if self.my_turn:
+                await self.play_lügen()
+
+    async def play_lügen(self):
+        if self.pile and (not self.hand or not self.round_value or random.random() < self.table.challenge_rate):
+            return await self.send({"action": "challenge"})
+        if not self.hand:
+            return await self.send({"action": "challenge"})
+        self.placed = random.sample(self.hand, min(len(self.hand), random.randint(1, 3)))
+        claimed = self.round_value or self.placed[0]["value"]
+        if claimed == "A" and self.table.settings.get("gamemode") == "gamemode_classic":
+            claimed = "7"  # im klassischen Modus darf kein Ass angesagt werden, die Lüge schon
+        await self.send({"action": "place_cards", "cards": self.placed, "claimed_value": claimed})
+
+
+class Table:
+    """One game and its bots, tracks when every bot of the table received an event."""
+
+    def __init__(self, ws_url, spec, scenario, recorder):
+        self.ws_url = ws_url
+        self.game = spec["game"]
+        self.game_id = spec["game_id"]
+        self.settings = scenario["settings"]
+        self.lobby = scenario["lobby"]
+        self.think_time = scenario["think_time"]
+        self.challenge_rate = scenario["challenge_rate"]
+        self.recorder = recorder
+        self.bots = [Bot(self, i, guest) for i, guest in enumerate(spec["guests"])]
+        self.stopped = False
+        self.arrivals = {}  # seq -> bots that received it
+        self.expected = {}  # seq -> (action, sent)
+
+    def expect(self, seq, action, sent):
+        self.expected[seq] = (action, sent)
+
+    def arrived(self, seq):
+        arrivals = self.arrivals[seq] = self.arrivals.get(seq, 0) + 1
+        if arrivals < len(self.bots):
+            return
+        del self.arrivals[seq]
+        if seq in self.expected:
+            action, sent = self.expected.pop(seq)
+            self.recorder.broadcasts.append((action, time.perf_counter() - sent))
+
+    async def reconnect(self):
+        await asyncio.gather(*(bot.reconnect() for bot in self.bots if bot.ws is not None))
+
+    async def close(self):
+        self.stopped = True
+        for bot in self.bots:
+            if bot.ws is not None:
+                await bot.ws.close()
+
+
+def run_client(base_url, tables, scenario, t0, duration):
+    """One client process: opens its tables at their offsets, returns what the recorder measured."""
+    ws_url = "ws" + base_url[len("http"):]
+    recorder = Recorder(t0)
+
+    async def open_table(offset, table):
+        await asyncio.sleep(max(0.0, t0 + offset - time.time()))
+        await asyncio.gather(*(bot.run() for bot in table.bots))
+
+    async def storm(at, opened):
+        await asyncio.sleep(max(0.0, t0 + at - time.time()))
+        await asyncio.gather(*(table.reconnect() for table in opened))
+
+    async def main():
+        opened = [Table(ws_url, spec, scenario, recorder) for _, spec in tables]
+        tasks = [asyncio.create_task(open_table(offset, table)) for (offset, _), table in zip(tables, opened)]
+        tasks += [asyncio.create_task(storm(at, opened)) for at in scenario["reconnect_at"] if at < duration]
+        await asyncio.sleep(max(0.0, t0 + duration - time.time()))
+        for table in opened:
+            await table.close()
+        await asyncio.wait(tasks, timeout=ACTION_TIMEOUT)
+        for task in tasks:
+            task.cancel()
+
+    asyncio.run(main())
+    return {"samples": recorder.samples, "broadcasts": recorder.broadcasts, "errors": recorder.errors}
+
+
+def create_table(base_url, game, scenario):
+    """Guests and a game over HTTP, like the frontend does before it opens the socket."""
+    guests = [_request(base_url, "POST", "/user/guest") for _ in range(scenario["players"])]
+    body = {"type": game, **scenario["settings"]}
+    game_id = _request(base_url, "POST", "/game", body, guests[0]["jwt_token"])["id"]
+    return {"game": game, "game_id": game_id, "guests": guests}
+
+
+def _percentiles(values):
+    p = statistics.quantiles(values, n=100) if len(values) > 1 else values * 99
+    return p[49] * 1000, p[94] * 1000, p[98] * 1000
+
+
+def report(name, results, stages, duration):
+    samples = [sample for result in results for sample in result["samples"]]
+    broadcasts = defaultdict(list)
+    for result in results:
+        for action, latency in result["broadcasts"]:
+            broadcasts[action].append(latency)
+    errors = [error for result in results for error in result["errors"]]
+    latencies = defaultdict(list)
+    for action, _, latency in samples:
+        latencies[action].append(latency)
+    error_counts = Counter(action for action, _, _ in errors)
+
+    actions = sum(len(values) for action, values in latencies.items() if action not in ("connect", "reconnect"))
+    print(f"{name}: {actions} actions in {duration:.0f} s -> {actions / duration:.0f} actions/s, "
+          f"{len(errors)} errors ({len(errors) / max(1, actions + len(errors)):.2%})")
+    print(f"  {'action':<22} {'count':>7} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'all p95':>8} {'all p99':>8}")
+    for action in sorted(set(latencies) | set(error_counts)):
+        values = latencies.get(action, [])
+        p50, p95, p99 = _percentiles(values) if values else (0.0, 0.0, 0.0)
+        all_p95, all_p99 = _percentiles(broadcasts[action])[1:] if broadcasts[action] else (0.0, 0.0)
+        print(f"  {action:<22} {len(values):>7} {error_counts[action]:>7} {p50:>8.1f} {p95:>8.1f} {p99:>8.1f} "
+              f"{all_p95:>8.1f} {all_p99:>8.1f}")
+    for (action, error), count in Counter((action, error) for action, error, _ in errors).most_common(10):
+        print(f"  {count:>7} x {action}: {error}")
+
+    print(f"  {'stage':<6} {'tables':>6} {'seconds':>11} {'actions/s':>10} {'p95 ms':>8} {'errors':>7}")
+    tables = 0
+    for i, (start, end, offsets) in enumerate(stages):
+        tables += len(offsets)
+        values = [latency for action, at, latency in samples
+                  if start <= at < end and action not in ("connect", "reconnect")]
+        failed = sum(1 for _, _, at in errors if start <= at < end)
+        p95 = _percentiles(values)[1] if values else 0.0
+        print(f"  {i + 1:<6} {tables:>6} {start:>5.0f}-{end:<5.0f} {len(values) / max(end - start, 1e-9):>10.0f} "
+              f"{p95:>8.1f} {failed:>7}")
+    return errors
+
+
+def boot(port, database_url):
+    """Starts the app with uvicorn in a temporary directory (its own ``game.db``), returns the process and directory."""
+    app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    os.symlink(os.path.join(app_dir, "static"), os.path.join(workdir, "static"))
+    env = {**os.environ, "LOG_LEVEL": "WARNING"}
+    if database_url:
+        env["SQLALCHEMY_DATABASE_URI"] = database_url
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--app-dir", app_dir, "--port", str(port)],
+        cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env
+    )
+    _wait_for_port(port)
+    return server, workdir
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenario", default="play", help="JSON file or name in benchmarks/scenarios")
+    parser.add_argument("--url", help="test a running server instead of starting one")
+    parser.add_argument("--database-url", help="SQLALCHEMY_DATABASE_URI of the started server, default: SQLite")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--clients", type=int, default=4, help="client processes")
+    args = parser.parse_args()
+
+    scenario = load_scenario(args.scenario)
+    stages, duration = schedule(scenario)
+    offsets = [offset for _, _, stage_offsets in stages for offset in stage_offsets]
+    games = [scenario["games"][i % len(scenario["games"])] for i in range(len(offsets))]
+
+    server, workdir = (None, None) if args.url else boot(args.port, args.database_url)
+    base_url = args.url or f"http://127.0.0.1:{args.port}"
+    try:
+        with ThreadPoolExecutor(SETUP_THREADS) as pool:
+            specs = list(pool.map(lambda game: create_table(base_url, game, scenario), games))
+        tables = list(zip(offsets, specs))
+        clients = max(1, min(args.clients, len(tables)))
+        t0 = time.time() + 1.0  # die Client-Prozesse brauchen einen Moment zum Starten
+        with ProcessPoolExecutor(clients) as pool:
+            results = list(pool.map(run_client, [base_url] * clients, [tables[i::clients] for i in range(clients)],
+                                    [scenario] * clients, [t0] * clients, [duration] * clients))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+            shutil.rmtree(workdir, ignore_errors=True)
+    errors = report(args.scenario, results, stages, duration)
+    raise SystemExit(1 if any(action == "socket" or error == "timeout" for action, error, _ in errors) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Headless simulator: plays complete Mau Mau and Lügen games against the real rules engines.
+
+Every game goes through ``game_decision`` with fake connections and the bots of ``benchmarks/engine.py``, the games
+are spread over a process pool. After every action the simulator checks invariants of the game: no card is lost or
+duplicated, the seating ring holds exactly the players and the current player is one of them. A game that breaks an
+invariant, raises, or where the engine rejects a move the bot considers legal counts as failed and is reported with
+its seed; ``--seed <seed> --games 1`` plays it again alone. Reports games/s, actions/s and latency percentiles per
+action (for capacity planning, the time of ``game_decision`` including encoding the messages). Run from the ``app``
+directory:
+
+    python -m benchmarks.simulate --game lügen --games 2000 --policy random
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.engine import Table, play_lügen, play_maumau
+from logic import lügen, maumau
+from util.cards import hand_size
+from util.seating import SEATING, seating_order
+
+GAMES = {
+    "maumau": (maumau, {"number_of_start_cards": 5}),
+    "lügen":  (lügen, {"number_of_start_cards": 0}),
+}
+POLICIES = ("scripted", "random")
+
+
+async def play(game, policy, table):
+    if game == "maumau":
+        await play_maumau(table, choose=random.choice if policy == "random" else None)
+    else:
+        await play_lügen(table, challenge_rate=random.uniform(0.05, 0.9) if policy == "random" else 0.3)
+
+
+def check_invariants(table):
+    """An error message if the game state is broken after an action, None otherwise."""
+    state, players = table.state, table.players
+    if not state.get("started"):
+        return None
+    deck_size = table.settings["deck_size"]
+    # Mau-Mau-Hände sind Kartenlisten, Lügen-Hände Zähl-Arrays
+    size = len if table.engine is maumau else hand_size
+    cards = sum(size(player["hand"]) for player in players.values())
+    cards += len(state["draw_pile"]) + len(state["discard_pile"])
+    cards += len(state.get("removed_pile", ())) * (4 if deck_size in (32, 52) else 8)
+    if cards != deck_size:
+        return f"{cards} cards in the game instead of {deck_size}"
+    if SEATING in state and sorted(seating_order(state, players)) != sorted(players):
+        return f"seating {seating_order(state, players)} does not match the players {sorted(players)}"
+    if state["current_player"] not in players:
+        return f"current player {state['current_player']} is not in the game"
+    return None
+
+
+def play_games(game, policy, seeds, settings, players, max_actions):
+    """One worker: plays a game per seed, returns counts, timings per action and the failed games."""
+    engine, game_settings = GAMES[game]
+    timings = defaultdict(list)
+    result = {"games": 0, "actions": 0, "capped": 0, "failures": []}
+
+    def after_action(table):
+        table.actions += 1
+        if max_actions and table.actions >= max_actions and not table.ended:
+            table.ended = True  # the bots would go on forever (or just very long), the game counts as played
+            result["capped"] += 1
+        return check_invariants(table)
+
+    loop = asyncio.new_event_loop()
+    for seed in seeds:
+        random.seed(seed)
+        table = Table(engine, {**game_settings, **settings}, players)
+        table.actions = 0
+        table.after_action = after_action
+        loop.run_until_complete(play(game, policy, table))
+        result["games"] += 1
+        if table.error:
+            result["failures"].append((seed, table.error))
+        for action, values in table.timings.items():
+            timings[action].extend(value * 1e6 for value in values)
+            result["actions"] += len(values)
+    loop.close()
+    result["timings"] = dict(timings)
+    return result
+
+
+def report(game, policy, results, elapsed):
+    games = sum(result["games"] for result in results)
+    actions = sum(result["actions"] for result in results)
+    failures = [failure for result in results for failure in result["failures"]]
+    timings = defaultdict(list)
+    for result in results:
+        for action, values in result["timings"].items():
+            timings[action].extend(values)
+
+    print(f"{game} ({policy}): {games} games, {actions} actions in {elapsed:.1f} s -> {games / elapsed:.1f} games/s, "
+          f"{actions / elapsed:.0f} actions/s, {sum(result['capped'] for result in results)} capped, "
+          f"{len(failures)} failed")
+    print(f"  {'action':<22} {'count':>8} {'p50 µs':>8} {'p90 µs':>8} {'p99 µs':>8} {'max µs':>9}")
+    for action, values in sorted(timings.items()):
+        p = statistics.quantiles(values, n=100) if len(values) > 1 else values * 99
+        print(f"  {action:<22} {len(values):>8} {p[49]:>8.1f} {p[89]:>8.1f} {p[98]:>8.1f} {max(values):>9.1f}")
+    for seed, error in failures[:10]:
+        print(f"  seed {seed}: {error.strip().splitlines()[-1] if error.strip() else error}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--game", choices=sorted(GAMES), nargs="+", default=sorted(GAMES))
+    parser.add_argument("--policy", choices=POLICIES, default="scripted")
+    parser.add_argument("--games", type=int, default=1000, help="games per game type")
+    parser.add_argument("--players", type=int, default=4)
+    parser.add_argument("--deck-size", type=int, choices=[32, 52, 64, 104], default=104)
+    parser.add_argument("--gamemode", choices=["gamemode_classic", "gamemode_alternative"],
+                        default="gamemode_alternative")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the first game, the others follow")
+    parser.add_argument("--max-actions", type=int, default=5000, help="per game, 0: no limit")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    settings = {"max_players": max(8, args.players), "deck_size": args.deck_size, "gamemode": args.gamemode}
+    seeds = range(args.seed, args.seed + args.games)
+    chunks = [seeds[i::args.workers] for i in range(args.workers) if seeds[i::args.workers]]
+    failed = False
+    with ProcessPoolExecutor(len(chunks)) as pool:
+        for game in args.game:
+            start = time.perf_counter()
+            results = list(pool.map(play_games, [game] * len(chunks), [args.policy] * len(chunks), chunks,
+                                    [settings] * len(chunks), [args.players] * len(chunks),
+                                    [args.max_actions] * len(chunks)))
+            failed |= bool(report(game, args.policy, results, time.perf_counter() - start))
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Payload size and encode time of the JSON and the MessagePack wire format (``util/wire.py``).
+
+Uses the messages of a typical Mau Mau turn and of a Lügen challenge, after which the loser takes the whole discard
+pile and gets a large ``hand`` message. "msgpack" packs the message directly, "transcode" is what the server does
+for a binary connection (decode its JSON frame once, then pack). Needs ``msgpack``. Run from the ``app`` directory:
+
+    python -m benchmarks.wire
+"""
+import timeit
+import uuid
+
+from util import codec, wire
+from util.cards import cards_to_wire, generate_card_deck
+
+NUMBER = 5000
+REPEAT = 5
+
+
+def maumau_turn(player_ids):
+    deck = cards_to_wire(generate_card_deck(32))
+    return [
+        {"action": "place_card_on_stack", "card": deck[0], "player": player_ids[0], "seq": 1760781600000042},
+        {"action": "card_count", "discard_pile_count": 12, "draw_pile_count": 9,
+         "hand_count": {pid: 5 for pid in player_ids}, "seq": 1760781600000043},
+        {"action": "hand", "hand": deck[1:6], "seq": 1760781600000044},
+        {"action": "turn", "player": player_ids[1], "turn_deadline": 1760781645.25, "seq": 1760781600000045},
+    ]
+
+
+def lügen_challenge(player_ids):
+    deck = cards_to_wire(generate_card_deck(104))
+    return [
+        {"action": "challenge", "opponent": player_ids[0], "challenger": player_ids[1], "success": False,
+         "cards": deck[:3], "seq": 1760781600000042},
+        {"action": "hand", "hand": deck[3:58], "seq": 1760781600000043},
+        {"action": "card_count", "hand_count": {pid: 12 for pid in player_ids}, "seq": 1760781600000044},
+        {"action": "turn", "player": player_ids[2], "turn_deadline": 1760781645.25, "seq": 1760781600000045},
+    ]
+
+
+def per_message(function, messages):
+    return min(timeit.repeat(lambda: [function(message) for message in messages], repeat=REPEAT,
+                             number=NUMBER)) / NUMBER / len(messages)
+
+
+def bench(messages):
+    texts = [codec.dumps(message) for message in messages]
+    json_size = sum(len(text.encode()) for text in texts)
+    msgpack_size = sum(len(wire.packb(message)) for message in messages)
+    return {
+        "json_size":    json_size,
+        "msgpack_size": msgpack_size,
+        "json":         per_message(codec.dumps, messages),
+        "msgpack":      per_message(wire.packb, messages),
+        "transcode":    per_message(lambda text: wire.packb(codec.loads(text)), texts),
+    }
+
+
+def main():
+    if wire.msgpack is None:
+        raise SystemExit("msgpack is not installed")
+    player_ids = [str(uuid.uuid4()) for _ in range(4)]
+    print(f"JSON backend: {codec.BACKEND}")
+    print(f"{'turn':<16} {'json B':>7} {'msgpack B':>10} {'ratio':>6} {'json µs':>8} {'msgpack µs':>11} "
+          f"{'transcode µs':>13}")
+    for name, messages in (("maumau", maumau_turn(player_ids)), ("lügen challenge", lügen_challenge(player_ids))):
+        result = bench(messages)
+        print(f"{name:<16} {result['json_size']:>7} {result['msgpack_size']:>10} "
+              f"{result['msgpack_size'] / result['json_size']:>6.2f} {result['json'] * 1e6:>8.2f} "
+              f"{result['msgpack'] * 1e6:>11.2f} {result['transcode'] * 1e6:>13.2f}")
+
+
+if __name__ == "__main__":
+    main()
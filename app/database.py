@@ -1,7 +1,13 @@
 import os
 
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base
+from sqlalchemy.pool import NullPool
+
+# Prepared statements asyncpg keeps per connection for the recurring queries
+STATEMENT_CACHE_SIZE = int(os.getenv('DB_STATEMENT_CACHE_SIZE', '500'))
 
 if os.environ.get("SQLALCHEMY_DATABASE_URI"):
     engine = create_engine(
@@ -10,10 +16,26 @@ if os.environ.get("SQLALCHEMY_DATABASE_URI"):
         max_overflow=20,
         pool_pre_ping=True
     )
+    async_url = make_url(os.environ.get("SQLALCHEMY_DATABASE_URI"))
+    if async_url.get_backend_name() == "postgresql":
+        async_url = async_url.set(drivername="postgresql+asyncpg").update_query_dict(
+            {"prepared_statement_cache_size": str(STATEMENT_CACHE_SIZE)}
+        )
+    async_engine = create_async_engine(
+        async_url,
+        pool_size=100,
+        max_overflow=20,
+        pool_pre_ping=True
+    )
 else:
     engine = create_engine(
         "sqlite:///./game.db",
         connect_args={"check_same_thread": False},
     )
+    # aiosqlite connections belong to the event loop that opened them, so they are not pooled
+    async_engine = create_async_engine("sqlite+aiosqlite:///./game.db", poolclass=NullPool)
+
+# Sessions for the routers and the game socket, the sync engine only creates the tables and cron jobs at startup
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 
 Base = declarative_base()
@@ -3,34 +3,59 @@ import os
 import jwt
 from fastapi import Depends, HTTPException
 from fastapi.security import APIKeyHeader
-from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy import bindparam, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from database import engine
+from database import AsyncSessionLocal
 from models.user import UserModel
+from util.auth_cache import Principal, principal_cache
+from util.broker import broker
 
 SECRET_KEY = os.getenv('SECRET_KEY', 'default_secret_key')
 AUDIENCE = os.getenv('AUDIENCE', 'PP-CGA-BE')
 
+# Only the columns of a Principal, the profile picture is not loaded. Built once so the compiled statement is cached
+PRINCIPAL_BY_ID = select(UserModel.id, UserModel.username, UserModel.guest).where(UserModel.id == bindparam("user_id"))
 
-def get_db():
-    db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
-    try:
+
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
-def verify_jwt(
-        db: Session = Depends(get_db),
+async def verify_jwt(
+        db: AsyncSession = Depends(get_db),
         token: str = Depends(APIKeyHeader(name='Authorization'))
-):
+) -> Principal:
+    # Bereits geprüfte Tokens brauchen weder Signaturprüfung noch Datenbank
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"], audience=AUDIENCE)
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Invalid Token")
 
-    user = db.query(UserModel).filter_by(id=payload.get("sub")).first()
-    if user is None:
+    row = (await db.execute(PRINCIPAL_BY_ID, {"user_id": payload.get("sub")})).first()
+    if row is None:
         raise HTTPException(status_code=401, detail="User not found")
 
+    principal = Principal(row.id, row.username, row.guest)
+    principal_cache.put(token, principal, payload.get("exp"))
+    return principal
+
+
+def invalidate_user(user_id):
+    """Drops the cached tokens of a user in this process and, through the broker, in all others."""
+    principal_cache.invalidate_user(user_id)
+    broker.invalidate_user(user_id)
+
+
+async def get_current_user(db: AsyncSession = Depends(get_db), principal: Principal = Depends(verify_jwt)) -> UserModel:
+    """The complete database row of the authenticated user, only for endpoints that change it."""
+    user = await db.get(UserModel, principal.id)
+    if user is None:
+        invalidate_user(principal.id)
+        raise HTTPException(status_code=401, detail="User not found")
     return user
@@ -1,11 +1,31 @@
+import random
 import time
-from typing import Dict, Any, Tuple
-
-from util.generic import send_to_all
+from types import SimpleNamespace
+from typing import Dict, Any, Optional, Tuple
+
+from util.cards import (
+    VALUE_A,
+    VALUES,
+    add_cards,
+    cards_to_wire,
+    from_wire,
+    hand_cards,
+    hand_size,
+    hand_to_wire,
+    new_hand,
+    remove_card,
+    remove_value,
+    value_count,
+    value_of
+)
+from util.changes import players_changed, state_changed
 from util.lügen import (
     generate_card_deck,
     get_next_player
 )
+from util.outbox import Outbox, deliver
+from util.seating import seat_players, seating_order, unseat_player
+from util.timers import turn_deadline
 
 # ============================================================
 # Konstanten und Schlüssel
@@ -80,6 +100,7 @@ DISCARD_PILE_COUNT = "discard_pile_count"
 LAST_PLAYER = "last_player"
 N_LAST = "n_last"
 TURN_START_TIME = "turn_start_time"
+TURN_DEADLINE = "turn_deadline"
 
 SETTING_MAX_PLAYERS = "max_players"
 SETTING_DECK_SIZE = "deck_size"
@@ -106,9 +127,9 @@ INIT_STATE = {
 # ============================================================
 # Hilfsfunktionen
 # ============================================================
-async def send_error(websocket, error_msg: str) -> None:
-    """Sende eine Fehlermeldung an einen bestimmten Websocket."""
-    await websocket.send_json({ERROR: error_msg})
+def send_error(outbox: Outbox, error_msg: str) -> None:
+    """Sende eine Fehlermeldung an die Verbindung, von der die Aktion kam."""
+    outbox.reply({ERROR: error_msg})
 
 
 def all_players_ready(players: Dict[str, Dict[str, Any]]) -> bool:
@@ -124,15 +145,45 @@ def remove_player(players: Dict[str, Dict[str, Any]], user_id: str) -> None:
 
 def get_hand_counts(players: Dict[str, Dict[str, Any]]) -> Dict[str, int]:
     """Erstellt ein Mapping von PlayerID zu Anzahl Karten auf der Hand."""
-    return {pid: len(data[HAND]) for pid, data in players.items()}
+    return {pid: hand_size(data[HAND]) for pid, data in players.items()}
+
+
+def ace_loser(players: Dict[str, Dict[str, Any]], settings: Dict[str, Any], player_ids) -> Optional[str]:
+    """Der Spieler unter ``player_ids``, der alle Asse hat und damit im klassischen Modus verliert."""
+    if settings[SETTINGS_GAMEMODE] != SETTINGS_GAMEMODE_OPTIONS_CLASSIC:
+        return None
+    required_aces = 4 if settings[SETTING_DECK_SIZE] in [32, 52] else 8
+    return next((pid for pid in player_ids if value_count(players[pid][HAND], VALUE_A) == required_aces), None)
+
+
+def discard_duplicates(
+        outbox: Outbox,
+        state: Dict[str, Any],
+        players: Dict[str, Dict[str, Any]],
+        settings: Dict[str, Any],
+        changed: Dict[str, Any]
+) -> None:
+    """
+    Sagt 4 gleiche (32/52 Karten) bzw. 8 gleiche (64/104 Karten) an und entfernt sie. Geprüft werden nur die Werte,
+    die auf einer Hand dazugekommen sind (``changed``: PlayerID -> Werte).
+    """
+    complete = 4 if settings[SETTING_DECK_SIZE] in [32, 52] else 8
+    for pid, values in changed.items():
+        hand = players[pid][HAND]
+        for value in sorted(values):
+            if value_count(hand, value) == complete:
+                remove_value(hand, value)
+                state[REMOVED_PILE].append(VALUES[value])
+                state_changed(REMOVED_PILE)
+                players_changed(pid)
+                outbox.to_all({ACTION: ACTION_DISCARD_DUPLICATES, VALUE: VALUES[value], PLAYER: pid})
 
 
 # ============================================================
 # Action-Handler-Funktionen
 # ============================================================
-async def handle_join(
-        websocket,
-        websocket_connections,
+def handle_join(
+        outbox: Outbox,
         message: Dict[str, Any],
         state: Dict[str, Any],
         players: Dict[str, Dict[str, Any]],
@@ -142,28 +193,29 @@ async def handle_join(
     """Behandelt das Joinen eines neuen Spielers."""
     # Validierung
     if len(message) != 0:
-        await send_error(websocket, ERROR_WRONG_DATA)
+        send_error(outbox, ERROR_WRONG_DATA)
         return state, players
 
     if user.id in players:
-        await send_error(websocket, ERROR_PLAYER_ALREADY_JOINED)
+        send_error(outbox, ERROR_PLAYER_ALREADY_JOINED)
         return state, players
 
     if state[STARTED]:
-        await send_error(websocket, ERROR_GAME_ALREADY_STARTED)
+        send_error(outbox, ERROR_GAME_ALREADY_STARTED)
         return state, players
 
     if len(players) == settings[SETTING_MAX_PLAYERS]:
-        await send_error(websocket, ERROR_GAME_FULL)
+        send_error(outbox, ERROR_GAME_FULL)
         return state, players
 
     players[user.id] = {
         READY:         False,
-        HAND:          [],
+        HAND:          new_hand(),
         JOIN_SEQUENCE: len(players) + 1
     }
+    players_changed(user.id)
 
-    await send_to_all(websocket_connections, {
+    outbox.to_all({
         ACTION:  ACTION_JOIN,
         PLAYER:  user.id,
         PLAYERS: list(players.keys())
@@ -171,9 +223,8 @@ async def handle_join(
     return state, players
 
 
-async def handle_ready(
-        websocket,
-        websocket_connections,
+def handle_ready(
+        outbox: Outbox,
         message: Dict[str, Any],
         state: Dict[str, Any],
         players: Dict[str, Dict[str, Any]],
@@ -183,30 +234,31 @@ async def handle_ready(
     """Setzt den Status READY für einen Spieler und startet ggf. das Spiel."""
     # Validierung
     if user.id not in players:
-        await send_error(websocket, ERROR_NOT_IN_LOBBY)
+        send_error(outbox, ERROR_NOT_IN_LOBBY)
         return state, players
     
     if len(message) != 1:
-        await send_error(websocket, ERROR_WRONG_DATA)
+        send_error(outbox, ERROR_WRONG_DATA)
         return state, players
 
     if READY not in message:
-        await send_error(websocket, ERROR_NO_READY_PROVIDED)
+        send_error(outbox, ERROR_NO_READY_PROVIDED)
         return state, players
 
     if message[READY] not in [True, False]:
-        await send_error(websocket, ERROR_WRONG_READY_VALUE)
+        send_error(outbox, ERROR_WRONG_READY_VALUE)
         return state, players
 
     if state[STARTED]:
-        await send_error(websocket, ERROR_GAME_ALREADY_STARTED)
+        send_error(outbox, ERROR_GAME_ALREADY_STARTED)
         return state, players
 
     # Setze Ready-Status
     players[user.id][READY] = message[READY]
+    players_changed(user.id)
 
     # Informiere alle über den neuen Ready-Status
-    await send_to_all(websocket_connections, {
+    outbox.to_all({
         ACTION:  ACTION_READY,
         PLAYER:  user.id,
         READY:   message[READY],
@@ -227,81 +279,61 @@ async def handle_ready(
             state[DISCARD_PILE] = []
             state[REMOVED_PILE] = []
 
-            # Karten austeilen
+            # Karten austeilen, hat ein Spieler alle Asse, wird neu gegeben
             cards_count = settings[SETTING_DECK_SIZE] // len(players)
             extra_card = settings[SETTING_DECK_SIZE] % len(players)
+            valid_distribution = True
             for pid in players:
                 player_cards = cards_count + (1 if extra_card > 0 else 0)
-                players[pid][HAND] = state[DRAW_PILE][:player_cards]
+                players[pid][HAND] = new_hand(state[DRAW_PILE][:player_cards])
                 players[pid][LAST_ACTION] = ACTION_READY
                 state[DRAW_PILE] = state[DRAW_PILE][player_cards:]
                 extra_card -= 1
 
-                num_aces = sum(1 for card in players[pid][HAND] if card[VALUE] == CARD_VALUE_A)
+                num_aces = value_count(players[pid][HAND], VALUE_A)
                 if num_aces == 4 and settings[SETTING_DECK_SIZE] in [32, 52]:
                     valid_distribution = False
-                    players[pid][HAND] = []
                 elif num_aces == 8 and settings[SETTING_DECK_SIZE] in [64, 104]:
                     valid_distribution = False
-                    players[pid][HAND] = []
-                else:
-                    valid_distribution = True
 
-            if valid_distribution:
-                break
+        seat_players(state, players)
+        state_changed()
+        players_changed()
 
         # 4/8-gleiche werden angesagt und entfernt
-        for pid in players:
-            value_counts = {}
-            for card in players[pid][HAND]:
-                value = card['value']
-                if value in value_counts:
-                    value_counts[value] += 1
-                else:
-                    value_counts[value] = 1
-            for value, count in value_counts.items():
-                if count == 4 and settings[SETTING_DECK_SIZE] in [32, 52]:
-                    players[pid][HAND] = [card for card in players[pid][HAND] if card['value'] != value]
-                    state[REMOVED_PILE].append(value)
-                    await send_to_all(websocket_connections,
-                                      {ACTION: ACTION_DISCARD_DUPLICATES, VALUE: value, PLAYER: pid})
-                elif count == 8 and settings[SETTING_DECK_SIZE] in [64, 104]:
-                    players[pid][HAND] = [card for card in players[pid][HAND] if card['value'] != value]
-                    state[REMOVED_PILE].append(value)
-                    await send_to_all(websocket_connections,
-                                      {ACTION: ACTION_DISCARD_DUPLICATES, VALUE: value, PLAYER: pid})
+        discard_duplicates(outbox, state, players, settings, {pid: range(len(VALUES)) for pid in players})
 
         # Sende Start-Info
-        await send_to_all(websocket_connections, {
+        outbox.to_all({
             ACTION: ACTION_START
         })
 
         for pid in players:
             # Jeder bekommt seine Handkarten
-            await websocket_connections[pid].send_json({
+            outbox.to_player(pid, {
                 ACTION: ACTION_HAND,
-                HAND:   players[pid][HAND]
+                HAND:   hand_to_wire(players[pid][HAND])
             })
 
         # Sende Karten-Zusammenfassung
-        await send_to_all(websocket_connections, {
+        outbox.to_all({
             ACTION:     ACTION_CARD_COUNT,
             HAND_COUNT: get_hand_counts(players)
         })
 
         # Nächster Zug
-        await send_to_all(websocket_connections, {
-            ACTION: ACTION_TURN,
-            PLAYER: state[CURRENT_PLAYER]
+        outbox.to_all({
+            ACTION:        ACTION_TURN,
+            PLAYER:        state[CURRENT_PLAYER],
+            TURN_DEADLINE: turn_deadline(state)
         })
 
     return state, players
 
 
 # noinspection PyUnusedLocal
-async def handle_leave_lobby(
-        websocket,
-        websocket_connections,
+def handle_leave_lobby(
+        outbox: Outbox,
         message: Dict[str, Any],
         state: Dict[str, Any],
         players: Dict[str, Dict[str, Any]],
@@ -310,16 +342,17 @@ async def handle_leave_lobby(
 ) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
     """Ermöglicht das Verlassen der Lobby, falls das Spiel noch nicht gestartet ist."""
     if len(message) != 0:
-        await send_error(websocket, ERROR_WRONG_DATA)
+        send_error(outbox, ERROR_WRONG_DATA)
         return state, players
 
     if state[STARTED]:
-        await send_error(websocket, ERROR_GAME_ALREADY_STARTED)
+        send_error(outbox, ERROR_GAME_ALREADY_STARTED)
         return state, players
 
     remove_player(players, user.id)
+    players_changed(user.id)
 
-    await send_to_all(websocket_connections, {
+    outbox.to_all({
         ACTION:  ACTION_LEAVE_LOBBY,
         PLAYER:  user.id,
         PLAYERS: list(players.keys())
@@ -328,9 +361,8 @@ async def handle_leave_lobby(
 
 
 # noinspection PyUnusedLocal
-async def handle_request_lobby_data(
-        websocket,
-        websocket_connections,
+def handle_request_lobby_data(
+        outbox: Outbox,
         message: Dict[str, Any],
         state: Dict[str, Any],
         players: Dict[str, Dict[str, Any]],
@@ -339,11 +371,11 @@ async def handle_request_lobby_data(
 ) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
     """Liefert Lobby-Daten an den anfragenden Spieler."""
     if len(message) != 0:
-        await send_error(websocket, ERROR_WRONG_DATA)
+        send_error(outbox, ERROR_WRONG_DATA)
         return state, players
 
     # Sende Ready-Status aller Spieler
-    await websocket.send_json({
+    outbox.reply({
         ACTION:  ACTION_LOBBY_DATA,
         PLAYERS: {pid: player_data[READY] for pid, player_data in players.items()}
     })
@@ -351,9 +383,8 @@ async def handle_request_lobby_data(
 
 
 # noinspection PyUnusedLocal
-async def handle_request_game_data(
-        websocket,
-        websocket_connections,
+def handle_request_game_data(
+        outbox: Outbox,
         message: Dict[str, Any],
         state: Dict[str, Any],
         players: Dict[str, Dict[str, Any]],
@@ -362,19 +393,19 @@ async def handle_request_game_data(
 ) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
     """Gibt Spiel-Daten zurück (Anzahl der Handkarten, letzte abgelegte Karte etc.)."""
     if len(message) != 0:
-        await send_error(websocket, ERROR_WRONG_DATA)
+        send_error(outbox, ERROR_WRONG_DATA)
         return state, players
 
     if not state[STARTED]:
-        await send_error(websocket, ERROR_GAME_NOT_STARTED)
+        send_error(outbox, ERROR_GAME_NOT_STARTED)
         return state, players
 
-    sorted_players = sorted(players.keys(), key=lambda pid: players[pid]['join_sequence'])
-    await websocket.send_json({
+    outbox.reply({
         ACTION:         ACTION_GAME_DATA,
-        PLAYERS:        {pid: len(players[pid][HAND]) for pid in sorted_players},
+        PLAYERS:        {pid: hand_size(players[pid][HAND]) for pid in seating_order(state, players)},
         CURRENT_PLAYER: state[CURRENT_PLAYER],
-        HAND:           players[user.id][HAND],
+        TURN_DEADLINE:  turn_deadline(state),
+        HAND:           hand_to_wire(players[user.id][HAND]),
         DISCARD_PILE_COUNT:   len(state[DISCARD_PILE]),
         REMOVED_PILE:   state[REMOVED_PILE],
         ROUND_VALUE:    state[ROUND_VALUE],
@@ -385,9 +416,8 @@ async def handle_request_game_data(
 
 
 # noinspection PyUnusedLocal
-async def place_cards(
-        websocket,
-        websocket_connections,
+def place_cards(
+        outbox: Outbox,
         message: Dict[str, Any],
         state: Dict[str, Any],
         players: Dict[str, Dict[str, Any]],
@@ -397,11 +427,11 @@ async def place_cards(
     """Ermöglicht es einem Spieler, eine Karte abzulegen."""
     # Validierung
     if CARDS not in message:
-        await send_error(websocket, ERROR_NO_CARDS_PROVIDED)
+        send_error(outbox, ERROR_NO_CARDS_PROVIDED)
         return state, players
 
     if CLAIMED_VALUE not in message:
-        await send_error(websocket, ERROR_NO_CLAIMED_VALUE_PROVIDED)
+        send_error(outbox, ERROR_NO_CLAIMED_VALUE_PROVIDED)
         return state, players
 
     # vars setzen
@@ -411,22 +441,26 @@ async def place_cards(
     # max. 3 cards with 32/52 deck, max. 7 cards with 64/104 deck
     if (settings[SETTING_DECK_SIZE] in [32, 52] and len(cards) > 3) or (
             settings[SETTING_DECK_SIZE] in [64, 104] and len(cards) > 7):
-        await send_error(websocket, ERROR_TOO_MANY_CARDS)
+        send_error(outbox, ERROR_TOO_MANY_CARDS)
         return state, players
 
     # win-check for last player
     last_player_id = state[LAST_PLAYER]
-    if last_player_id and not players[last_player_id][HAND]:
+    if last_player_id and hand_size(players[last_player_id][HAND]) == 0:
         players.pop(last_player_id)
+        unseat_player(state, last_player_id)
         state[WINNER].append(last_player_id)
-        await send_to_all(websocket_connections, {
+        state[LAST_PLAYER] = None  # der Gewinner ist nicht mehr im Spiel
+        state_changed(WINNER, LAST_PLAYER)
+        players_changed(last_player_id)
+        outbox.to_all({
             ACTION: ACTION_WIN,
             PLAYER: last_player_id
         })
         # Wenn nur noch 2 Spieler übrig ist -> Spielende
         if len(players) == 2:
             winner = state[WINNER][0] if state[WINNER] else None
-            await send_to_all(websocket_connections, {
+            outbox.to_all({
                 ACTION: ACTION_END,
                 REASON: "only_two_players_left",
                 WINNER: winner
@@ -435,6 +469,8 @@ async def place_cards(
             state = INIT_STATE.copy()
 
             players = {}
+            state_changed()
+            players_changed()
 
             return state, players
 
@@ -443,40 +479,45 @@ async def place_cards(
     if settings[SETTING_DECK_SIZE] in [52, 104]:
         values += ['2', '3', '4', '5', '6']
     if claimed_value not in values:
-        await send_error(websocket, ERROR_VALUE_NOT_POSSIBLE)
+        send_error(outbox, ERROR_VALUE_NOT_POSSIBLE)
         return state, players
 
     # du kannst kein Ass sagen
     if settings[SETTINGS_GAMEMODE] == SETTINGS_GAMEMODE_OPTIONS_CLASSIC:
         if claimed_value == CARD_VALUE_A:
-            await send_error(websocket, ERROR_VALUE_NOT_POSSIBLE)
+            send_error(outbox, ERROR_VALUE_NOT_POSSIBLE)
             return state, players
 
     # Check, ob Karten tatsächlich in der Hand ist
+    cards = [from_wire(card) for card in cards]
+    hand = players[user.id][HAND]
     for card in cards:
-        if card not in players[user.id][HAND]:
-            await send_error(websocket, ERROR_CARD_NOT_IN_HAND)
+        if card is None or cards.count(card) > hand[card]:
+            send_error(outbox, ERROR_CARD_NOT_IN_HAND)
             return state, players
 
     # Set round_value if not existent
     if state[ROUND_VALUE] is None:
         state[ROUND_VALUE] = claimed_value
+        state_changed(ROUND_VALUE)
     elif state[ROUND_VALUE] != claimed_value:
-        await send_error(websocket, ERROR_VALUE_NOT_POSSIBLE)
+        send_error(outbox, ERROR_VALUE_NOT_POSSIBLE)
         return state, players
 
     # Karten wird auf den Ablagestapel gelegt
     for card in cards:
         state[DISCARD_PILE].append(card)
-        players[user.id][HAND].remove(card)
+        remove_card(hand, card)
 
     # vars setzen
     state[N_LAST] = len(cards)
     state[LAST_PLAYER] = state[CURRENT_PLAYER]
-    state[CURRENT_PLAYER] = get_next_player(user.id, players)  # der nächste ist dran
+    state[CURRENT_PLAYER] = get_next_player(state, players, user.id)  # der nächste ist dran
+    state[TURN_START_TIME] = time.time()  # Timer neu starten bei Zugwechsel
+    state_changed(DISCARD_PILE, N_LAST, LAST_PLAYER, CURRENT_PLAYER, TURN_START_TIME)
 
     # Broadcast
-    await send_to_all(websocket_connections, {
+    outbox.to_all({
         ACTION:        ACTION_PLACE_CARDS,
         CLAIMED_VALUE: claimed_value,
         N_LAST:        state[N_LAST],
@@ -484,25 +525,26 @@ async def place_cards(
     })
 
     # Allen den neuen Karten-Count senden
-    await send_to_all(websocket_connections, {
+    outbox.to_all({
         ACTION:     ACTION_CARD_COUNT,
         HAND_COUNT: get_hand_counts(players)
     })
 
     # Nächster Zug
-    await send_to_all(websocket_connections, {
-        ACTION: ACTION_TURN,
-        PLAYER: state[CURRENT_PLAYER]
+    outbox.to_all({
+        ACTION:        ACTION_TURN,
+        PLAYER:        state[CURRENT_PLAYER],
+        TURN_DEADLINE: turn_deadline(state)
     })
 
     players[user.id][LAST_ACTION] = ACTION_PLACE_CARDS
+    players_changed(user.id)
     return state, players
 
 
 # noinspection PyUnusedLocal,DuplicatedCode
-async def challenge(
-        websocket,
-        websocket_connections,
+def challenge(
+        outbox: Outbox,
         message: Dict[str, Any],
         state: Dict[str, Any],
         players: Dict[str, Dict[str, Any]],
@@ -511,88 +553,73 @@ async def challenge(
 ) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
     """Ermöglicht das Ziehen der Strafkarten, wenn COUNT_7 > 0."""
     if len(message) != 0:
-        await send_error(websocket, ERROR_WRONG_DATA)
+        send_error(outbox, ERROR_WRONG_DATA)
         return state, players
 
-    if not state[DISCARD_PILE]:
-        await send_error(websocket, ERROR_CHALLENGE_NOT_POSSIBLE)
+    if not state[DISCARD_PILE] or state[LAST_PLAYER] not in players:
+        # Auch wenn der Spieler der letzten Karten schon gewonnen oder das Spiel verlassen hat
+        send_error(outbox, ERROR_CHALLENGE_NOT_POSSIBLE)
         return state, players
 
     # auswertung
     for card in state[DISCARD_PILE][-state[N_LAST]:]:
-        if card[VALUE] != state[ROUND_VALUE]:
+        if VALUES[value_of(card)] != state[ROUND_VALUE]:
             state[SUCCESS] = True
             break
         else:
             state[SUCCESS] = False
 
     # aufnehmen
-    if state[SUCCESS]:
-        players[state[LAST_PLAYER]][HAND].extend(state[DISCARD_PILE])
-    else:
-        players[user.id][HAND].extend(state[DISCARD_PILE])
+    taker = state[LAST_PLAYER] if state[SUCCESS] else user.id
+    add_cards(players[taker][HAND], state[DISCARD_PILE])
+    players_changed(taker)
+    state_changed(SUCCESS)
 
-    await send_to_all(websocket_connections, {
+    outbox.to_all({
         ACTION:     ACTION_CHALLENGE,
         OPPONENT:   state[LAST_PLAYER],
         CHALLENGER: user.id,
         SUCCESS:    state[SUCCESS],
-        CARDS:      state[DISCARD_PILE][-state[N_LAST]:]
+        CARDS:      cards_to_wire(state[DISCARD_PILE][-state[N_LAST]:])
     })
 
     # lose-check
-    if settings[SETTINGS_GAMEMODE] == SETTINGS_GAMEMODE_OPTIONS_CLASSIC:
-        required_aces = 4 if settings[SETTING_DECK_SIZE] in [32, 52] else 8
-        for pid in players:
-            num_aces = sum(1 for card in players[pid][HAND] if card[VALUE] == CARD_VALUE_A)
-
-            if num_aces == required_aces:
-                await send_to_all(websocket_connections, {
-                    ACTION: ACTION_END,
-                    REASON: "Pair of Aces",
-                    PLAYER: pid
-                })
+    loser = ace_loser(players, settings, [taker])
+    if loser:
+        outbox.to_all({
+            ACTION: ACTION_END,
+            REASON: "Pair of Aces",
+            PLAYER: loser
+        })
 
-                state = INIT_STATE.copy()
+        state = INIT_STATE.copy()
 
-                players = {}
+        players = {}
+        state_changed()
+        players_changed()
 
-                return state, players
+        return state, players
 
-    # 4/8-gleiche werden angesagt und entfernt
-    for pid in players:
-        value_counts = {}
-        for card in players[pid][HAND]:
-            value = card['value']
-            if value in value_counts:
-                value_counts[value] += 1
-            else:
-                value_counts[value] = 1
-        for value, count in value_counts.items():
-            if count == 4 and settings[SETTING_DECK_SIZE] in [32, 52]:
-                players[pid][HAND] = [card for card in players[pid][HAND] if card['value'] != value]
-                state[REMOVED_PILE].append(value)
-                await send_to_all(websocket_connections,
-                                  {ACTION: ACTION_DISCARD_DUPLICATES, VALUE: value, PLAYER: pid})
-            elif count == 8 and settings[SETTING_DECK_SIZE] in [64, 104]:
-                players[pid][HAND] = [card for card in players[pid][HAND] if card['value'] != value]
-                state[REMOVED_PILE].append(value)
-                await send_to_all(websocket_connections,
-                                  {ACTION: ACTION_DISCARD_DUPLICATES, VALUE: value, PLAYER: pid})
+    # 4/8-gleiche werden angesagt und entfernt (nur der Aufnehmende hat neue Karten)
+    discard_duplicates(outbox, state, players, settings, {taker: {value_of(card) for card in state[DISCARD_PILE]}})
 
     # win-check for last player
     last_player_id = state[LAST_PLAYER]
-    if last_player_id and not players[last_player_id][HAND]:
+    if last_player_id and hand_size(players[last_player_id][HAND]) == 0:
         players.pop(last_player_id)
+        unseat_player(state, last_player_id)
         state[WINNER].append(last_player_id)
-        await send_to_all(websocket_connections, {
+        state[LAST_PLAYER] = None  # der Gewinner ist nicht mehr im Spiel
+        state_changed(WINNER, LAST_PLAYER)
+        players_changed(last_player_id)
+        outbox.to_all({
             ACTION: ACTION_WIN,
             PLAYER: last_player_id
         })
         # Wenn nur noch 2 Spieler übrig ist -> Spielende
         if len(players) == 2:
             winner = state[WINNER][0] if state[WINNER] else None
-            await send_to_all(websocket_connections, {
+            outbox.to_all({
                 ACTION: ACTION_END,
                 REASON: "only_two_players_left",
                 WINNER: winner
@@ -601,40 +628,45 @@ async def challenge(
             state = INIT_STATE.copy()
 
             players = {}
+            state_changed()
+            players_changed()
 
             return state, players
 
     for pid in players:
-        await websocket_connections[pid].send_json({
+        outbox.to_player(pid, {
             ACTION: ACTION_HAND,
-            HAND:   players[pid][HAND]
+            HAND:   hand_to_wire(players[pid][HAND])
         })
 
-    await send_to_all(websocket_connections, {
+    outbox.to_all({
         ACTION:     ACTION_CARD_COUNT,
         HAND_COUNT: get_hand_counts(players)
     })
 
     if not state[SUCCESS]:
-        state[CURRENT_PLAYER] = get_next_player(user.id, players)  # der nächste ist dran
+        state[CURRENT_PLAYER] = get_next_player(state, players, user.id)  # der nächste ist dran
 
     players[user.id][LAST_ACTION] = ACTION_CHALLENGE
     state[ROUND_VALUE] = None
     state[N_LAST] = 0
     state[DISCARD_PILE] = []
-
-    await send_to_all(websocket_connections, {
-        ACTION: ACTION_TURN,
-        PLAYER: state[CURRENT_PLAYER]
+    state[TURN_START_TIME] = time.time()  # neue Runde, Timer neu starten
+    players_changed(user.id)
+    state_changed(CURRENT_PLAYER, ROUND_VALUE, N_LAST, DISCARD_PILE, TURN_START_TIME)
+
+    outbox.to_all({
+        ACTION:        ACTION_TURN,
+        PLAYER:        state[CURRENT_PLAYER],
+        TURN_DEADLINE: turn_deadline(state)
     })
 
     return state, players
 
 
 # noinspection PyUnusedLocal
-async def handle_leave_game(
-        websocket,
-        websocket_connections,
+def handle_leave_game(
+        outbox: Outbox,
         message: Dict[str, Any],
         state: Dict[str, Any],
         players: Dict[str, Dict[str, Any]],
@@ -643,19 +675,26 @@ async def handle_leave_game(
 ) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
     """Ermöglicht einem Spieler das Verlassen des laufenden Spiels."""
     if len(message) != 0:
-        await send_error(websocket, ERROR_WRONG_DATA)
+        send_error(outbox, ERROR_WRONG_DATA)
         return state, players
 
-    # Karten des Spielers kommen auf den Ablagestapel
-    state[DRAW_PILE] = players[user.id][HAND]
+    # Karten des Spielers kommen auf den Ablagestapel, gemischt (die Hand ist nach Farbe und Wert sortiert)
+    state[DRAW_PILE] = hand_cards(players[user.id][HAND])
+    random.shuffle(state[DRAW_PILE])
+    state_changed(DRAW_PILE)
     # Save possible next player before removal of current player
     next_player = None
     if state[CURRENT_PLAYER] == user.id:
-        next_player = get_next_player(user.id, players)
+        next_player = get_next_player(state, players, user.id)
 
     remove_player(players, user.id)
+    unseat_player(state, user.id)
+    players_changed(user.id)
+    if state[LAST_PLAYER] == user.id:
+        state[LAST_PLAYER] = None
+        state_changed(LAST_PLAYER)
 
-    await send_to_all(websocket_connections, {
+    outbox.to_all({
         ACTION:  ACTION_LEAVE_GAME,
         PLAYER:  user.id,
         PLAYERS: list(players.keys())
@@ -664,7 +703,7 @@ async def handle_leave_game(
     # Prüfen, ob nur ein Spieler übrig
     if len(players) == 2:
         winner = state[WINNER][0] if state[WINNER] else None
-        await send_to_all(websocket_connections, {
+        outbox.to_all({
             ACTION: ACTION_END,
             REASON: "only_two_players_left",
             WINNER: winner
@@ -673,6 +712,8 @@ async def handle_leave_game(
         state = INIT_STATE.copy()
 
         players = {}
+        state_changed()
+        players_changed()
 
         return state, players
 
@@ -680,68 +721,53 @@ async def handle_leave_game(
     if next_player:
         state[CURRENT_PLAYER] = next_player
         state[TURN_START_TIME] = time.time()  # Timer zurücksetzen, da Zugwechsel
-        await send_to_all(websocket_connections, {
-            ACTION: ACTION_TURN,
-            PLAYER: state[CURRENT_PLAYER]
+        state_changed(CURRENT_PLAYER, TURN_START_TIME)
+        outbox.to_all({
+            ACTION:        ACTION_TURN,
+            PLAYER:        state[CURRENT_PLAYER],
+            TURN_DEADLINE: turn_deadline(state)
         })
 
     # Karten austeilen
     cards_count = len(state[DRAW_PILE]) // len(players)
     extra_card = len(state[DRAW_PILE]) % len(players)
+    dealt = {}  # PlayerID -> Werte der erhaltenen Karten
     for pid in players:
         player_cards = cards_count + (1 if extra_card > 0 else 0)
-        players[pid][HAND].extend(state[DRAW_PILE][:player_cards])
+        add_cards(players[pid][HAND], state[DRAW_PILE][:player_cards])
+        dealt[pid] = {value_of(card) for card in state[DRAW_PILE][:player_cards]}
         state[DRAW_PILE] = state[DRAW_PILE][player_cards:]
+        players_changed(pid)
         extra_card -= 1
 
     # lose-check
-    if settings[SETTINGS_GAMEMODE] == SETTINGS_GAMEMODE_OPTIONS_CLASSIC:
-        required_aces = 4 if settings[SETTING_DECK_SIZE] in [32, 52] else 8
-        for pid in players:
-            num_aces = sum(1 for card in players[pid][HAND] if card[VALUE] == CARD_VALUE_A)
-
-            if num_aces == required_aces:
-                await send_to_all(websocket_connections, {
-                    ACTION: ACTION_END,
-                    REASON: "Pair of Aces",
-                    PLAYER: pid
-                })
+    loser = ace_loser(players, settings, dealt)
+    if loser:
+        outbox.to_all({
+            ACTION: ACTION_END,
+            REASON: "Pair of Aces",
+            PLAYER: loser
+        })
 
-                state = INIT_STATE.copy()
+        state = INIT_STATE.copy()
 
-                players = {}
+        players = {}
+        state_changed()
+        players_changed()
 
-                return state, players
+        return state, players
 
     # 4/8-gleiche werden angesagt und entfernt
-    for pid in players:
-        value_counts = {}
-        for card in players[pid][HAND]:
-            value = card['value']
-            if value in value_counts:
-                value_counts[value] += 1
-            else:
-                value_counts[value] = 1
-        for value, count in value_counts.items():
-            if count == 4 and settings[SETTING_DECK_SIZE] in [32, 52]:
-                players[pid][HAND] = [card for card in players[pid][HAND] if card['value'] != value]
-                state[REMOVED_PILE].append(value)
-                await send_to_all(websocket_connections,
-                                  {ACTION: ACTION_DISCARD_DUPLICATES, VALUE: value, PLAYER: pid})
-            elif count == 8 and settings[SETTING_DECK_SIZE] in [64, 104]:
-                players[pid][HAND] = [card for card in players[pid][HAND] if card['value'] != value]
-                state[REMOVED_PILE].append(value)
-                await send_to_all(websocket_connections,
-                                  {ACTION: ACTION_DISCARD_DUPLICATES, VALUE: value, PLAYER: pid})
+    discard_duplicates(outbox, state, players, settings, dealt)
 
     for pid in players:
-        await websocket_connections[pid].send_json({
+        outbox.to_player(pid, {
             ACTION: ACTION_HAND,
-            HAND:   players[pid][HAND]
+            HAND:   hand_to_wire(players[pid][HAND])
         })
 
     # Karten-Zusammenfassung
-    await send_to_all(websocket_connections, {
+    outbox.to_all({
         ACTION:     ACTION_CARD_COUNT,
         HAND_COUNT: get_hand_counts(players)
     })
@@ -750,32 +776,77 @@ async def handle_leave_game(
 
 
 # ============================================================
-# Hauptfunktion game_decision
+# Zugzeit abgelaufen
 # ============================================================
-async def game_decision(
-        websocket,
+def apply_turn_timeout(
+        state: Dict[str, Any],
+        players: Dict[str, Dict[str, Any]],
+        settings: Dict[str, Any],
+        player_id: str
+) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]], Outbox]:
+    """Zugzeit abgelaufen: der Spieler verlässt das Spiel als Strafe (reine Spiellogik, wie ``apply``)."""
+    outbox = Outbox()
+    outbox.to_all({
+        ACTION: ACTION_TIMEOUT_PENALTY,
+        PLAYER: player_id
+    })
+    state, players = handle_leave_game(outbox, {}, state, players, settings, SimpleNamespace(id=player_id))
+    return state, players, outbox
+
+
+async def handle_turn_timeout(
         websocket_connections,
+        state: Dict[str, Any],
+        players: Dict[str, Dict[str, Any]],
+        settings: Dict[str, Any],
+        player_id: str
+) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
+    """Wird vom Timer ausgelöst, wenn die Zugzeit abgelaufen ist, und verschickt die Nachrichten."""
+    state, players, outbox = apply_turn_timeout(state, players, settings, player_id)
+    await deliver(outbox, None, websocket_connections)
+    return state, players
+
+
+# ============================================================
+# Hauptfunktion game_decision
+# ============================================================
+def apply(
         message: Dict[str, Any],
         state: Dict[str, Any],
         players: Dict[str, Dict[str, Any]],
         settings: Dict[str, Any],
         user
-) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
+) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]], Outbox]:
     """
-    Steuerung der Spielabläufe basierend auf eingehenden Aktionen.
+    Reine Spiellogik einer Aktion, ohne Netzwerk: wertet die Regeln aus und sammelt alle Nachrichten in einer Outbox.
+
+    ``state`` und ``players`` werden wie bisher direkt geändert, es gilt der zurückgegebene Zustand (bei Spielende ein
+    neuer). Die Nachrichten werden nicht gesendet, das macht ``game_decision`` (oder z. B. eine Simulation gar nicht).
 
-    :param websocket: Aktuelle WebSocket-Verbindung des Spielers
-    :param websocket_connections: Mapping von PlayerID -> WebSocket-Verbindung
     :param message: Eingehende Nachricht (Dictionary) mit Action & Parametern
     :param state: Globaler Spielstatus (Dictionary)
     :param players: Mapping von PlayerID -> Spielerdaten (Handkarten, Ready-Status, etc.)
     :param settings: Spiel-Einstellungen (max. Spieler, Deck-Größe, etc.)
     :param user: Objekt mit Spielerinformationen (z.B. user.id)
-    :return: (state, players) - Aktualisierter Spielstatus und Spielerdaten
+    :return: (state, players, outbox) - Aktualisierter Spielstatus, Spielerdaten und die zu sendenden Nachrichten
     """
+    outbox = Outbox()
+    state, players = dispatch(outbox, message, state, players, settings, user)
+    return state, players, outbox
+
+
+def dispatch(
+        outbox: Outbox,
+        message: Dict[str, Any],
+        state: Dict[str, Any],
+        players: Dict[str, Dict[str, Any]],
+        settings: Dict[str, Any],
+        user
+) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
+    """Steuerung der Spielabläufe basierend auf eingehenden Aktionen."""
     action = message.pop(ACTION, None)
     if not action:
-        await send_error(websocket, ERROR_NO_ACTION_PROVIDED)
+        send_error(outbox, ERROR_NO_ACTION_PROVIDED)
         return state, players
 
     # Mapping: Aktion -> Handler-Funktion
@@ -792,28 +863,47 @@ async def game_decision(
 
     # Handhabung der Lobby-spezifischen Aktionen (Spielzustand noch nicht gestartet)
     if action in (ACTION_JOIN, ACTION_READY, ACTION_LEAVE_LOBBY, ACTION_REQUEST_LOBBY_DATA):
-        return await action_handlers[action](websocket, websocket_connections, message, state, players, settings,
-                                             user) if action in action_handlers else (state, players)
+        return action_handlers[action](outbox, message, state, players, settings, user) if action in action_handlers else (state, players)
 
     # Falls das Spiel noch nicht gestartet ist, nur eingeschränkte Aktionen erlauben
     if not state[STARTED]:
         if action == ACTION_REQUEST_GAME_DATA:
-            return await handle_request_game_data(websocket, websocket_connections, message, state, players, settings,
-                                                  user)
+            return handle_request_game_data(outbox, message, state, players, settings, user)
         else:
-            await send_error(websocket, ERROR_GAME_NOT_STARTED)
+            send_error(outbox, ERROR_GAME_NOT_STARTED)
             return state, players
 
     # Wenn das Spiel läuft, aber eine unbekannte Aktion kommt
     if action not in action_handlers:
-        await send_error(websocket, ERROR_UNKNOWN_ACTION)
+        send_error(outbox, ERROR_UNKNOWN_ACTION)
         return state, players
 
     # Ab hier: Aktionen, die nur möglich sind, wenn das Spiel läuft (z. B. Karte legen)
     # Prüfen, ob der aktuelle Spieler am Zug ist (sofern kein Request-Game-Data o. Ä.)
     if action not in (ACTION_REQUEST_GAME_DATA, ACTION_LEAVE_GAME) and state[CURRENT_PLAYER] != user.id:
-        await send_error(websocket, ERROR_NOT_YOUR_TURN)
+        send_error(outbox, ERROR_NOT_YOUR_TURN)
         return state, players
 
     # Aufruf der passenden Handler-Funktion
-    return await action_handlers[action](websocket, websocket_connections, message, state, players, settings, user)
+    return action_handlers[action](outbox, message, state, players, settings, user)
+
+
+async def game_decision(
+        websocket,
+        websocket_connections,
+        message: Dict[str, Any],
+        state: Dict[str, Any],
+        players: Dict[str, Dict[str, Any]],
+        settings: Dict[str, Any],
+        user
+) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
+    """
+    Führt eine Aktion aus (``apply``) und verschickt danach ihre Nachrichten.
+
+    :param websocket: Aktuelle WebSocket-Verbindung des Spielers
+    :param websocket_connections: Mapping von PlayerID -> WebSocket-Verbindung
+    :return: (state, players) - Aktualisierter Spielstatus und Spielerdaten
+    """
+    state, players, outbox = apply(message, state, players, settings, user)
+    await deliver(outbox, websocket, websocket_connections)
+    return state, players
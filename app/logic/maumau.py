@@ -1,14 +1,33 @@
 import random
 import time
+from types import SimpleNamespace
 from typing import Dict, Any, Tuple
 
-from util.generic import flip_pile_if_empty, send_to_all
+from util.cards import (
+    VALUE_7,
+    VALUE_8,
+    VALUE_J,
+    cards_to_wire,
+    from_wire,
+    to_wire,
+    value_of
+)
+from util.changes import players_changed, state_changed
+from util.generic import flip_pile_if_empty
 from util.maumau import (
+    add_card,
     can_place_card_on_stack,
     generate_card_deck,
     get_next_player,
+    hand_to_wire,
+    new_hand,
+    playable_cards,
+    remove_card,
     turn_first_card
 )
+from util.outbox import Outbox, deliver
+from util.seating import seat_players, seating_order, unseat_player
+from util.timers import turn_deadline
 
 # ============================================================
 # Konstanten und Schlüssel
@@ -36,6 +55,7 @@ HAND = "hand"
 HAND_COUNT = "hand_count"
 VALUE = "value"
 CARDS = "cards"
+PLAYABLE_CARDS = "playable_cards"
 
 ACTION_JOIN = "join"
 ACTION_READY = "ready"
@@ -56,6 +76,7 @@ ACTION_END = "end"
 ACTION_HAND = "hand"
 ACTION_CARD_COUNT = "card_count"
 ACTION_TURN = "turn"
+ACTION_PLAYABLE_CARDS = "playable_cards"
 ACTION_TIMEOUT_PENALTY = "timeout_penalty"
 
 ERROR_NO_ACTION_PROVIDED = "No action provided"
@@ -80,14 +101,12 @@ ERROR_0_COUNT_7 = "0_count_7"
 ERROR_CAN_NOT_SKIP = "can_not_skip"
 ERROR_UNKNOWN_ACTION = "unknown_action"
 
-CARD_VALUE_7 = "7"
-CARD_VALUE_8 = "8"
-CARD_VALUE_J = "J"
 SUIT_HEARTS = "Hearts"
 SUIT_DIAMONDS = "Diamonds"
 SUIT_CLUBS = "Clubs"
 SUIT_SPADES = "Spades"
 TURN_START_TIME = "turn_start_time"
+TURN_DEADLINE = "turn_deadline"
 
 SETTING_MAX_PLAYERS = "max_players"
 SETTING_DECK_SIZE = "deck_size"
@@ -97,9 +116,9 @@ SETTING_NUMBER_OF_START_CARDS = "number_of_start_cards"
 # ============================================================
 # Hilfsfunktionen
 # ============================================================
-async def send_error(websocket, error_msg: str) -> None:
-    """Sende eine Fehlermeldung an einen bestimmten Websocket."""
-    await websocket.send_json({ERROR: error_msg})
+def send_error(outbox: Outbox, error_msg: str) -> None:
+    """Sende eine Fehlermeldung an die Verbindung, von der die Aktion kam."""
+    outbox.reply({ERROR: error_msg})
 
 
 def all_players_ready(players: Dict[str, Dict[str, Any]]) -> bool:
@@ -118,12 +137,38 @@ def get_hand_counts(players: Dict[str, Dict[str, Any]]) -> Dict[str, int]:
     return {pid: len(data[HAND]) for pid, data in players.items()}
 
 
+def get_playable_cards(state: Dict[str, Any], players: Dict[str, Dict[str, Any]], user_id: str) -> list:
+    """Karten, die der Spieler jetzt ablegen darf (leer, wenn er nicht am Zug ist)."""
+    if state[CURRENT_PLAYER] != user_id or user_id not in players:
+        return []
+    return cards_to_wire(playable_cards(players[user_id][HAND], state[DISCARD_PILE][-1], state[J_CHOICE],
+                                        state[COUNT_7]))
+
+
+def send_playable_cards(outbox: Outbox, state: Dict[str, Any], players: Dict[str, Dict[str, Any]],
+                        user_id: str) -> None:
+    """Sendet dem Spieler am Zug, welche seiner Karten er ablegen darf."""
+    outbox.to_player(user_id, {
+        ACTION: ACTION_PLAYABLE_CARDS,
+        CARDS:  get_playable_cards(state, players, user_id)
+    })
+
+
+def send_turn(outbox: Outbox, state: Dict[str, Any], players: Dict[str, Dict[str, Any]]) -> None:
+    """Kündigt allen den nächsten Zug an, der Spieler am Zug bekommt dazu seine spielbaren Karten."""
+    outbox.to_all({
+        ACTION:        ACTION_TURN,
+        PLAYER:        state[CURRENT_PLAYER],
+        TURN_DEADLINE: turn_deadline(state)
+    })
+    send_playable_cards(outbox, state, players, state[CURRENT_PLAYER])
+
+
 # ============================================================
 # Action-Handler-Funktionen
 # ============================================================
-async def handle_join(
-        websocket,
-        websocket_connections,
+def handle_join(
+        outbox: Outbox,
         message: Dict[str, Any],
         state: Dict[str, Any],
         players: Dict[str, Dict[str, Any]],
@@ -133,28 +178,29 @@ async def handle_join(
     """Behandelt das Joinen eines neuen Spielers."""
     # Validierung
     if len(message) != 0:
-        await send_error(websocket, ERROR_WRONG_DATA)
+        send_error(outbox, ERROR_WRONG_DATA)
         return state, players
 
     if user.id in players:
-        await send_error(websocket, ERROR_PLAYER_ALREADY_JOINED)
+        send_error(outbox, ERROR_PLAYER_ALREADY_JOINED)
         return state, players
 
     if state[STARTED]:
-        await send_error(websocket, ERROR_GAME_ALREADY_STARTED)
+        send_error(outbox, ERROR_GAME_ALREADY_STARTED)
         return state, players
 
     if len(players) == settings[SETTING_MAX_PLAYERS]:
-        await send_error(websocket, ERROR_GAME_FULL)
+        send_error(outbox, ERROR_GAME_FULL)
         return state, players
 
     players[user.id] = {
         READY:         False,
-        HAND:          [],
+        HAND:          new_hand(),
         JOIN_SEQUENCE: len(players) + 1
     }
+    players_changed(user.id)
 
-    await send_to_all(websocket_connections, {
+    outbox.to_all({
         ACTION:  ACTION_JOIN,
         PLAYER:  user.id,
         PLAYERS: list(players.keys())
@@ -162,9 +208,8 @@ async def handle_join(
     return state, players
 
 
-async def handle_ready(
-        websocket,
-        websocket_connections,
+def handle_ready(
+        outbox: Outbox,
         message: Dict[str, Any],
         state: Dict[str, Any],
         players: Dict[str, Dict[str, Any]],
@@ -174,30 +219,31 @@ async def handle_ready(
     """Setzt den Status READY für einen Spieler und startet ggf. das Spiel."""
     # Validierung
     if user.id not in players:
-        await send_error(websocket, ERROR_NOT_IN_LOBBY)
+        send_error(outbox, ERROR_NOT_IN_LOBBY)
         return state, players
 
     if len(message) != 1:
-        await send_error(websocket, ERROR_WRONG_DATA)
+        send_error(outbox, ERROR_WRONG_DATA)
         return state, players
 
     if READY not in message:
-        await send_error(websocket, ERROR_NO_READY_PROVIDED)
+        send_error(outbox, ERROR_NO_READY_PROVIDED)
         return state, players
 
     if message[READY] not in [True, False]:
-        await send_error(websocket, ERROR_WRONG_READY_VALUE)
+        send_error(outbox, ERROR_WRONG_READY_VALUE)
         return state, players
 
     if state[STARTED]:
-        await send_error(websocket, ERROR_GAME_ALREADY_STARTED)
+        send_error(outbox, ERROR_GAME_ALREADY_STARTED)
         return state, players
 
     # Setze Ready-Status
     players[user.id][READY] = message[READY]
+    players_changed(user.id)
 
     # Informiere alle über den neuen Ready-Status
-    await send_to_all(websocket_connections, {
+    outbox.to_all({
         ACTION:  ACTION_READY,
         PLAYER:  user.id,
         READY:   message[READY],
@@ -215,26 +261,29 @@ async def handle_ready(
         state[WINNER] = []
         state[CURRENT_PLAYER] = random.choice(list(players.keys()))
         state[TURN_START_TIME] = time.time()
+        seat_players(state, players)
+        state_changed()
+        players_changed()
 
         # Sende Start-Info
-        await send_to_all(websocket_connections, {
+        outbox.to_all({
             ACTION:       ACTION_START,
-            DISCARD_PILE: state[DISCARD_PILE][-1]
+            DISCARD_PILE: to_wire(state[DISCARD_PILE][-1])
         })
 
         # Karten austeilen
         for pid in players:
-            players[pid][HAND] = state[DRAW_PILE][:settings[SETTING_NUMBER_OF_START_CARDS]]
+            players[pid][HAND] = new_hand(state[DRAW_PILE][:settings[SETTING_NUMBER_OF_START_CARDS]])
             players[pid][LAST_ACTION] = ACTION_READY
             state[DRAW_PILE] = state[DRAW_PILE][settings[SETTING_NUMBER_OF_START_CARDS]:]
             # Jeder bekommt seine Handkarten
-            await websocket_connections[pid].send_json({
+            outbox.to_player(pid, {
                 ACTION: ACTION_HAND,
-                HAND:   players[pid][HAND]
+                HAND:   hand_to_wire(players[pid][HAND])
             })
 
         # Sende Karten-Zusammenfassung
-        await send_to_all(websocket_connections, {
+        outbox.to_all({
             ACTION:             ACTION_CARD_COUNT,
             DISCARD_PILE_COUNT: len(state[DISCARD_PILE]),
             DRAW_PILE_COUNT:    len(state[DRAW_PILE]),
@@ -242,18 +291,14 @@ async def handle_ready(
         })
 
         # Nächster Zug
-        await send_to_all(websocket_connections, {
-            ACTION: ACTION_TURN,
-            PLAYER: state[CURRENT_PLAYER]
-        })
+        send_turn(outbox, state, players)
 
     return state, players
 
 
 # noinspection PyUnusedLocal
-async def handle_leave_lobby(
-        websocket,
-        websocket_connections,
+def handle_leave_lobby(
+        outbox: Outbox,
         message: Dict[str, Any],
         state: Dict[str, Any],
         players: Dict[str, Dict[str, Any]],
@@ -262,16 +307,17 @@ async def handle_leave_lobby(
 ) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
     """Ermöglicht das Verlassen der Lobby, falls das Spiel noch nicht gestartet ist."""
     if len(message) != 0:
-        await send_error(websocket, ERROR_WRONG_DATA)
+        send_error(outbox, ERROR_WRONG_DATA)
         return state, players
 
     if state[STARTED]:
-        await send_error(websocket, ERROR_GAME_ALREADY_STARTED)
+        send_error(outbox, ERROR_GAME_ALREADY_STARTED)
         return state, players
 
     remove_player(players, user.id)
+    players_changed(user.id)
 
-    await send_to_all(websocket_connections, {
+    outbox.to_all({
         ACTION:  ACTION_LEAVE_LOBBY,
         PLAYER:  user.id,
         PLAYERS: list(players.keys())
@@ -280,9 +326,8 @@ async def handle_leave_lobby(
 
 
 # noinspection PyUnusedLocal
-async def handle_request_lobby_data(
-        websocket,
-        websocket_connections,
+def handle_request_lobby_data(
+        outbox: Outbox,
         message: Dict[str, Any],
         state: Dict[str, Any],
         players: Dict[str, Dict[str, Any]],
@@ -291,11 +336,11 @@ async def handle_request_lobby_data(
 ) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
     """Liefert Lobby-Daten an den anfragenden Spieler."""
     if len(message) != 0:
-        await send_error(websocket, ERROR_WRONG_DATA)
+        send_error(outbox, ERROR_WRONG_DATA)
         return state, players
 
     # Sende Ready-Status aller Spieler
-    await websocket.send_json({
+    outbox.reply({
         ACTION:  ACTION_LOBBY_DATA,
         PLAYERS: {pid: player_data[READY] for pid, player_data in players.items()}
     })
@@ -303,9 +348,8 @@ async def handle_request_lobby_data(
 
 
 # noinspection PyUnusedLocal
-async def handle_request_game_data(
-        websocket,
-        websocket_connections,
+def handle_request_game_data(
+        outbox: Outbox,
         message: Dict[str, Any],
         state: Dict[str, Any],
         players: Dict[str, Dict[str, Any]],
@@ -314,29 +358,29 @@ async def handle_request_game_data(
 ) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
     """Gibt Spiel-Daten zurück (Anzahl der Handkarten, letzte abgelegte Karte etc.)."""
     if len(message) != 0:
-        await send_error(websocket, ERROR_WRONG_DATA)
+        send_error(outbox, ERROR_WRONG_DATA)
         return state, players
 
     if not state[STARTED]:
-        await send_error(websocket, ERROR_GAME_NOT_STARTED)
+        send_error(outbox, ERROR_GAME_NOT_STARTED)
         return state, players
 
-    sorted_players = sorted(players.keys(), key=lambda pid: players[pid]['join_sequence'])
-    await websocket.send_json({
+    outbox.reply({
         ACTION:         ACTION_GAME_DATA,
-        PLAYERS:        {pid: len(players[pid][HAND]) for pid in sorted_players},
-        DISCARD_PILE:   state[DISCARD_PILE][-1],
+        PLAYERS:        {pid: len(players[pid][HAND]) for pid in seating_order(state, players)},
+        DISCARD_PILE:   to_wire(state[DISCARD_PILE][-1]),
         DRAW_PILE:      len(state[DRAW_PILE]),
         CURRENT_PLAYER: state[CURRENT_PLAYER],
-        HAND:           players[user.id][HAND]
+        TURN_DEADLINE:  turn_deadline(state),
+        HAND:           hand_to_wire(players[user.id][HAND]),
+        PLAYABLE_CARDS: get_playable_cards(state, players, user.id)
     })
     return state, players
 
 
 # noinspection PyUnusedLocal
-async def handle_place_card_on_stack(
-        websocket,
-        websocket_connections,
+def handle_place_card_on_stack(
+        outbox: Outbox,
         message: Dict[str, Any],
         state: Dict[str, Any],
         players: Dict[str, Dict[str, Any]],
@@ -346,116 +390,126 @@ async def handle_place_card_on_stack(
     """Ermöglicht es einem Spieler, eine Karte abzulegen."""
     # Validierung
     if len(message) not in [2, 3]:
-        await send_error(websocket, ERROR_WRONG_DATA)
+        send_error(outbox, ERROR_WRONG_DATA)
         return state, players
 
     if CARD not in message:
-        await send_error(websocket, ERROR_NO_CARD_PROVIDED)
+        send_error(outbox, ERROR_NO_CARD_PROVIDED)
         return state, players
 
     if MAU not in message:
-        await send_error(websocket, ERROR_NO_MAU_PROVIDED)
+        send_error(outbox, ERROR_NO_MAU_PROVIDED)
         return state, players
 
-    card = message[CARD]
+    card = from_wire(message[CARD])
+    hand = players[user.id][HAND]
 
     # Wenn Karte Bube (J), muss J_CHOICE gesetzt sein
-    if card[VALUE] == CARD_VALUE_J and J_CHOICE not in message:
-        await send_error(websocket, ERROR_NO_CHOICE_PROVIDED)
+    if card is not None and value_of(card) == VALUE_J and J_CHOICE not in message:
+        send_error(outbox, ERROR_NO_CHOICE_PROVIDED)
         return state, players
 
     # Check, ob Karte tatsächlich in der Hand ist
-    if card not in players[user.id][HAND]:
-        await send_error(websocket, ERROR_CARD_NOT_IN_HAND)
+    if card is None or card not in hand:
+        send_error(outbox, ERROR_CARD_NOT_IN_HAND)
         return state, players
 
     # Überprüfe, ob das Ablegen erlaubt ist
     if not can_place_card_on_stack(card, state[DISCARD_PILE][-1], state[J_CHOICE]):
-        await send_error(websocket, ERROR_CARD_NOT_ALLOWED)
+        send_error(outbox, ERROR_CARD_NOT_ALLOWED)
+        return state, players
+
+    # Offene 7er: nur eine weitere 7, sonst erst Strafkarten ziehen (bevor die Karte abgelegt wird)
+    if value_of(card) != VALUE_7 and state[COUNT_7] != 0:
+        send_error(outbox, ERROR_HAS_TO_DRAW_PENALTY)
+        return state, players
+
+    # Bei Bube muss eine gültige Wahl (Farbe) getroffen werden
+    if value_of(card) == VALUE_J and message[J_CHOICE] not in [SUIT_HEARTS, SUIT_DIAMONDS, SUIT_CLUBS, SUIT_SPADES]:
+        send_error(outbox, ERROR_J_CHOICE_NOT_POSSIBLE)
         return state, players
 
     # Karte wird auf den Ablagestapel gelegt
     state[DISCARD_PILE].append(card)
-    players[user.id][HAND].remove(card)
+    remove_card(hand, card)
+    state_changed(DISCARD_PILE)
+    players_changed(user.id)
 
     # MAU-Logik: Wenn Spieler 1 Karte auf der Hand hat, muss MAU gesagt werden
-    if len(players[user.id][HAND]) == 1:
+    if len(hand) == 1:
         if message[MAU]:
-            await send_to_all(websocket_connections, {
+            outbox.to_all({
                 ACTION: ACTION_MAU,
                 PLAYER: user.id
             })
         else:
             # Falls MAU nicht gesagt, eine Strafkarte ziehen
             if state[DRAW_PILE]:
-                players[user.id][HAND].append(state[DRAW_PILE].pop())
+                drawn = state[DRAW_PILE].pop()
+                add_card(hand, drawn)
+                state_changed(DRAW_PILE)
             else:
-                await send_error(websocket, "No cards left to draw")
+                send_error(outbox, "No cards left to draw")
                 return state, players
             try:
                 state = flip_pile_if_empty(state)
             except IndexError as e:
-                await send_error(websocket, str(e))
-            await websocket.send_json({
+                send_error(outbox, str(e))
+            outbox.reply({
                 ACTION: ACTION_HAND,
-                HAND:   players[user.id][HAND],
-                CARDS:  players[user.id][HAND][-1]
+                HAND:   hand_to_wire(hand),
+                CARDS:  to_wire(drawn)
             })
 
     # Effekte je nach Kartenwert (7, J, 8)
-    if card[VALUE] == CARD_VALUE_7:
+    if value_of(card) == VALUE_7:
         # 7er erhöht den COUNT_7 für Strafkarten
         state[COUNT_7] += 2
-    else:
-        if state[COUNT_7] != 0:
-            # Kartenwert != 7 aber COUNT_7 != 0 -> erst Strafkarten ziehen
-            await send_error(websocket, ERROR_HAS_TO_DRAW_PENALTY)
-            return state, players
+        state_changed(COUNT_7)
 
-    if card[VALUE] == CARD_VALUE_J:
-        # Bei Bube muss eine Wahl (Farbe) getroffen werden
-        j_choice = message[J_CHOICE]
-        if j_choice in [SUIT_HEARTS, SUIT_DIAMONDS, SUIT_CLUBS, SUIT_SPADES]:
-            state[J_CHOICE] = j_choice
-        else:
-            await send_error(websocket, ERROR_J_CHOICE_NOT_POSSIBLE)
-            return state, players
+    if value_of(card) == VALUE_J:
+        state[J_CHOICE] = message[J_CHOICE]
+        state_changed(J_CHOICE)
 
     # 8er -> nächster Spieler wird übersprungen
-    if card[VALUE] == CARD_VALUE_8:
-        state[CURRENT_PLAYER] = get_next_player(user.id, players, skip=1)
+    if value_of(card) == VALUE_8:
+        state[CURRENT_PLAYER] = get_next_player(state, players, user.id, skip=1)
     else:
-        state[CURRENT_PLAYER] = get_next_player(user.id, players)
+        state[CURRENT_PLAYER] = get_next_player(state, players, user.id)
     state[TURN_START_TIME] = time.time()  # Timer zurücksetzen
+    state_changed(CURRENT_PLAYER, TURN_START_TIME)
 
     # Reshuffle if draw_pile is empty and we now have enough cards to shuffle
     if not state[DRAW_PILE] and len(state[DISCARD_PILE]) >= 2:
         draw_card = state[DISCARD_PILE][0]
         state[DRAW_PILE] = [draw_card]
         state[DISCARD_PILE].remove(draw_card)
+        state_changed(DRAW_PILE)
 
     # Broadcast
     message = {
         ACTION: ACTION_PLACE_CARD_ON_STACK,
-        CARD:   card,
+        CARD:   to_wire(card),
         PLAYER: user.id
     }
-    if card[VALUE] == CARD_VALUE_J:
+    if value_of(card) == VALUE_J:
         message[J_CHOICE] = state[J_CHOICE]
-    await send_to_all(websocket_connections, message)
+    outbox.to_all(message)
 
     # Hat der Spieler nun gewonnen?
-    if len(players[user.id][HAND]) == 0:
+    if len(hand) == 0:
         players.pop(user.id)
+        unseat_player(state, user.id)
         state[WINNER].append(user.id)
-        await send_to_all(websocket_connections, {
+        state_changed(WINNER)
+        outbox.to_all({
             ACTION: ACTION_WIN,
             PLAYER: user.id
         })
         # Wenn nur noch 1 Spieler übrig ist -> Spielende
         if len(players) == 1:
             winner = state[WINNER][0] if state[WINNER] else None
-            await send_to_all(websocket_connections, {
+            outbox.to_all({
                 ACTION: ACTION_END,
                 WINNER: winner
             })
@@ -471,13 +525,15 @@ async def handle_place_card_on_stack(
             }
 
             players = {}
+            state_changed()
+            players_changed()
 
             return state, players
     else:
         players[user.id][LAST_ACTION] = ACTION_PLACE_CARD_ON_STACK
 
     # Allen den neuen Karten-Count senden
-    await send_to_all(websocket_connections, {
+    outbox.to_all({
         ACTION:             ACTION_CARD_COUNT,
         DISCARD_PILE_COUNT: len(state[DISCARD_PILE]),
         DRAW_PILE_COUNT:    len(state[DRAW_PILE]),
@@ -485,18 +541,14 @@ async def handle_place_card_on_stack(
     })
 
     # Nächster Zug
-    await send_to_all(websocket_connections, {
-        ACTION: ACTION_TURN,
-        PLAYER: state[CURRENT_PLAYER]
-    })
+    send_turn(outbox, state, players)
 
     return state, players
 
 
 # noinspection DuplicatedCode,PyUnusedLocal
-async def handle_draw_card(
-        websocket,
-        websocket_connections,
+def handle_draw_card(
+        outbox: Outbox,
         message: Dict[str, Any],
         state: Dict[str, Any],
         players: Dict[str, Dict[str, Any]],
@@ -505,53 +557,59 @@ async def handle_draw_card(
 ) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
     """Ermöglicht das Ziehen einer Karte vom Stapel."""
     if len(message) != 0:
-        await send_error(websocket, ERROR_WRONG_DATA)
+        send_error(outbox, ERROR_WRONG_DATA)
         return state, players
 
     if players[user.id].get(LAST_ACTION) == ACTION_DRAW_CARD:
-        await send_error(websocket, ERROR_CANT_DRAW_AGAIN)
+        send_error(outbox, ERROR_CANT_DRAW_AGAIN)
         return state, players
 
     if state[COUNT_7] != 0:
-        await send_error(websocket, ERROR_HAS_TO_DRAW_PENALTY)
+        send_error(outbox, ERROR_HAS_TO_DRAW_PENALTY)
         return state, players
 
     # Ziehe Karte
+    hand = players[user.id][HAND]
     if state[DRAW_PILE]:
-        players[user.id][HAND].append(state[DRAW_PILE].pop())
+        drawn = state[DRAW_PILE].pop()
+        add_card(hand, drawn)
+        state_changed(DRAW_PILE)
+        players_changed(user.id)
     else:
-        await send_error(websocket, "No cards left to draw")
+        send_error(outbox, "No cards left to draw")
         return state, players
     try:
         state = flip_pile_if_empty(state)
     except IndexError as e:
-        await send_error(websocket, str(e))
+        send_error(outbox, str(e))
 
     # Sende Info zum Ziehen
-    await websocket.send_json({
+    outbox.reply({
         ACTION: ACTION_DRAW_CARD,
         PLAYER: user.id
     })
-    await websocket.send_json({
+    outbox.reply({
         ACTION: ACTION_HAND,
-        HAND:   players[user.id][HAND],
-        CARDS:  players[user.id][HAND][-1]
+        HAND:   hand_to_wire(hand),
+        CARDS:  to_wire(drawn)
     })
-    await send_to_all(websocket_connections, {
+    outbox.to_all({
         ACTION:             ACTION_CARD_COUNT,
         DISCARD_PILE_COUNT: len(state[DISCARD_PILE]),
         DRAW_PILE_COUNT:    len(state[DRAW_PILE]),
         HAND_COUNT:         get_hand_counts(players)
     })
+    # Der Spieler bleibt am Zug, mit neuen Karten
+    send_playable_cards(outbox, state, players, user.id)
 
     players[user.id][LAST_ACTION] = ACTION_DRAW_CARD
+    players_changed(user.id)
     return state, players
 
 
 # noinspection PyUnusedLocal,DuplicatedCode
-async def handle_draw_penalty(
-        websocket,
-        websocket_connections,
+def handle_draw_penalty(
+        outbox: Outbox,
         message: Dict[str, Any],
         state: Dict[str, Any],
         players: Dict[str, Dict[str, Any]],
@@ -560,53 +618,57 @@ async def handle_draw_penalty(
 ) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
     """Ermöglicht das Ziehen der Strafkarten, wenn COUNT_7 > 0."""
     if len(message) != 0:
-        await send_error(websocket, ERROR_WRONG_DATA)
+        send_error(outbox, ERROR_WRONG_DATA)
         return state, players
 
     if state[COUNT_7] == 0:
-        await send_error(websocket, ERROR_0_COUNT_7)
+        send_error(outbox, ERROR_0_COUNT_7)
         return state, players
 
     # Ziehe COUNT_7 Karten, if possible
-    drawn_cards = 0
+    hand = players[user.id][HAND]
+    drawn_cards = []
     for _ in range(state[COUNT_7]):
         if state[DRAW_PILE]:
-            players[user.id][HAND].append(state[DRAW_PILE].pop())
-            drawn_cards += 1
+            drawn_cards.append(state[DRAW_PILE].pop())
+            add_card(hand, drawn_cards[-1])
         else:
             break
         try:
             state = flip_pile_if_empty(state)
         except IndexError as e:
-            await send_error(websocket, str(e))
+            send_error(outbox, str(e))
 
-    await send_to_all(websocket_connections, {
+    outbox.to_all({
         ACTION:  ACTION_DRAW_PENALTY,
         PLAYER:  user.id,
-        COUNT_7: drawn_cards
+        COUNT_7: len(drawn_cards)
     })
 
     state[COUNT_7] = 0
-    await websocket.send_json({
+    state_changed(COUNT_7, DRAW_PILE)
+    players_changed(user.id)
+    outbox.reply({
         ACTION: ACTION_HAND,
-        HAND:   players[user.id][HAND],
-        CARDS:  players[user.id][HAND][-drawn_cards:]
+        HAND:   hand_to_wire(hand),
+        CARDS:  cards_to_wire(drawn_cards)
     })
-    await send_to_all(websocket_connections, {
+    outbox.to_all({
         ACTION:             ACTION_CARD_COUNT,
         DISCARD_PILE_COUNT: len(state[DISCARD_PILE]),
         DRAW_PILE_COUNT:    len(state[DRAW_PILE]),
         HAND_COUNT:         get_hand_counts(players)
     })
+    # Der Spieler bleibt am Zug, mit neuen Karten
+    send_playable_cards(outbox, state, players, user.id)
 
     players[user.id][LAST_ACTION] = ACTION_DRAW_PENALTY
     return state, players
 
 
 # noinspection PyUnusedLocal
-async def handle_skip(
-        websocket,
-        websocket_connections,
+def handle_skip(
+        outbox: Outbox,
         message: Dict[str, Any],
         state: Dict[str, Any],
         players: Dict[str, Dict[str, Any]],
@@ -615,30 +677,28 @@ async def handle_skip(
 ) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
     """Ermöglicht das Überspringen des Zugs (wenn man bereits gezogen hat)."""
     if len(message) != 0:
-        await send_error(websocket, ERROR_WRONG_DATA)
+        send_error(outbox, ERROR_WRONG_DATA)
         return state, players
 
     # Deny skip if player did not draw and the draw pile is filled
     if players[user.id][LAST_ACTION] != ACTION_DRAW_CARD and state[DRAW_PILE]:
-        await send_error(websocket, ERROR_CAN_NOT_SKIP)
+        send_error(outbox, ERROR_CAN_NOT_SKIP)
         return state, players
 
     # Nächster Spieler
-    state[CURRENT_PLAYER] = get_next_player(user.id, players)
+    state[CURRENT_PLAYER] = get_next_player(state, players, user.id)
     state[TURN_START_TIME] = time.time()  # Timer neu starten bei Zugwechsel
-    await send_to_all(websocket_connections, {
-        ACTION: ACTION_TURN,
-        PLAYER: state[CURRENT_PLAYER]
-    })
+    state_changed(CURRENT_PLAYER, TURN_START_TIME)
+    send_turn(outbox, state, players)
 
     players[user.id][LAST_ACTION] = ACTION_SKIP
+    players_changed(user.id)
     return state, players
 
 
 # noinspection PyUnusedLocal
-async def handle_leave_game(
-        websocket,
-        websocket_connections,
+def handle_leave_game(
+        outbox: Outbox,
         message: Dict[str, Any],
         state: Dict[str, Any],
         players: Dict[str, Dict[str, Any]],
@@ -647,19 +707,22 @@ async def handle_leave_game(
 ) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
     """Ermöglicht einem Spieler das Verlassen des laufenden Spiels."""
     if len(message) != 0:
-        await send_error(websocket, ERROR_WRONG_DATA)
+        send_error(outbox, ERROR_WRONG_DATA)
         return state, players
 
     # Karten des Spielers kommen auf den Ablagestapel
     state[DISCARD_PILE] = players[user.id][HAND] + state[DISCARD_PILE]
+    state_changed(DISCARD_PILE)
     # Save possible next player before removal of current player
     next_player = None
     if state[CURRENT_PLAYER] == user.id:
-        next_player = get_next_player(user.id, players)
+        next_player = get_next_player(state, players, user.id)
 
     remove_player(players, user.id)
+    unseat_player(state, user.id)
+    players_changed(user.id)
 
-    await send_to_all(websocket_connections, {
+    outbox.to_all({
         ACTION:  ACTION_LEAVE_GAME,
         PLAYER:  user.id,
         PLAYERS: list(players.keys())
@@ -668,7 +731,7 @@ async def handle_leave_game(
     # Prüfen, ob nur ein Spieler übrig
     if len(players) == 1:
         winner = state[WINNER][0] if state[WINNER] else None
-        await send_to_all(websocket_connections, {
+        outbox.to_all({
             ACTION: ACTION_END,
             WINNER: winner
         })
@@ -684,6 +747,8 @@ async def handle_leave_game(
         }
 
         players = {}
+        state_changed()
+        players_changed()
 
         return state, players
 
@@ -691,13 +756,11 @@ async def handle_leave_game(
     if next_player:
         state[CURRENT_PLAYER] = next_player
         state[TURN_START_TIME] = time.time()  # Timer zurücksetzen, da Zugwechsel
-        await send_to_all(websocket_connections, {
-            ACTION: ACTION_TURN,
-            PLAYER: state[CURRENT_PLAYER]
-        })
+        state_changed(CURRENT_PLAYER, TURN_START_TIME)
+        send_turn(outbox, state, players)
 
     # Karten-Zusammenfassung
-    await send_to_all(websocket_connections, {
+    outbox.to_all({
         ACTION:             ACTION_CARD_COUNT,
         DISCARD_PILE_COUNT: len(state[DISCARD_PILE]),
         DRAW_PILE_COUNT:    len(state[DRAW_PILE]),
@@ -707,32 +770,77 @@ async def handle_leave_game(
 
 
 # ============================================================
-# Hauptfunktion game_decision
+# Zugzeit abgelaufen
 # ============================================================
-async def game_decision(
-        websocket,
+def apply_turn_timeout(
+        state: Dict[str, Any],
+        players: Dict[str, Dict[str, Any]],
+        settings: Dict[str, Any],
+        player_id: str
+) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]], Outbox]:
+    """Zugzeit abgelaufen: der Spieler verlässt das Spiel als Strafe (reine Spiellogik, wie ``apply``)."""
+    outbox = Outbox()
+    outbox.to_all({
+        ACTION: ACTION_TIMEOUT_PENALTY,
+        PLAYER: player_id
+    })
+    state, players = handle_leave_game(outbox, {}, state, players, settings, SimpleNamespace(id=player_id))
+    return state, players, outbox
+
+
+async def handle_turn_timeout(
         websocket_connections,
+        state: Dict[str, Any],
+        players: Dict[str, Dict[str, Any]],
+        settings: Dict[str, Any],
+        player_id: str
+) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
+    """Wird vom Timer ausgelöst, wenn die Zugzeit abgelaufen ist, und verschickt die Nachrichten."""
+    state, players, outbox = apply_turn_timeout(state, players, settings, player_id)
+    await deliver(outbox, None, websocket_connections)
+    return state, players
+
+
+# ============================================================
+# Hauptfunktion game_decision
+# ============================================================
+def apply(
         message: Dict[str, Any],
         state: Dict[str, Any],
         players: Dict[str, Dict[str, Any]],
         settings: Dict[str, Any],
         user
-) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
+) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]], Outbox]:
     """
-    Steuerung der Spielabläufe basierend auf eingehenden Aktionen.
+    Reine Spiellogik einer Aktion, ohne Netzwerk: wertet die Regeln aus und sammelt alle Nachrichten in einer Outbox.
+
+    ``state`` und ``players`` werden wie bisher direkt geändert, es gilt der zurückgegebene Zustand (bei Spielende ein
+    neuer). Die Nachrichten werden nicht gesendet, das macht ``game_decision`` (oder z. B. eine Simulation gar nicht).
 
-    :param websocket: Aktuelle WebSocket-Verbindung des Spielers
-    :param websocket_connections: Mapping von PlayerID -> WebSocket-Verbindung
     :param message: Eingehende Nachricht (Dictionary) mit Action & Parametern
     :param state: Globaler Spielstatus (Dictionary)
     :param players: Mapping von PlayerID -> Spielerdaten (Handkarten, Ready-Status, etc.)
     :param settings: Spiel-Einstellungen (max. Spieler, Deck-Größe, etc.)
     :param user: Objekt mit Spielerinformationen (z.B. user.id)
-    :return: (state, players) - Aktualisierter Spielstatus und Spielerdaten
+    :return: (state, players, outbox) - Aktualisierter Spielstatus, Spielerdaten und die zu sendenden Nachrichten
     """
+    outbox = Outbox()
+    state, players = dispatch(outbox, message, state, players, settings, user)
+    return state, players, outbox
+
+
+def dispatch(
+        outbox: Outbox,
+        message: Dict[str, Any],
+        state: Dict[str, Any],
+        players: Dict[str, Dict[str, Any]],
+        settings: Dict[str, Any],
+        user
+) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
+    """Steuerung der Spielabläufe basierend auf eingehenden Aktionen."""
     action = message.pop(ACTION, None)
     if not action:
-        await send_error(websocket, ERROR_NO_ACTION_PROVIDED)
+        send_error(outbox, ERROR_NO_ACTION_PROVIDED)
         return state, players
 
     # Mapping: Aktion -> Handler-Funktion
@@ -751,28 +859,47 @@ async def game_decision(
 
     # Handhabung der Lobby-spezifischen Aktionen (Spielzustand noch nicht gestartet)
     if action in (ACTION_JOIN, ACTION_READY, ACTION_LEAVE_LOBBY, ACTION_REQUEST_LOBBY_DATA):
-        return await action_handlers[action](websocket, websocket_connections, message, state, players, settings,
-                                             user) if action in action_handlers else (state, players)
+        return action_handlers[action](outbox, message, state, players, settings, user) if action in action_handlers else (state, players)
 
     # Falls das Spiel noch nicht gestartet ist, nur eingeschränkte Aktionen erlauben
     if not state[STARTED]:
         if action == ACTION_REQUEST_GAME_DATA:
-            return await handle_request_game_data(websocket, websocket_connections, message, state, players, settings,
-                                                  user)
+            return handle_request_game_data(outbox, message, state, players, settings, user)
         else:
-            await send_error(websocket, ERROR_GAME_NOT_STARTED)
+            send_error(outbox, ERROR_GAME_NOT_STARTED)
             return state, players
 
     # Wenn das Spiel läuft, aber eine unbekannte Aktion kommt
     if action not in action_handlers:
-        await send_error(websocket, ERROR_UNKNOWN_ACTION)
+        send_error(outbox, ERROR_UNKNOWN_ACTION)
         return state, players
 
     # Ab hier: Aktionen, die nur möglich sind, wenn das Spiel läuft (z. B. Karte legen)
     # Prüfen, ob der aktuelle Spieler am Zug ist (sofern kein Request-Game-Data o. Ä.)
     if action not in (ACTION_REQUEST_GAME_DATA, ACTION_LEAVE_GAME) and state[CURRENT_PLAYER] != user.id:
-        await send_error(websocket, ERROR_NOT_YOUR_TURN)
+        send_error(outbox, ERROR_NOT_YOUR_TURN)
         return state, players
 
     # Aufruf der passenden Handler-Funktion
-    return await action_handlers[action](websocket, websocket_connections, message, state, players, settings, user)
+    return action_handlers[action](outbox, message, state, players, settings, user)
+
+
+async def game_decision(
+        websocket,
+        websocket_connections,
+        message: Dict[str, Any],
+        state: Dict[str, Any],
+        players: Dict[str, Dict[str, Any]],
+        settings: Dict[str, Any],
+        user
+) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
+    """
+    Führt eine Aktion aus (``apply``) und verschickt danach ihre Nachrichten.
+
+    :param websocket: Aktuelle WebSocket-Verbindung des Spielers
+    :param websocket_connections: Mapping von PlayerID -> WebSocket-Verbindung
+    :return: (state, players) - Aktualisierter Spielstatus und Spielerdaten
+    """
+    state, players, outbox = apply(message, state, players, settings, user)
+    await deliver(outbox, websocket, websocket_connections)
+    return state, players
@@ -1,8 +1,8 @@
-import json
-
 from sqlalchemy import String, TypeDecorator
 from sqlalchemy.dialects.postgresql import JSONB
 
+from util import codec
+
 
 class CustomJSON(TypeDecorator):
     impl = String
@@ -18,11 +18,11 @@ class CustomJSON(TypeDecorator):
             return None
         if dialect.name == "postgresql":
             return value
-        return json.dumps(value)
+        return codec.dumps(value)
 
     def process_result_value(self, value, dialect):
         if value is None:
             return None
         if dialect.name == "postgresql":
             return value
-        return json.loads(value)
+        return codec.loads(value)
@@ -1,5 +1,6 @@
-from sqlalchemy import Column, Enum, String
+from sqlalchemy import Column, Enum, Float, String
 
+from database import Base
 from models.base import BaseModel
 from models.custom_type import CustomJSON
 from schemas.game import GameType
@@ -13,3 +14,12 @@ class GameModel(BaseModel):
     settings = Column(CustomJSON)
     state = Column(CustomJSON)
     players = Column(CustomJSON)
+
+
+class GameOwnerModel(Base):
+    """The process that holds a game in memory (``util/game_store.py``), its claim ends at ``expires`` (Unix time)."""
+    __tablename__ = "game_owner"
+
+    game_id = Column(String(36), primary_key=True)
+    owner = Column(String(128), nullable=False)
+    expires = Column(Float, nullable=False)
@@ -1,7 +1,10 @@
+import time
+
 from sqlalchemy import Column, Integer, LargeBinary, String, Boolean
 import bcrypt
 
 from models.base import BaseModel
+from util.metrics import PASSWORD_SECONDS
 
 
 class UserModel(BaseModel):
@@ -15,9 +18,14 @@ class UserModel(BaseModel):
     profile_picture_name = Column(String, nullable=True)
 
     def set_password(self, password):
+        start = time.perf_counter()
         salt = bcrypt.gensalt()
         hashed_password = bcrypt.hashpw(password.encode(), salt)
         self.password = hashed_password.decode()
+        PASSWORD_SECONDS.observe(time.perf_counter() - start, "hash")
 
     def verify_password(self, password):
-        return bcrypt.checkpw(password.encode(), self.password.encode())
+        start = time.perf_counter()
+        valid = bcrypt.checkpw(password.encode(), self.password.encode())
+        PASSWORD_SECONDS.observe(time.perf_counter() - start, "verify")
+        return valid
@@ -0,0 +1,61 @@
+import asyncio
+import hmac
+import logging
+import os
+import threading
+from typing import Literal
+
+from fastapi import APIRouter, Header, HTTPException, Query
+from starlette.responses import JSONResponse, PlainTextResponse
+
+from util.profiler import SamplingProfiler
+
+# Token for the admin endpoints, without one they do not exist (404)
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+# Longest profile that can be requested, in seconds
+PROFILER_MAX_SECONDS = float(os.getenv('PROFILER_MAX_SECONDS', '60'))
+
+router = APIRouter(prefix="/admin", tags=["admin"], include_in_schema=False)
+
+logger = logging.getLogger("app.admin")
+
+_profiling = threading.Lock()  # only one profile at a time per process
+
+
+def verify_admin(token: str | None):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if token is None or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+@router.get("/profile")
+async def profile(seconds: float = Query(10.0, gt=0),
+                  output: Literal["collapsed", "speedscope"] = Query("collapsed", alias="format"),
+                  focus: bool = Query(False, description="only frames of logic/ and routers/game.py"),
+                  x_admin_token: str | None = Header(None)):
+    """
+    Samples the event loop thread of this process for ``seconds`` and returns where the time went (see
+    ``util/profiler.py``). The loop keeps serving games meanwhile, this request only waits.
+    """
+    verify_admin(x_admin_token)
+    if seconds > PROFILER_MAX_SECONDS:
+        raise HTTPException(status_code=422, detail=f"At most {PROFILER_MAX_SECONDS:g} seconds")
+    if not _profiling.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    try:
+        # Dieser Handler läuft im Thread der Event-Loop
+        profiler = SamplingProfiler(threading.get_ident())
+        logger.info("profile started", extra={"fields": {"seconds": seconds, "focus": focus}})
+        profiler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            # join() wartet auf den Sampler-Thread, die Loop soll dabei weiterlaufen
+            await asyncio.to_thread(profiler.stop)
+    finally:
+        _profiling.release()
+
+    if output == "speedscope":
+        return JSONResponse(profiler.speedscope(f"event loop, {profiler.duration:.1f} s", focus))
+    return PlainTextResponse(profiler.collapsed(focus))
@@ -1,38 +1,62 @@
-import asyncio
-import json
+import logging
 import time
 from math import floor
 from typing import Annotated
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException
 from fastapi import Path
-from sqlalchemy import text
-from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette.websockets import WebSocket, WebSocketDisconnect
 
-from database import engine
+from database import AsyncSessionLocal
 from dependencies import get_db, verify_jwt
-from logic.lügen import game_decision as game_decision_lügen
-from logic.maumau import game_decision as game_decision_maumau, ACTION, ACTION_END, WINNER
-from logic.maumau import get_next_player, get_hand_counts, ACTION_TURN, ACTION_CARD_COUNT
+from logic.lügen import apply as apply_lügen, handle_turn_timeout as turn_timeout_lügen
+from logic.maumau import apply as apply_maumau, handle_turn_timeout as turn_timeout_maumau
+from logic.maumau import CURRENT_PLAYER
 from models.game import GameModel
-from models.user import UserModel
 from schemas.game import GameCreateSchema, GameSchema
-from util.generic import GameLock, generate_random_number_and_check_if_exists, send_to_all
+from util import codec, handoff, wire
+from util.actor import GameScheduler
+from util.auth_cache import Principal
+from util.broker import GameConnections
+from util.changes import track_changes
+from util.codec import FrameTooLargeError
+from util.connection import Connection, Frame, batched
+from util.game_store import GameOwnedElsewhere, GameStore
+from util.generic import generate_random_number_and_check_if_exists
+from util.logs import log_action, log_state
+from util.metrics import ACTION_SECONDS, TURN_TIMEOUTS, Gauge, track_scheduler
+from util.outbox import deliver
+from util.timers import TimerService, turn_deadline
 
 router = APIRouter(prefix="/game", tags=["game"])
 
-lock = GameLock()
+logger = logging.getLogger("app.game")
 
-# Globale Dictionaries, um die aktiven Websocket-Verbindungen und Timeout-Tasks pro Spiel zu verwalten
-websocket_connections = {}  # {game_id: {user_id: websocket, ...}}
-turn_timeout_tasks = {}  # {game_id: asyncio.Task}
+scheduler = GameScheduler()
+track_scheduler(scheduler)
+# affinity.py routet die Sockets eines Spiels zu dem Worker, der es hält
+game_store = GameStore(on_claim=handoff.report_claimed, on_release=handoff.report_released)
+
+# Das Spiel liegt (noch) bei einem anderen Prozess, der Client soll sich neu verbinden
+CLOSE_CODE_TRY_AGAIN = 1013
+
+# Globales Dictionary, um die aktiven Websocket-Verbindungen pro Spiel zu verwalten
+websocket_connections = {}  # {game_id: GameConnections({user_id: Connection, ...})}
+
+# Reine Spiellogik je Spieltyp; die Nachrichten verschickt process_message
+ENGINES = {"MAU_MAU": apply_maumau, "LÜGEN": apply_lügen}
+
+Gauge("game_active_games", "Games held in memory by this process.", lambda: len(game_store.games))
+Gauge("game_active_connections", "Open game sockets of this process.",
+      lambda: sum(len(connections) for connections in websocket_connections.values()))
 
 
 @router.get("/{game_code}", response_model=GameSchema)
 async def game_get(game_code: Annotated[str, Path(min_length=6, max_length=6, pattern="^[0-9]*$")],
-                   db: Session = Depends(get_db), user: UserModel = Depends(verify_jwt)):
-    game = db.query(GameModel).filter_by(code=game_code).one()
+                   db: AsyncSession = Depends(get_db), user: Principal = Depends(verify_jwt)):
+    game = (await db.execute(select(GameModel).filter_by(code=game_code))).scalar_one()
     return {
         "id":                    game.id,
         "type":                  game.type,
@@ -47,7 +71,8 @@ async def game_get(game_code: Annotated[str, Path(min_length=6, max_length=6, pa
 
 
 @router.post("", response_model=GameSchema)
-async def game_create(game: GameCreateSchema, db: Session = Depends(get_db), user: UserModel = Depends(verify_jwt)):
+async def game_create(game: GameCreateSchema, db: AsyncSession = Depends(get_db),
+                      user: Principal = Depends(verify_jwt)):
     max_players = (
         min(floor((game.deck_size - 10) / game.number_of_start_cards), 8)
         if game.type == "maumau"
@@ -55,7 +80,7 @@ async def game_create(game: GameCreateSchema, db: Session = Depends(get_db), use
     )
     new_game = GameModel(
         type=game.type,
-        code=generate_random_number_and_check_if_exists(6, db),
+        code=await generate_random_number_and_check_if_exists(6, db),
         settings={
             "max_players":           max_players,
             "deck_size":             game.deck_size,
@@ -68,7 +93,7 @@ async def game_create(game: GameCreateSchema, db: Session = Depends(get_db), use
         players={}
     )
     db.add(new_game)
-    db.commit()
+    await db.commit()
     return {
         "id":                    new_game.id,
         "type":                  new_game.type,
@@ -84,202 +109,255 @@ async def game_create(game: GameCreateSchema, db: Session = Depends(get_db), use
 
 @router.websocket("/ws/{game_id}")
 async def game_socket(websocket: WebSocket, game_id: str):
-    with sessionmaker(bind=engine)() as db_conn:
-        token = websocket.query_params.get("token")
-        if not token:
-            await websocket.close()
-            return
-
-        user = verify_jwt(db=db_conn, token=token)
-        if not user:
-            await websocket.close()
-            return
-
-        _game = db_conn.query(GameModel).filter_by(id=game_id).first()
-        if not _game:
-            await websocket.close()
-            return
-        game_id = str(_game.id)
+    token = websocket.query_params.get("token")
+    if not token:
+        await websocket.close()
+        return
 
-    if game_id not in websocket_connections:
-        websocket_connections[game_id] = {}
-    websocket_connections[game_id][user.id] = websocket
-
-    await websocket.accept()
-    print(f"Connected to game {game_id} as {user.id} ({user.username})")
+    async with AsyncSessionLocal() as db_conn:
+        try:
+            user = await verify_jwt(db=db_conn, token=token)
+        except HTTPException:
+            user = None
+    if not user:
+        await websocket.close()
+        return
+
+    try:
+        game = await game_store.get(game_id)
+    except GameOwnedElsewhere:
+        await websocket.accept()
+        await websocket.close(code=CLOSE_CODE_TRY_AGAIN)
+        return
+    if game is None:
+        await websocket.close()
+        return
 
-    # Starte den Turn-Timeout-Task, falls noch nicht vorhanden
-    if game_id not in turn_timeout_tasks:
-        turn_timeout_tasks[game_id] = asyncio.create_task(turn_timeout_loop(game_id))
+    if game_id not in websocket_connections:
+        websocket_connections[game_id] = GameConnections(game_id)
+    connections = websocket_connections[game_id]
+    subprotocol = wire.choose_subprotocol(websocket.scope.get("subprotocols", ()))
+    connection = Connection(websocket, batch=websocket.query_params.get("batch") in ("1", "true"),
+                            events=connections.events, user_id=user.id, binary=subprotocol is not None)
+    connections[user.id] = connection
+    # Verpasste Ereignisse werden vor allen neuen eingereiht (kein await dazwischen)
+    last_seq = websocket.query_params.get("last_seq")
+    needs_snapshot = last_seq is not None and not replay_events(connection, last_seq)
+
+    await websocket.accept(subprotocol=subprotocol)
+    connection.start()
+    logger.info("connected", extra={"fields": {"game_id": game_id, "user_id": user.id, "last_seq": last_seq}})
+
+    # Nach einem Neustart gibt es für laufende Spiele noch keinen Timer
+    arm_turn_timer(game_id, game.state)
+
+    if needs_snapshot:
+        try:
+            await scheduler.submit(game_id, lambda: send_snapshot(connection, game_id, user))
+        except Exception:
+            logger.exception("snapshot failed", extra={"fields": {"game_id": game_id, "user_id": user.id}})
 
     while True:
         try:
-            message = await websocket.receive_json()
-            print(f"Received message: {message} from {user.id} in game {game_id}")
+            data = await receive_frame(websocket)
+            if connection.binary and isinstance(data, bytes):
+                message = wire.decode_frame(data)
+            else:
+                message = codec.decode_frame(data)
+        except FrameTooLargeError:
+            await connection.send_json({"error": "frame_too_large"})
+            continue
         except WebSocketDisconnect as e:
-            print(f"Disconnected from game {game_id} as {user.id} ({user.username})")
-            if user.id in websocket_connections.get(game_id, {}):
-                del websocket_connections[game_id][user.id]
+            logger.info("disconnected", extra={"fields": {"game_id": game_id, "user_id": user.id}})
+            connection.stop()
             break
         except Exception as e:
-            await websocket.send_json({"unknown_error": str(e)})
-            await websocket.close()
-            print(f"Unknown Error: {e}")
+            await connection.send_json({"unknown_error": str(e)})
+            await connection.close()
+            logger.exception("receive failed", extra={"fields": {"game_id": game_id, "user_id": user.id}})
             break
 
-        while not lock.acquire(game_id):
-            await asyncio.sleep(0.1)
-
+        received = time.perf_counter()
         try:
-            with sessionmaker(bind=engine)() as db_conn:
-                data = db_conn.execute(text("SELECT * FROM game WHERE id = :id"), {"id": game_id})
-                game_list = data.mappings().all()
-                if not game_list:
-                    await websocket.send_json({"error": "game_not_found"})
-                    return
-
-                game_data = game_list[0]
-                state = json.loads(game_data["state"]) if isinstance(game_data["state"], str) else game_data["state"]
-                players = json.loads(game_data["players"]) if isinstance(game_data["players"], str) else game_data[
-                    "players"]
-                settings = json.loads(game_data["settings"]) if isinstance(game_data["settings"], str) else game_data[
-                    "settings"]
-
-                print(f"Game state: {state}")
-                print(f"Game players: {players}")
-                print(f"Game settings: {settings}")
-
-                if game_data["type"] == "MAU_MAU":
-                    new_state, new_players = await game_decision_maumau(
-                        websocket, websocket_connections[game_id], message, state, players, settings, user
-                    )
-                elif game_data["type"] == "LÜGEN":
-                    new_state, new_players = await game_decision_lügen(
-                        websocket, websocket_connections[game_id], message, state, players, settings, user
-                    )
-                else:
-                    await websocket.send_json({"error": "unknown_game_type"})
-                    continue
-
-                print(f"Game state after: {new_state}")
-                print(f"Game players after: {new_players}")
-
-                state_str = json.dumps(new_state)
-                players_str = json.dumps(new_players)
-                db_conn.execute(
-                    text("UPDATE game SET state = :state, players = :players WHERE id = :id"),
-                    {"state": state_str, "players": players_str, "id": game_id}
-                )
-                db_conn.flush()
-                db_conn.commit()
+            if not await scheduler.submit(
+                    game_id, lambda: process_message(connection, game_id, message, user, len(data), received)
+            ):
+                break
+        except GameOwnedElsewhere:
+            await connection.close(CLOSE_CODE_TRY_AGAIN)
+            break
         except Exception as e:
-            await websocket.send_json({"unknown_error_session": str(e)})
-            await websocket.close()
-            print(f"Unknown Error: {e}")
+            await connection.send_json({"unknown_error_session": str(e)})
+            await connection.close()
+            logger.exception("action failed", extra={"fields": {"game_id": game_id, "user_id": user.id}})
             break
-        finally:
-            lock.release(game_id)
+
+    # Nur entfernen, wenn der Spieler sich nicht inzwischen neu verbunden hat
+    if websocket_connections.get(game_id, {}).get(user.id) is connection:
+        del websocket_connections[game_id][user.id]
+
+    if not websocket_connections.get(game_id):
+        try:
+            await scheduler.submit(game_id, lambda: release_game(game_id))
+        except Exception:
+            logger.exception("release failed", extra={"fields": {"game_id": game_id}})
 
 
-async def turn_timeout_loop(game_id: str):
+async def receive_frame(websocket: WebSocket) -> str | bytes:
+    """Wie ``receive_text``, nimmt aber auch binäre Nachrichten (MessagePack) an."""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+    return message["text"] if message.get("text") is not None else message["bytes"]
+
+
+def replay_events(connection: Connection, last_seq: str) -> bool:
     """
-    Prüft alle 5 Sekunden, ob der aktuelle Spieler länger als 45 Sekunden am Zug ist.
-    Falls ja, wird dieser Spieler aus dem Spiel entfernt. Ist danach nur noch ein Spieler übrig,
-    wird das Spiel beendet.
+    Reiht die Ereignisse nach ``last_seq`` für einen wieder verbundenen Spieler ein.
+    Gibt False zurück, wenn sie nicht mehr alle vorliegen, dann braucht der Spieler einen Snapshot.
     """
-    while True:
-        await asyncio.sleep(5)  # Überprüfe alle 5 Sekunden
-        while not lock.acquire(game_id):
-            await asyncio.sleep(0.1)
+    try:
+        missed = connection.events.since(int(last_seq), connection.user_id)
+    except ValueError:
+        return False
+    if missed is None or len(missed) > connection.max_queue:
+        return False
+    for frame in missed:
+        connection.enqueue_frame(frame)
+    return True
+
+
+async def send_snapshot(connection: Connection, game_id: str, user):
+    """Schickt den aktuellen Stand (Spiel- oder Lobby-Daten) statt der verpassten Ereignisse."""
+    game = await game_store.get(game_id)
+    if game is None:
+        return
+    started = game.state.get("started") and user.id in game.players
+    await process_message(connection, game_id, {"action": "request_game_data" if started else "request_lobby_data"},
+                          user)
+
+
+async def release_game(game_id: str):
+    """
+    Speichert ein Spiel ohne verbundene Spieler und entfernt es aus dem Speicher. Danach kann es auch von einem
+    anderen Prozess übernommen werden (siehe affinity.py).
+    """
+    if websocket_connections.get(game_id):
+        return  # Inzwischen hat sich wieder jemand verbunden
+    websocket_connections.pop(game_id, None)
+    turn_timers.cancel(game_id)
+    await game_store.evict(game_id)
+
+
+async def process_message(connection: Connection, game_id: str, message: dict, user, payload_size: int = 0,
+                          received: float = None) -> bool:
+    """
+    Führt eine Aktion eines Spielers aus. Läuft immer im Actor des Spiels.
+    Gibt False zurück, wenn das Spiel nicht mehr existiert.
+    ``received``: ``perf_counter()`` beim Empfang, für die Wartezeit im Actor (``/metrics``).
+    """
+    loading = time.perf_counter()
+    game = await game_store.get(game_id)
+    if game is None:
+        await connection.send_json({"error": "game_not_found"})
+        return False
+
+    start = time.perf_counter()
+    action = message.get("action") if isinstance(message, dict) else None  # wird von der Spiellogik entfernt
+    apply = ENGINES.get(game.type)
+    if apply is None:
+        await connection.send_json({"error": "unknown_game_type"})
+        return True
+
+    # Alle Nachrichten einer Aktion gehen an Clients im Batch-Modus als ein einziger Frame raus,
+    # gespeichert wird nur, was die Spiellogik als geändert meldet
+    connections = websocket_connections[game_id]
+    with batched([connection, *connections.values()]), track_changes() as changes:
         try:
-            with sessionmaker(bind=engine)() as db_conn:
-                data = db_conn.execute(text("SELECT * FROM game WHERE id = :id"), {"id": game_id})
-                game_list = data.mappings().all()
-                if not game_list:
-                    break  # Spiel existiert nicht mehr
-                game_data = game_list[0]
-                state = json.loads(game_data["state"]) if isinstance(game_data["state"], str) else game_data["state"]
-                players = json.loads(game_data["players"]) if isinstance(game_data["players"], str) else game_data[
-                    "players"]
-
-                # Falls das Spiel noch nicht gestartet wurde, beenden wir den Loop
-                if not state.get("started"):
-                    break
-
-                current_player = state.get("CURRENT_PLAYER")
-                if not current_player:
-                    continue
-
-                turn_start_time = state.get("turn_start_time")
-                if not turn_start_time:
-                    state["turn_start_time"] = time.time()
-                    state_str = json.dumps(state)
-                    db_conn.execute(text("UPDATE game SET state = :state WHERE id = :id"),
-                                    {"state": state_str, "id": game_id})
-                    db_conn.commit()
-                    continue
-
-                now = time.time()
-                if now - turn_start_time > 45:  # Timeout von 45 Sekunden
-                    removed_player = current_player
-                    print(f"Player {removed_player} timed out and will be removed from game {game_id}")
-
-                    # Informiere alle Clients über die Timeout-Entfernung
-                    await send_to_all(websocket_connections[game_id], {
-                        "action": "timeout_penalty",
-                        "player": current_player
-                    })
-
-                    # Optional: Die Handkarten des Spielers können (falls gewünscht) dem Ablagestapel hinzugefügt werden
-                    if removed_player in players:
-                        state["DISCARD_PILE"] = players[removed_player].get("HAND", []) + state.get("DISCARD_PILE", [])
-                        del players[removed_player]
-
-                    # if removed_player in websocket_connections.get(game_id, {}):
-                    #     del websocket_connections[game_id][removed_player]
-
-                    # Prüfe, ob nach Entfernen nur noch ein Spieler übrig bleibt
-                    if len(players) <= 1:
-                        winner = state[WINNER][0] if state[WINNER] else None
-                        await send_to_all(websocket_connections[game_id], {
-                            ACTION: ACTION_END,
-                            WINNER: winner
-                        })
-                        state = {
-                            "started":        False,
-                            "CURRENT_PLAYER": "",
-                            "DISCARD_PILE":   [],
-                            "DRAW_PILE":      [],
-                            "COUNT_7":        0,
-                            "J_CHOICE":       "",
-                            "WINNER":         []
-                        }
-                        players = {}
-                    else:
-                        new_current = get_next_player(removed_player, players)
-                        state["CURRENT_PLAYER"] = new_current
-                        state["turn_start_time"] = time.time()
-                        await send_to_all(websocket_connections[game_id], {
-                            ACTION:   ACTION_TURN,
-                            "player": new_current
-                        })
-
-                        await send_to_all(websocket_connections[game_id], {
-                            ACTION:               ACTION_CARD_COUNT,
-                            "DISCARD_PILE_COUNT": len(state.get("DISCARD_PILE", [])),
-                            "DRAW_PILE_COUNT":    len(state.get("DRAW_PILE", [])),
-                            "HAND_COUNT":         get_hand_counts(players)
-                        })
-
-                    state_str = json.dumps(state)
-                    players_str = json.dumps(players)
-                    db_conn.execute(
-                        text("UPDATE game SET state = :state, players = :players WHERE id = :id"),
-                        {"state": state_str, "players": players_str, "id": game_id}
-                    )
-                    db_conn.commit()
-        except Exception as e:
-            print(f"Error in turn timeout loop for game {game_id}: {e}")
-        finally:
-            lock.release(game_id)
-    turn_timeout_tasks.pop(game_id, None)
+            new_state, new_players, outbox = apply(message, game.state, game.players, game.settings, user)
+        except Exception:
+            # Die Spiellogik ändert state und players direkt, ein halb ausgeführter Zug darf nicht im Speicher bleiben
+            await game_store.discard(game_id)
+            raise
+        decided = time.perf_counter()
+        await deliver(outbox, connection, connections)
+    delivered = time.perf_counter()
+
+    await game_store.update(game, new_state, new_players, changes)
+    arm_turn_timer(game_id, new_state)
+    persisted = time.perf_counter()
+
+    label = action if isinstance(action, str) else "none"
+    if received is not None:
+        ACTION_SECONDS.observe(loading - received, label, "lock_wait")
+    ACTION_SECONDS.observe(start - loading, label, "load")
+    ACTION_SECONDS.observe(decided - start, label, "decision")
+    ACTION_SECONDS.observe(delivered - decided, label, "broadcast")
+    ACTION_SECONDS.observe(persisted - delivered, label, "persist")
+    log_action(game_id, user.id, action, persisted - start, payload_size, changed=bool(changes))
+    log_state(game_id, new_state, new_players, game.settings)
+    return True
+
+
+def deliver_remote(game_id: str, user_id: str | None, frame: Frame):
+    """Stellt ein Ereignis aus einem anderen Prozess den hier verbundenen Spielern zu."""
+    connections = websocket_connections.get(game_id)
+    if not connections:
+        return
+    if user_id is None:
+        for connection in connections.values():
+            connection.enqueue_frame(frame)
+    elif user_id in connections:
+        connections[user_id].enqueue_frame(frame)
+
+
+def arm_turn_timer(game_id: str, state: dict):
+    """Stellt den Timer auf das Ende des aktuellen Zugs (oder entfernt ihn, wenn kein Zug läuft)."""
+    deadline = turn_deadline(state)
+    if deadline is None:
+        turn_timers.cancel(game_id)
+    else:
+        turn_timers.arm(game_id, deadline, state.get(CURRENT_PLAYER))
+
+
+def on_turn_timeout(game_id: str, player_id: str):
+    # Läuft wie eine Spieleraktion durch den Actor des Spiels
+    scheduler.post(game_id, lambda: process_turn_timeout(game_id, player_id))
+
+
+turn_timers = TimerService(on_turn_timeout)
+
+
+async def process_turn_timeout(game_id: str, player_id: str):
+    """
+    Entfernt einen Spieler, dessen Zugzeit abgelaufen ist. Ist danach nur noch ein Spieler übrig,
+    wird das Spiel beendet.
+    """
+    try:
+        game = await game_store.get(game_id)
+    except GameOwnedElsewhere:
+        turn_timers.cancel(game_id)  # der andere Prozess hat einen eigenen Timer
+        return
+    if game is None:
+        return
+    state = game.state
+    deadline = turn_deadline(state)
+    # Inzwischen kann der Zug gewechselt haben, dann wurde der Timer bereits neu gestellt
+    if deadline is None or deadline > time.time() or state.get(CURRENT_PLAYER) != player_id \
+            or player_id not in game.players:
+        return
+
+    if game.type == "MAU_MAU":
+        handle_turn_timeout = turn_timeout_maumau
+    elif game.type == "LÜGEN":
+        handle_turn_timeout = turn_timeout_lügen
+    else:
+        return
+
+    logger.info("turn timeout", extra={"fields": {"game_id": game_id, "user_id": player_id}})
+    TURN_TIMEOUTS.inc(game.type)
+    connections = websocket_connections.get(game_id) or GameConnections(game_id)
+    with batched(connections.values()), track_changes() as changes:
+        new_state, new_players = await handle_turn_timeout(connections, state, game.players, game.settings, player_id)
+    await game_store.update(game, new_state, new_players, changes)
+    arm_turn_timer(game_id, new_state)
@@ -2,13 +2,15 @@ import io
 import os
 
 from fastapi import APIRouter, Depends, File, HTTPException, UploadFile
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 from starlette.responses import StreamingResponse
 
-from dependencies import get_db, verify_jwt
+from dependencies import get_current_user, get_db, invalidate_user, verify_jwt
 from models.user import UserModel
 from schemas.user import UserCreateSchema, UserLoginSchema, UserPasswordChangeSchema, UserSchema
+from util.auth_cache import Principal
 from util.generic import gen_token, generate_random_string
 from util.guestname import generate_random_name_and_check_if_exists
 
@@ -18,43 +20,44 @@ router = APIRouter(prefix="/user", tags=["user"])
 
 
 @router.get("/{user_id}", response_model=UserSchema)
-async def get_user(user_id: str, db: Session = Depends(get_db), user: UserModel = Depends(verify_jwt)):
-    return db.query(UserModel).filter_by(id=user_id).one()
+async def get_user(user_id: str, db: AsyncSession = Depends(get_db), user: Principal = Depends(verify_jwt)):
+    return (await db.execute(select(UserModel).filter_by(id=user_id))).scalar_one()
 
 
 @router.get("", response_model=list[UserSchema])
-async def user_list(db: Session = Depends(get_db), user: UserModel = Depends(verify_jwt)):
-    return db.query(UserModel).all()
+async def user_list(db: AsyncSession = Depends(get_db), user: Principal = Depends(verify_jwt)):
+    return (await db.scalars(select(UserModel))).all()
 
 
 @router.post("/register", response_model=UserLoginSchema)
-async def user_create(user: UserCreateSchema, db: Session = Depends(get_db)):
+async def user_create(user: UserCreateSchema, db: AsyncSession = Depends(get_db)):
     new_user = UserModel(
         username=user.username
     )
     new_user.set_password(user.password)
     db.add(new_user)
-    db.commit()
+    await db.commit()
     token = gen_token(new_user)
     return {"jwt_token": token.encode("UTF-8"), "username": new_user.username, "id": new_user.id}
 
 
 @router.put("/password", response_model=UserSchema)
-async def user_changepassword(password_data: UserPasswordChangeSchema, db: Session = Depends(get_db),
-                              user: UserModel = Depends(verify_jwt)):
+async def user_changepassword(password_data: UserPasswordChangeSchema, db: AsyncSession = Depends(get_db),
+                              user: UserModel = Depends(get_current_user)):
     if not user.verify_password(password_data.old_password):
         raise HTTPException(
             status_code=status.HTTP_406_NOT_ACCEPTABLE,
             detail="Invalid current password"
         )
     user.set_password(password_data.new_password)
-    db.commit()
+    await db.commit()
+    invalidate_user(user.id)
     return user
 
 
 @router.post("/login", response_model=UserLoginSchema)
-async def user_login(user_data: UserCreateSchema, db: Session = Depends(get_db)):
-    user = db.query(UserModel).filter_by(username=user_data.username).one()
+async def user_login(user_data: UserCreateSchema, db: AsyncSession = Depends(get_db)):
+    user = (await db.execute(select(UserModel).filter_by(username=user_data.username))).scalar_one()
     if not user.verify_password(user_data.password):
         raise HTTPException(
             status_code=status.HTTP_406_NOT_ACCEPTABLE,
@@ -65,23 +68,24 @@ async def user_login(user_data: UserCreateSchema, db: Session = Depends(get_db))
 
 
 @router.post("/guest", response_model=UserLoginSchema)
-async def guest_login(db: Session = Depends(get_db)):
+async def guest_login(db: AsyncSession = Depends(get_db)):
     new_user = UserModel(
         guest=True,
-        username=generate_random_name_and_check_if_exists(db)
+        username=await generate_random_name_and_check_if_exists(db)
     )
     new_user.set_password(generate_random_string(15))
 
     db.add(new_user)
-    db.commit()
+    await db.commit()
     token = gen_token(new_user)
     return {"jwt_token": token.encode("UTF-8"), "username": new_user.username, "id": new_user.id}
 
 
 # noinspection PyTypeChecker
 @router.get("/{user_id}/profile_picture", response_class=StreamingResponse)
-async def get_profile_picture(user_id: str, db: Session = Depends(get_db), user: UserModel = Depends(verify_jwt)):
-    user = db.query(UserModel).filter_by(id=user_id).one()
+async def get_profile_picture(user_id: str, db: AsyncSession = Depends(get_db),
+                              user: Principal = Depends(verify_jwt)):
+    user = (await db.execute(select(UserModel).filter_by(id=user_id))).scalar_one()
     if not user.profile_picture_data:
         raise HTTPException(status_code=404, detail="Profile picture not found")
     file_like = io.BytesIO(user.profile_picture_data)
@@ -90,8 +94,8 @@ async def get_profile_picture(user_id: str, db: Session = Depends(get_db), user:
 
 
 @router.put("/profile_picture", response_model=UserSchema)
-async def set_profile_picture(profile_picture: UploadFile = File(), db: Session = Depends(get_db),
-                              user: UserModel = Depends(verify_jwt)):
+async def set_profile_picture(profile_picture: UploadFile = File(), db: AsyncSession = Depends(get_db),
+                              user: UserModel = Depends(get_current_user)):
     if not profile_picture:
         raise HTTPException(status_code=400, detail="No file provided")
     if not profile_picture.content_type:
@@ -101,14 +105,14 @@ async def set_profile_picture(profile_picture: UploadFile = File(), db: Session
     user.profile_picture_data = await profile_picture.read()
     user.profile_picture_type = profile_picture.content_type
     user.profile_picture_name = profile_picture.filename
-    db.commit()
+    await db.commit()
     return user
 
 
 @router.delete("/profile_picture", response_model=UserSchema)
-async def delete_profile_picture(db: Session = Depends(get_db), user: UserModel = Depends(verify_jwt)):
+async def delete_profile_picture(db: AsyncSession = Depends(get_db), user: UserModel = Depends(get_current_user)):
     user.profile_picture_data = None
     user.profile_picture_type = None
     user.profile_picture_name = None
-    db.commit()
+    await db.commit()
     return user
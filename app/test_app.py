@@ -274,3 +274,1067 @@ def test_user_profile_image_delete(test_client, jwt_token):
 
     delete_resp = test_client.delete(f"/user/profile_picture", headers={"Authorization": user_jwt})
     assert delete_resp.status_code == 200
+
+
+# AUTH CACHE TESTS
+def test_principal_cache_lru_and_expiry():
+    import time
+    from util.auth_cache import Principal, PrincipalCache
+
+    cache = PrincipalCache(max_size=2, ttl=60)
+    alice, bob = Principal("a", "alice", False), Principal("b", "bob", True)
+    cache.put("token-a", alice)
+    cache.put("token-b", bob)
+    assert cache.get("token-a") is alice
+    cache.put("token-a2", alice)
+    assert cache.get("token-b") is None  # least recently used
+    assert len(cache) == 2
+
+    cache.put("expired", bob, exp=time.time() - 1)
+    assert cache.get("expired") is None
+
+    cache.invalidate_user("a")
+    assert len(cache) == 0
+
+
+def test_verify_jwt_uses_cache(test_client, jwt_token):
+    import asyncio
+    from dependencies import verify_jwt
+    from util.auth_cache import principal_cache
+
+    headers = {"Authorization": jwt_token}
+    user_id = test_client.get("/user", headers=headers).json()[0]["id"]
+    principal = principal_cache.get(jwt_token)
+    assert principal is not None and principal.id == user_id
+
+    # Ein Treffer braucht keine Datenbank-Session
+    assert asyncio.run(verify_jwt(db=None, token=jwt_token)) is principal
+
+    response = test_client.put(
+        "/user/password",
+        json={"old_password": "NewValidPass!123", "new_password": "NewValidPass!123"},
+        headers=headers,
+    )
+    assert response.status_code == 200
+    assert principal_cache.get(jwt_token) is None
+
+
+# GAME STATE STORE TESTS
+def test_game_store_persists_on_flush(test_client, jwt_token):
+    import asyncio
+    from models.game import GameModel
+    from routers.game import game_store
+    from sqlalchemy.orm import sessionmaker
+
+    headers = {"Authorization": jwt_token}
+    request_data = {
+        "type":                  "maumau",
+        "deck_size":             32,
+        "number_of_start_cards": 5,
+        "gamemode":              "gamemode_classic"
+    }
+    game_id = test_client.post("/game", json=request_data, headers=headers).json()["id"]
+
+    with test_client.websocket_connect(f"/game/ws/{game_id}?token={jwt_token}") as websocket:
+        websocket.send_json({"action": "join"})
+        assert websocket.receive_json()["action"] == "join"
+
+    assert len(asyncio.run(game_store.get(game_id)).players) == 1
+    asyncio.run(game_store.flush())
+    with sessionmaker(bind=engine)() as db:
+        assert len(db.query(GameModel).filter_by(id=game_id).one().players) == 1
+
+
+def test_game_store_skips_unchanged_actions(test_client, jwt_token):
+    import asyncio
+    from routers.game import game_store
+
+    headers = {"Authorization": jwt_token}
+    request_data = {
+        "type":                  "maumau",
+        "deck_size":             32,
+        "number_of_start_cards": 5,
+        "gamemode":              "gamemode_classic"
+    }
+    game_id = test_client.post("/game", json=request_data, headers=headers).json()["id"]
+
+    with test_client.websocket_connect(f"/game/ws/{game_id}?token={jwt_token}") as websocket:
+        websocket.send_json({"action": "join"})
+        assert websocket.receive_json()["action"] == "join"
+        entry = asyncio.run(game_store.get(game_id))
+        assert entry.changes.players and entry.pending_actions == 1
+        asyncio.run(game_store.persist(entry))
+        assert not entry.dirty
+
+        # Wird nur mit einem Fehler beantwortet und ändert nichts am Spiel
+        websocket.send_json({"action": "join"})
+        assert "error" in websocket.receive_json()
+
+    assert not entry.dirty
+    assert entry.pending_actions == 0
+
+
+
+def test_failed_action_reloads_persisted_game(test_client, jwt_token, monkeypatch):
+    import asyncio
+    import routers.game
+    from routers.game import game_store
+
+    headers = {"Authorization": jwt_token}
+    guest_token = test_client.post("/user/guest").json()["jwt_token"]
+    request_data = {
+        "type":                  "maumau",
+        "deck_size":             32,
+        "number_of_start_cards": 5,
+        "gamemode":              "gamemode_classic"
+    }
+    game_id = test_client.post("/game", json=request_data, headers=headers).json()["id"]
+
+    def broken_apply(message, state, players, settings, user):
+        # Ändert den Stand und scheitert dann mitten in der Aktion
+        state["started"] = True
+        players.clear()
+        raise KeyError("last_player")
+
+    with test_client.websocket_connect(f"/game/ws/{game_id}?token={guest_token}") as other:
+        other.send_json({"action": "join"})
+        assert other.receive_json()["action"] == "join"
+        with test_client.websocket_connect(f"/game/ws/{game_id}?token={jwt_token}") as websocket:
+            websocket.send_json({"action": "join"})
+            assert websocket.receive_json()["action"] == "join"
+            asyncio.run(game_store.flush())
+            monkeypatch.setitem(routers.game.ENGINES, "MAU_MAU", broken_apply)
+            websocket.send_json({"action": "ready", "ready": True})
+            assert "unknown_error_session" in websocket.receive_json()
+        monkeypatch.undo()
+
+        # Der andere Spieler ist noch verbunden, das Spiel kommt trotzdem neu aus der Datenbank
+        entry = asyncio.run(game_store.get(game_id))
+        assert not entry.state["started"] and len(entry.players) == 2
+
+
+def test_game_store_single_owner(test_client, jwt_token):
+    import asyncio
+    from models.game import GameModel
+    from sqlalchemy.orm import sessionmaker
+    from util.game_store import GameOwnedElsewhere, GameStore
+
+    headers = {"Authorization": jwt_token}
+    request_data = {
+        "type":                  "maumau",
+        "deck_size":             32,
+        "number_of_start_cards": 5,
+        "gamemode":              "gamemode_classic"
+    }
+    game_id = test_client.post("/game", json=request_data, headers=headers).json()["id"]
+
+    async def run():
+        # Zwei Worker mit demselben Spiel
+        first, second = GameStore(owner="worker-1"), GameStore(owner="worker-2")
+        entry = await first.get(game_id)
+        with pytest.raises(GameOwnedElsewhere):
+            await second.get(game_id)
+
+        await first.update(entry, {**entry.state, "marker": "first"}, entry.players)
+        await first.evict(game_id)  # speichert und gibt das Spiel frei
+        taken = await second.get(game_id)
+        assert taken.state["marker"] == "first"
+
+        # Eine veraltete Kopie kann den neuen Besitzer nicht überschreiben
+        first.games[game_id] = entry
+        entry.state = {**entry.state, "marker": "stale"}
+        entry.changes.full_state = True
+        with pytest.raises(GameOwnedElsewhere):
+            await first.persist(entry)
+        assert game_id not in first.games
+        await second.close()
+
+    asyncio.run(run())
+    with sessionmaker(bind=engine)() as db:
+        assert db.query(GameModel).filter_by(id=game_id).one().state["marker"] == "first"
+
+
+# SCHEDULER TESTS
+def test_game_scheduler_runs_jobs_in_order():
+    import asyncio
+    from util.actor import GameScheduler
+
+    async def run():
+        scheduler = GameScheduler(idle_timeout=0.05)
+        order = []
+
+        async def job(i):
+            await asyncio.sleep(0.001 * (5 - i))
+            order.append(i)
+            return i
+
+        results = await asyncio.gather(*(scheduler.submit("game", lambda i=i: job(i)) for i in range(5)))
+        assert scheduler.stats()["game"]["processed"] == 5
+        await asyncio.sleep(0.1)
+        assert "game" not in scheduler.actors
+        return order, results
+
+    order, results = asyncio.run(run())
+    assert order == [0, 1, 2, 3, 4]
+    assert results == [0, 1, 2, 3, 4]
+
+
+def test_game_scheduler_metrics():
+    import asyncio
+    from util import metrics
+    from util.actor import GameScheduler
+
+    async def run():
+        scheduler = GameScheduler()
+        metrics.track_scheduler(scheduler)
+        waits = metrics.ACTOR_QUEUE_WAIT.count()
+        release = asyncio.Event()
+        for game_id, jobs in (("a", 3), ("b", 1)):
+            for _ in range(jobs):
+                scheduler.post(game_id, release.wait)
+        await asyncio.sleep(0.01)
+        # Je Spiel läuft ein Job, der Rest wartet in der Inbox
+        depth = metrics._actor_queue_depth()
+        release.set()
+        await asyncio.sleep(0.01)
+        metrics._schedulers.remove(scheduler)
+        return depth, metrics.ACTOR_QUEUE_WAIT.count() - waits
+
+    depth, observed = asyncio.run(run())
+    assert depth == {("total",): 2, ("max",): 2}
+    assert observed == 4
+
+
+# CONNECTION TESTS
+class BlockedWebSocket:
+    def __init__(self):
+        self.sent = []
+        self.closed_with = None
+        self.release = None
+
+    async def send_text(self, frame):
+        await self.release.wait()
+        self.sent.append(frame)
+
+    async def close(self, code=1000):
+        self.closed_with = code
+
+
+def run_slow_consumer(policy, messages):
+    import asyncio
+    from util.connection import Connection
+
+    async def run():
+        websocket = BlockedWebSocket()
+        websocket.release = asyncio.Event()
+        connection = Connection(websocket, max_queue=2, policy=policy)
+        connection.start()
+        for message in messages:
+            connection.enqueue(message)
+        websocket.release.set()
+        await connection.close()
+        return websocket, connection
+
+    return asyncio.run(run())
+
+
+def test_connection_slow_consumer_drop():
+    websocket, connection = run_slow_consumer("drop", [{"action": "a"}, {"action": "b"}, {"action": "c"}])
+    assert websocket.sent == ['{"action":"a"}', '{"action":"b"}']
+    assert connection.dropped == 1
+
+
+def test_connection_slow_consumer_coalesce():
+    websocket, connection = run_slow_consumer("coalesce", [
+        {"action": "turn", "player": "1"}, {"action": "win"}, {"action": "turn", "player": "2"}
+    ])
+    assert websocket.sent == ['{"action":"win"}', '{"action":"turn","player":"2"}']
+
+
+def test_connection_slow_consumer_coalesce_disconnects_without_older_frame():
+    # Ein Frame, der nichts Älteres ersetzen kann, darf nicht still verloren gehen
+    websocket, connection = run_slow_consumer("coalesce", [
+        {"action": "turn", "player": "1"}, {"action": "card_count"}, {"action": "hand", "hand": []}
+    ])
+    assert websocket.sent == []
+    assert websocket.closed_with == 1013
+    assert connection.closed
+
+
+def test_connection_slow_consumer_disconnect():
+    websocket, connection = run_slow_consumer("disconnect", [{"action": "a"}, {"action": "b"}, {"action": "c"}])
+    assert websocket.sent == []
+    assert websocket.closed_with == 1013
+
+
+def test_send_to_all_encodes_once():
+    import asyncio
+    from util.connection import Connection
+    from util.generic import send_to_all
+
+    connections = {pid: Connection(BlockedWebSocket()) for pid in ("a", "b", "c")}
+    asyncio.run(send_to_all(connections, {"action": "turn", "player": "a"}))
+    frames = [connection.queue[0] for connection in connections.values()]
+    assert all(frame is frames[0] for frame in frames)
+    assert frames[0].text == '{"action":"turn","player":"a"}'
+
+
+# CODEC TESTS
+@pytest.mark.parametrize("backend", ["json", "orjson"])
+def test_codec_backends(backend):
+    from util import codec
+    if backend not in codec.BACKENDS:
+        pytest.skip(f"{backend} is not installed")
+
+    previous = codec.BACKEND
+    codec.use_backend(backend)
+    try:
+        message = {"action": "place_cards", "cards": [{"suit": "Hearts", "value": "10"}], "claimed_value": "Ü"}
+        assert codec.dumps(message) == '{"action":"place_cards","cards":[{"suit":"Hearts","value":"10"}],' \
+                                       '"claimed_value":"Ü"}'
+        assert codec.decode_frame(codec.dumps(message)) == message
+        with pytest.raises(codec.FrameTooLargeError):
+            codec.decode_frame("[" + "1," * 100 + "1]", max_size=100)
+    finally:
+        codec.use_backend(previous)
+
+
+def test_websocket_rejects_oversized_frame(test_client, jwt_token):
+    from util import codec
+
+    headers = {"Authorization": jwt_token}
+    request_data = {
+        "type":                  "maumau",
+        "deck_size":             32,
+        "number_of_start_cards": 5,
+        "gamemode":              "gamemode_classic"
+    }
+    game_id = test_client.post("/game", json=request_data, headers=headers).json()["id"]
+
+    with test_client.websocket_connect(f"/game/ws/{game_id}?token={jwt_token}") as websocket:
+        websocket.send_text('{"action": "join", "padding": "' + "x" * codec.MAX_FRAME_SIZE + '"}')
+        response = websocket.receive_json()
+        assert response["error"] == "frame_too_large"
+        websocket.send_json({"action": "request_lobby_data"})
+        assert websocket.receive_json()["action"] == "lobby_data"
+
+
+def test_websocket_batch_mode(test_client, jwt_token):
+    headers = {"Authorization": jwt_token}
+    request_data = {
+        "type":                  "maumau",
+        "deck_size":             32,
+        "number_of_start_cards": 5,
+        "gamemode":              "gamemode_classic"
+    }
+    game_id = test_client.post("/game", json=request_data, headers=headers).json()["id"]
+
+    with test_client.websocket_connect(f"/game/ws/{game_id}?token={jwt_token}&batch=1") as websocket:
+        websocket.send_json({"action": "join"})
+        events = websocket.receive_json()["events"]
+        assert [event["action"] for event in events] == ["join"]
+        websocket.send_json({"action": "join"})
+        assert [event["error"] for event in websocket.receive_json()["events"]] == ["player_already_joined"]
+
+
+# LOGGING TESTS
+def test_structured_logging():
+    import io
+    import json
+    from util.logs import setup_logging, shutdown_logging, log_action, log_state
+
+    stream = io.StringIO()
+    shutdown_logging()
+    setup_logging(stream)
+    try:
+        state = {"started": True, "DRAW_PILE": ["secret"]}
+        log_action("game", "user", "draw_card", 0.0015, 42, changed=True)
+        log_state("game", state, {}, {}, sample_rate=0)
+        log_state("game", state, {}, {}, sample_rate=1)
+        state["DRAW_PILE"].clear()
+    finally:
+        shutdown_logging()
+
+    records = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert len(records) == 2
+    assert records[0]["logger"] == "app.actions"
+    assert records[0]["action"] == "draw_card" and records[0]["payload_size"] == 42
+    assert records[0]["duration_ms"] == 1.5 and records[0]["changed"] is True
+    assert records[1]["logger"] == "app.state"
+    assert json.loads(records[1]["state"])["DRAW_PILE"] == ["secret"]
+
+
+# METRICS TESTS
+def test_metrics_histogram_and_label_cap():
+    from util.metrics import Histogram, OTHER
+
+    histogram = Histogram("test_seconds", "Test.", ("action",), buckets=(0.1, 1.0), max_series=2,
+                          registry=[], capped=("action",))
+    histogram.observe(0.05, "a")
+    histogram.observe(0.5, "a")
+    histogram.observe(5, "b")
+    histogram.observe(0.05, "c")  # über der Grenze, zählt als "other"
+    lines = histogram.render()
+    assert 'test_seconds_bucket{action="a",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{action="a",le="1.0"} 2' in lines
+    assert 'test_seconds_bucket{action="b",le="+Inf"} 1' in lines
+    assert 'test_seconds_count{action="a"} 2' in lines
+    assert histogram.count(OTHER) == 1 and histogram.count("c") == 0
+
+    # Nur die Labels der Clients werden zusammengefasst
+    phases = Histogram("test_phase_seconds", "Test.", ("action", "phase"), max_series=1, registry=[],
+                       capped=("action",))
+    phases.observe(0.1, "a", "load")
+    phases.observe(0.1, "b", "load")
+    phases.observe(0.1, "c", "persist")
+    assert phases.count(OTHER, "load") == 1 and phases.count(OTHER, "persist") == 1
+
+
+def test_metrics_endpoint(test_client, jwt_token):
+    headers = {"Authorization": jwt_token}
+    request_data = {
+        "type":                  "maumau",
+        "deck_size":             32,
+        "number_of_start_cards": 5,
+        "gamemode":              "gamemode_classic"
+    }
+    game_id = test_client.post("/game", json=request_data, headers=headers).json()["id"]
+    with test_client.websocket_connect(f"/game/ws/{game_id}?token={jwt_token}") as websocket:
+        websocket.send_json({"action": "join"})
+        assert websocket.receive_json()["action"] == "join"
+        response = test_client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = response.text
+    for phase in ("lock_wait", "load", "decision", "broadcast", "persist"):
+        assert f'game_action_seconds_count{{action="join",phase="{phase}"}}' in text
+    assert "game_active_connections 1" in text
+    assert 'ws_frames_sent_total{protocol="json"}' in text
+    assert 'http_request_duration_seconds_count{method="POST",route="/game",status="200"}' in text
+    assert 'password_hash_seconds_count{operation="hash"}' in text
+    assert 'db_pool_checkouts_total{engine="async"}' in text
+
+
+
+def test_admin_profile(test_client, monkeypatch):
+    from routers import admin
+    response = test_client.get("/admin/profile?seconds=0.1")
+    assert response.status_code == 404
+
+    monkeypatch.setattr(admin, "ADMIN_TOKEN", "secret")
+    assert test_client.get("/admin/profile?seconds=0.1").status_code == 403
+    assert test_client.get("/admin/profile?seconds=0.1", headers={"X-Admin-Token": "wrong"}).status_code == 403
+    assert test_client.get("/admin/profile?seconds=3600", headers={"X-Admin-Token": "secret"}).status_code == 422
+
+    response = test_client.get("/admin/profile?seconds=0.2", headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 200
+    lines = response.text.splitlines()
+    assert lines
+    for line in lines:
+        stack, count = line.rsplit(" ", 1)
+        assert stack and int(count) > 0
+
+    response = test_client.get("/admin/profile?seconds=0.2&format=speedscope", headers={"X-Admin-Token": "secret"})
+    profile = response.json()["profiles"][0]
+    assert profile["type"] == "sampled"
+    assert len(profile["samples"]) == len(profile["weights"]) > 0
+    frames = response.json()["shared"]["frames"]
+    assert all(0 <= index < len(frames) for sample in profile["samples"] for index in sample)
+
+
+def test_profiler_focus():
+    import threading
+    import time
+    from logic.maumau import get_hand_counts
+    from util.maumau import generate_card_deck, new_hand
+    from util.profiler import SamplingProfiler
+
+    players = {f"player-{i}": {"hand": new_hand(generate_card_deck(32)[:5])} for i in range(4)}
+    profiler = SamplingProfiler(threading.get_ident(), interval=0.001)
+    profiler.start()
+    end = time.perf_counter() + 0.3
+    while time.perf_counter() < end:
+        get_hand_counts(players)
+    profiler.stop()
+
+    assert "test_profiler_focus (test_app.py:" in profiler.collapsed()
+    lines = profiler.collapsed(focus=True).splitlines()
+    assert lines
+    # Nur noch Frames aus logic/ und routers/game.py
+    assert all(line.startswith("get_hand_counts (logic/maumau.py:") for line in lines)
+
+
+# TURN TIMER TESTS
+def test_timer_service_fires_in_deadline_order():
+    import asyncio
+    import time
+    from util.timers import TimerService
+
+    async def run():
+        fired = []
+        timers = TimerService(lambda key, payload: fired.append((key, payload)))
+        now = time.time()
+        timers.arm("a", now + 0.05, "first")
+        timers.arm("b", now + 0.02, "second")
+        timers.arm("c", now + 0.01)
+        timers.cancel("c")
+        timers.arm("a", now + 0.03, "replaced")
+        assert len(timers) == 2
+        await asyncio.sleep(0.1)
+        return fired, len(timers)
+
+    fired, remaining = asyncio.run(run())
+    assert fired == [("b", "second"), ("a", "replaced")]
+    assert remaining == 0
+
+
+def test_turn_timeout_removes_player(monkeypatch, jwt_token):
+    import time
+    import util.timers
+
+    monkeypatch.setattr(util.timers, "TURN_TIMEOUT", 0.3)
+    with TestClient(app) as test_client:
+        guest_token = test_client.post("/user/guest").json()["jwt_token"]
+        request_data = {
+            "type":                  "maumau",
+            "deck_size":             32,
+            "number_of_start_cards": 5,
+            "gamemode":              "gamemode_classic"
+        }
+        game_id = test_client.post("/game", json=request_data, headers={"Authorization": jwt_token}).json()["id"]
+
+        def receive_until(websocket, action):
+            while True:
+                message = websocket.receive_json()
+                if message.get("action") == action:
+                    return message
+
+        with test_client.websocket_connect(f"/game/ws/{game_id}?token={jwt_token}") as first, \
+                test_client.websocket_connect(f"/game/ws/{game_id}?token={guest_token}") as second:
+            for websocket in (first, second):
+                websocket.send_json({"action": "join"})
+                receive_until(websocket, "join")
+            for websocket in (first, second):
+                websocket.send_json({"action": "ready", "ready": True})
+            turn = receive_until(first, "turn")
+            assert turn["turn_deadline"] > time.time() - 1
+
+            penalty = receive_until(first, "timeout_penalty")
+            assert penalty["player"] == turn["player"]
+            receive_until(first, "end")
+
+
+# BROKER TESTS
+def test_socket_broker_forwards_to_other_processes(tmp_path, monkeypatch):
+    import asyncio
+    import json
+    import util.broker
+    from util.broker import GameConnections, SocketBroker, SocketBrokerHub
+    from util.generic import send_to_all
+
+    async def run():
+        hub = SocketBrokerHub(str(tmp_path / "broker.sock"))
+        await hub.start()
+        received = {"first": [], "second": []}
+        first, second = SocketBroker(hub.path), SocketBroker(hub.path)
+        await first.start(lambda game_id, user_id, frame: received["first"].append((game_id, user_id, frame.text)))
+        await second.start(lambda game_id, user_id, frame: received["second"].append((game_id, user_id, frame.text)))
+
+        # "first" ist der Broker dieses Prozesses, die Spieler sind alle mit "second" verbunden
+        monkeypatch.setattr(util.broker, "broker", first)
+        connections = GameConnections("game")
+        await send_to_all(connections, {"action": "turn", "player": "a"})
+        await connections["b"].send_json({"action": "hand", "hand": []})
+        for _ in range(50):
+            if len(received["second"]) == 2:
+                break
+            await asyncio.sleep(0.01)
+
+        await first.stop()
+        await second.stop()
+        await hub.stop()
+        return received
+
+    received = asyncio.run(run())
+    assert received["first"] == []
+    assert [(game_id, user_id, json.loads(text)["action"]) for game_id, user_id, text in received["second"]] == [
+        ("game", None, "turn"),
+        ("game", "b", "hand")
+    ]
+
+
+def test_broker_invalidates_users_in_other_processes(tmp_path):
+    import asyncio
+    from util.broker import INVALIDATE_USER, SocketBroker, SocketBrokerHub
+
+    async def run():
+        hub = SocketBrokerHub(str(tmp_path / "broker.sock"))
+        await hub.start()
+        invalidated = {"first": [], "second": []}
+        first, second = SocketBroker(hub.path), SocketBroker(hub.path)
+        await first.start(lambda *args: None, invalidated["first"].append)
+        await second.start(lambda *args: None, invalidated["second"].append)
+
+        first.invalidate_user("user-1")
+        for _ in range(50):
+            if invalidated["second"]:
+                break
+            await asyncio.sleep(0.01)
+        # So kommt der NOTIFY des Cron-Jobs an: ohne Herkunft, gilt für jeden Prozess
+        first._receive(f"||user-2|{INVALIDATE_USER}|")
+
+        await first.stop()
+        await second.stop()
+        await hub.stop()
+        return invalidated
+
+    assert asyncio.run(run()) == {"first": ["user-2"], "second": ["user-1"]}
+
+
+def test_broker_needs_game_routing():
+    from util.broker import check_routing
+
+    check_routing("memory://", "")
+    check_routing("unix:///tmp/broker.sock", "affinity")
+    check_routing("postgresql://db/app", "external")
+    with pytest.raises(RuntimeError, match="affinity"):
+        check_routing("postgresql://db/app", "")
+
+
+def test_event_log_replay():
+    from util.replay import EventLog
+
+    events = EventLog(size=3)
+    first = events.frame({"action": "join"}).text
+    start = events.seq
+    events.frame({"action": "hand", "hand": []}, "a")
+    events.frame({"action": "hand", "hand": []}, "b")
+    assert [frame.action for frame in events.since(start, "a")] == ["hand"]
+    assert events.since(events.seq, "a") == []
+    assert f'"seq":{start}' in first
+
+    events.frame({"action": "turn"})
+    assert events.since(start - 1, "a") is None  # "join" ist nicht mehr im Puffer
+    assert [frame.action for frame in events.since(start, "b")] == ["hand", "turn"]
+    assert events.since(events.seq + 1, "a") is None
+    assert EventLog().seq > events.seq
+
+
+def test_websocket_resume_with_last_seq(jwt_token):
+    headers = {"Authorization": jwt_token}
+    request_data = {
+        "type":                  "maumau",
+        "deck_size":             32,
+        "number_of_start_cards": 5,
+        "gamemode":              "gamemode_classic"
+    }
+    with TestClient(app) as local_client:
+        game_id = local_client.post("/game", json=request_data, headers=headers).json()["id"]
+        guest_token = local_client.post("/user/guest").json()["jwt_token"]
+
+        with local_client.websocket_connect(f"/game/ws/{game_id}?token={jwt_token}") as host:
+            host.send_json({"action": "join"})
+            host.receive_json()
+            with local_client.websocket_connect(f"/game/ws/{game_id}?token={guest_token}") as guest:
+                guest.send_json({"action": "join"})
+                last_seq = guest.receive_json()["seq"]
+            host.receive_json()
+
+            # Während der Gast weg ist
+            host.send_json({"action": "ready", "ready": True})
+            ready = host.receive_json()
+
+            with local_client.websocket_connect(f"/game/ws/{game_id}?token={guest_token}&last_seq={last_seq}") as guest:
+                assert guest.receive_json() == ready
+                guest.send_json({"action": "request_lobby_data"})
+                assert guest.receive_json()["seq"] == ready["seq"] + 1
+
+            # Zu alt: statt der Ereignisse kommt der aktuelle Stand
+            with local_client.websocket_connect(f"/game/ws/{game_id}?token={guest_token}&last_seq=1") as guest:
+                assert guest.receive_json()["action"] == "lobby_data"
+
+
+def test_wire_card_encoding():
+    from util import wire
+    if wire.msgpack is None:
+        pytest.skip("msgpack is not installed")
+    from util.cards import cards_to_wire, generate_card_deck
+
+    deck = cards_to_wire(generate_card_deck(104))
+    message = {"action": "hand", "hand": deck, "card": deck[0], "players": {"a": 5}, "cards": []}
+    packed = wire.packb(message)
+    assert wire.unpackb(packed) == message
+    assert len(packed) < 104 + 50
+
+
+def test_cards_round_trip():
+    from util.cards import (
+        HAND_LENGTH,
+        VALUE_A,
+        add_card,
+        from_wire,
+        generate_card_deck,
+        hand_cards,
+        hand_size,
+        hand_to_wire,
+        new_hand,
+        remove_card,
+        remove_value,
+        to_wire,
+        value_count,
+        value_counts
+    )
+
+    deck = generate_card_deck(104)
+    assert len(deck) == 104 and all(from_wire(to_wire(card)) == card for card in deck)
+    assert from_wire({"suit": "Hearts", "value": "1"}) is None
+    assert from_wire({"suit": "Hearts", "value": "7", "x": 1}) is None
+    assert from_wire("Hearts") is None
+
+    hand = new_hand(deck)
+    assert len(hand) == HAND_LENGTH + 104 and hand_size(hand) == 104
+    assert sorted(deck) == hand_cards(hand)
+    assert value_count(hand, VALUE_A) == 8 and value_counts(hand) == [8] * 13
+    remove_value(hand, VALUE_A)
+    assert hand_size(hand) == 96 and {"suit": "Spades", "value": "A"} not in hand_to_wire(hand)
+    assert value_count(hand, VALUE_A) == 0 and value_counts(hand) == [8] * 7 + [0] + [8] * 5
+
+    # Die Zähler pro Wert laufen bei jeder Änderung der Hand mit
+    remove_card(hand, from_wire({"suit": "Spades", "value": "9"}))
+    add_card(hand, from_wire({"suit": "Clubs", "value": "A"}))
+    assert value_counts(hand) == value_counts(new_hand(hand_cards(hand))) and hand_size(hand) == 96
+
+
+def test_hand_keeps_cards_in_order():
+    import random
+    from util.cards import (
+        CARD_CODES,
+        HAND_SLOTS,
+        VALUE_7,
+        add_card,
+        add_cards,
+        cards_to_wire,
+        generate_card_deck,
+        hand_cards,
+        hand_to_wire,
+        new_hand,
+        remove_card,
+        remove_value
+    )
+
+    def counted(hand):
+        return [card for card in range(HAND_SLOTS) for _ in range(hand[card])]
+
+    deck = generate_card_deck(104)
+    hand = new_hand(deck[:10])
+    sent = hand_to_wire(hand)
+    assert sent == cards_to_wire(sorted(deck[:10]))
+    # Die Karten hinter den Zählern laufen bei jeder Änderung mit, schon verschickte Listen bleiben wie sie sind
+    add_card(hand, deck[10])
+    remove_card(hand, deck[0])
+    add_cards(hand, deck[11:30])
+    assert sent == cards_to_wire(sorted(deck[:10]))
+    assert hand_cards(hand) == counted(hand) == sorted(deck[1:30])
+    add_card(hand, CARD_CODES["Hearts", "7"])
+    remove_value(hand, VALUE_7)
+    assert hand_cards(hand) == counted(hand)
+    for card in random.sample(hand_cards(hand), 5):
+        remove_card(hand, card)
+        assert hand_cards(hand) == counted(hand)
+    assert hand_to_wire(hand) == cards_to_wire(counted(hand))
+
+
+def test_upgrade_legacy_state():
+    from util.cards import CARD_CODES, hand_to_wire, new_hand, to_wire, upgrade_legacy_state
+
+    state = {"draw_pile": [{"suit": "Clubs", "value": "9"}], "discard_pile": [{"suit": "Hearts", "value": "J"}],
+             "removed_pile": ["A"]}
+    spades_2 = [0] * 65
+    spades_2[3 << 4 | 8], spades_2[64] = 2, 2  # count array without value counters
+    hearts_7 = [0] * 78
+    hearts_7[0], hearts_7[64], hearts_7[77] = 1, 1, 1  # count array without the cards in order
+    players = {"a": {"hand": [{"suit": "Spades", "value": "2"}, {"suit": "Hearts", "value": "7"}]},
+               "b": {"hand": []}, "c": {"hand": spades_2}, "d": {"hand": hearts_7}}
+    upgrade_legacy_state(state, players)
+    assert to_wire(state["draw_pile"][0]) == {"suit": "Clubs", "value": "9"}
+    assert to_wire(state["discard_pile"][0]) == {"suit": "Hearts", "value": "J"}
+    assert state["removed_pile"] == ["A"]
+    assert hand_to_wire(players["a"]["hand"]) == [{"suit": "Hearts", "value": "7"}, {"suit": "Spades", "value": "2"}]
+    assert hand_to_wire(players["b"]["hand"]) == []
+    assert hand_to_wire(players["c"]["hand"]) == [{"suit": "Spades", "value": "2"}] * 2
+    assert hand_to_wire(players["d"]["hand"]) == [{"suit": "Hearts", "value": "7"}]
+
+    # Already upgraded games stay as they are
+    upgraded = [list(players["a"]["hand"]), list(state["draw_pile"])]
+    upgrade_legacy_state(state, players)
+    assert [players["a"]["hand"], state["draw_pile"]] == upgraded
+
+    # Mau Mau: sortierte Kartenlisten statt Zähl-Arrays, auch aus Zähl-Arrays dieser Version
+    two, seven, nine = CARD_CODES["Spades", "2"], CARD_CODES["Hearts", "7"], CARD_CODES["Clubs", "9"]
+    players = {"a": {"hand": [{"suit": "Spades", "value": "2"}, {"suit": "Hearts", "value": "7"}]},
+               "b": {"hand": []}, "c": {"hand": spades_2}, "d": {"hand": new_hand([nine, seven])},
+               "e": {"hand": [seven, nine]}}
+    upgrade_legacy_state({}, players, card_lists=True)
+    assert {pid: player["hand"] for pid, player in players.items()} == {
+        "a": sorted([two, seven]), "b": [], "c": [two, two], "d": sorted([seven, nine]), "e": [seven, nine]
+    }
+
+
+def test_lügen_discard_duplicates_checks_changed_values():
+    from logic.lügen import ace_loser, discard_duplicates
+    from util.cards import CARD_CODES, VALUE_7, VALUE_A, add_card, hand_size, new_hand
+    from util.outbox import ALL, Outbox
+
+    sevens = [CARD_CODES[suit, "7"] for suit in ("Hearts", "Diamonds", "Clubs")]
+    aces = [CARD_CODES[suit, "A"] for suit in ("Hearts", "Diamonds", "Clubs", "Spades")]
+    players = {"a": {"hand": new_hand(sevens)}, "b": {"hand": new_hand(aces)}}
+    state = {"removed_pile": []}
+    settings = {"deck_size": 32, "gamemode": "gamemode_classic"}
+    outbox = Outbox()
+
+    add_card(players["a"]["hand"], CARD_CODES["Spades", "7"])
+    discard_duplicates(outbox, state, players, settings, {"a": {VALUE_7}})
+    assert state["removed_pile"] == ["7"] and hand_size(players["a"]["hand"]) == 0
+    assert outbox == [(ALL, {"action": "discard_duplicates", "value": "7", "player": "a"})]
+
+    # Nur geänderte Hände und Werte werden geprüft
+    assert ace_loser(players, settings, ["a"]) is None and ace_loser(players, settings, ["a", "b"]) == "b"
+    discard_duplicates(outbox, state, players, settings, {"b": {VALUE_7}})
+    assert state["removed_pile"] == ["7"] and hand_size(players["b"]["hand"]) == 4
+    discard_duplicates(outbox, state, players, settings, {"b": {VALUE_A}})
+    assert state["removed_pile"] == ["7", "A"] and hand_size(players["b"]["hand"]) == 0
+
+
+def test_maumau_apply_without_connections():
+    from types import SimpleNamespace
+    from logic.maumau import apply
+    from util.outbox import ALL, SENDER
+
+    settings = {"max_players": 4, "deck_size": 32, "number_of_start_cards": 5, "gamemode": "gamemode_classic"}
+    users = [SimpleNamespace(id="a"), SimpleNamespace(id="b")]
+    state, players = {"started": False}, {}
+    for message, user in [({"action": "join"}, users[0]), ({"action": "join"}, users[1]),
+                          ({"action": "ready", "ready": True}, users[0])]:
+        state, players, _ = apply(message, state, players, settings, user)
+    state, players, outbox = apply({"action": "ready", "ready": True}, state, players, settings, users[1])
+
+    # Die Spiellogik sendet nichts selbst, sie gibt die Nachrichten in der richtigen Reihenfolge zurück
+    actions = [(recipient, message.get("action")) for recipient, message in outbox]
+    assert state["started"] and actions[:2] == [(ALL, "ready"), (ALL, "start")]
+    assert {recipient for recipient, action in actions if action == "hand"} == {"a", "b"}
+    assert actions[-2:] == [(ALL, "turn"), (state["current_player"], "playable_cards")]
+
+    waiting = next(user for user in users if user.id != state["current_player"])
+    state, players, outbox = apply({"action": "skip"}, state, players, settings, waiting)
+    assert outbox == [(SENDER, {"error": "not_your_turn"})]
+
+
+def test_maumau_rejected_card_stays_in_hand():
+    from types import SimpleNamespace
+    from logic.maumau import apply
+    from util.maumau import CARD_CODES, add_card
+    from util.outbox import SENDER
+
+    settings = {"max_players": 4, "deck_size": 32, "number_of_start_cards": 5, "gamemode": "gamemode_classic"}
+    users = [SimpleNamespace(id="a"), SimpleNamespace(id="b")]
+    state, players = {"started": False}, {}
+    for message in [{"action": "join"}, {"action": "ready", "ready": True}]:
+        for user in users:
+            state, players, _ = apply(dict(message), state, players, settings, user)
+    current = SimpleNamespace(id=state["current_player"])
+    hand = players[current.id]["hand"]
+    add_card(hand, CARD_CODES["Hearts", "K"])
+    add_card(hand, CARD_CODES["Hearts", "J"])
+    state["discard_pile"].append(CARD_CODES["Hearts", "7"])
+    state["count_7"] = 2
+    before = (list(hand), list(state["discard_pile"]))
+
+    # Offene 7er: eine andere Karte wird abgelehnt und bleibt auf der Hand
+    state, players, outbox = apply({"action": "place_card_on_stack", "card": {"suit": "Hearts", "value": "K"},
+                                    "mau": True}, state, players, settings, current)
+    assert outbox == [(SENDER, {"error": "has_to_draw_penalty"})]
+    state["count_7"] = 0
+    state, players, outbox = apply({"action": "place_card_on_stack", "card": {"suit": "Hearts", "value": "J"},
+                                    "mau": True, "j_choice": "Stars"}, state, players, settings, current)
+    assert outbox == [(SENDER, {"error": "j_choice_not_possible"})]
+    assert (players[current.id]["hand"], state["discard_pile"]) == before
+
+
+def test_maumau_playable_cards():
+    from util.maumau import CARD_CODES, SUITS, VALUE_7, new_hand, value_of
+    from util.maumau import _can_place, can_place_card_on_stack, playable_cards
+
+    cards = list(CARD_CODES.values())
+    for last_card in cards:
+        for j_choice in ("",) + SUITS:
+            assert [card for card in cards if can_place_card_on_stack(card, last_card, j_choice)] == \
+                   [card for card in cards if _can_place(card, last_card, j_choice)]
+
+    hearts_7, hearts_9, hearts_j, spades_7, spades_k = (CARD_CODES[card] for card in [
+        ("Hearts", "7"), ("Hearts", "9"), ("Hearts", "J"), ("Spades", "7"), ("Spades", "K")
+    ])
+    hand = new_hand([spades_k, hearts_j, spades_7, hearts_9, hearts_9])
+    assert playable_cards(hand, hearts_7, "") == [hearts_9, hearts_j, spades_7]
+    assert playable_cards(hand, hearts_7, "", count_7=2) == [spades_7]
+    assert playable_cards(hand, hearts_j, "Spades") == [spades_7, spades_k]
+    assert all(value_of(card) == VALUE_7 for card in playable_cards(hand, spades_k, "", count_7=2))
+
+
+def test_seating_ring():
+    from util.seating import get_next_player, seat_players, seating_order, unseat_player
+
+    players = {pid: {"join_sequence": seq} for pid, seq in [("c", 3), ("a", 1), ("d", 4), ("b", 2)]}
+    state = {}
+    seat_players(state, players)
+    assert seating_order(state, players) == ["a", "b", "c", "d"]
+    assert get_next_player(state, players, "d") == "a"
+    assert get_next_player(state, players, "a", skip=1) == "c"
+
+    # Verlassen, Gewinnen und Timeout nehmen den Spieler aus dem Ring
+    unseat_player(state, "a")
+    unseat_player(state, "c")
+    assert seating_order(state, players) == ["b", "d"]
+    assert get_next_player(state, players, "b") == "d"
+    assert get_next_player(state, players, "b", skip=1) == "b"
+    unseat_player(state, "c")  # nicht mehr im Ring
+    assert get_next_player(state, players, "d") == "b"
+
+    # Spiele ohne Ring (gespeichert vor der Sitzordnung) bekommen ihn beim ersten Zugwechsel
+    legacy = {}
+    assert get_next_player(legacy, players, "b") == "c"
+    assert seating_order(legacy, players) == ["a", "b", "c", "d"]
+
+
+def test_websocket_sends_playable_cards(jwt_token):
+    from util.cards import from_wire
+    from util.maumau import can_place_card_on_stack
+
+    request_data = {
+        "type":                  "maumau",
+        "deck_size":             32,
+        "number_of_start_cards": 5,
+        "gamemode":              "gamemode_classic"
+    }
+    with TestClient(app) as local_client:
+        game_id = local_client.post("/game", json=request_data, headers={"Authorization": jwt_token}).json()["id"]
+        guest_token = local_client.post("/user/guest").json()["jwt_token"]
+
+        def receive_until(websocket, action):
+            while True:
+                message = websocket.receive_json()
+                if message.get("action") == action:
+                    return message
+
+        with local_client.websocket_connect(f"/game/ws/{game_id}?token={jwt_token}") as first, \
+                local_client.websocket_connect(f"/game/ws/{game_id}?token={guest_token}") as second:
+            first.send_json({"action": "join"})
+            first_id = receive_until(first, "join")["player"]
+            second.send_json({"action": "join"})
+            for websocket in (first, second):
+                websocket.send_json({"action": "ready", "ready": True})
+            top = from_wire(receive_until(first, "start")["discard_pile"])
+            hand = receive_until(first, "hand")["hand"]
+            current = first if receive_until(first, "turn")["player"] == first_id else second
+            if current is second:
+                hand = receive_until(second, "hand")["hand"]
+
+            playable = receive_until(current, "playable_cards")["cards"]
+            assert playable == [card for card in hand if can_place_card_on_stack(from_wire(card), top, "")]
+
+            current.send_json({"action": "request_game_data"})
+            assert receive_until(current, "game_data")["playable_cards"] == playable
+
+
+def test_websocket_msgpack_subprotocol(test_client, jwt_token):
+    from util import wire
+    if wire.msgpack is None:
+        pytest.skip("msgpack is not installed")
+
+    headers = {"Authorization": jwt_token}
+    request_data = {
+        "type":                  "maumau",
+        "deck_size":             32,
+        "number_of_start_cards": 5,
+        "gamemode":              "gamemode_classic"
+    }
+    game_id = test_client.post("/game", json=request_data, headers=headers).json()["id"]
+
+    with test_client.websocket_connect(f"/game/ws/{game_id}?token={jwt_token}",
+                                       subprotocols=[wire.SUBPROTOCOL]) as websocket:
+        assert websocket.accepted_subprotocol == wire.SUBPROTOCOL
+        websocket.send_bytes(wire.packb({"action": "join"}))
+        assert wire.unpackb(websocket.receive_bytes())["action"] == "join"
+        websocket.send_json({"action": "request_lobby_data"})
+        lobby_data = wire.unpackb(websocket.receive_bytes())
+        assert lobby_data["action"] == "lobby_data" and len(lobby_data["players"]) == 1
+
+
+def test_hash_ring_moves_few_games():
+    from util.hashring import HashRing
+
+    games = [f"game-{i}" for i in range(2000)]
+    ring = HashRing(["w1", "w2", "w3"])
+    before = {game: ring.get(game) for game in games}
+    assert set(before.values()) == {"w1", "w2", "w3"}
+
+    ring.add("w4")
+    after = {game: ring.get(game) for game in games}
+    moved = [game for game in games if before[game] != after[game]]
+    assert all(after[game] == "w4" for game in moved)
+    assert len(moved) < len(games) / 2
+
+    ring.remove("w4")
+    assert {game: ring.get(game) for game in games} == before
+
+
+def test_affinity_proxy_routing():
+    from affinity import AffinityProxy, _close_after_response
+
+    proxy = AffinityProxy(["127.0.0.1:9001", "127.0.0.1:9002"])
+    owner = proxy.route("game-1")
+    proxy.report(owner, b"+game-1")
+    proxy.ring.add("127.0.0.1:9003")
+    assert proxy.route("game-1") == owner  # laufende Spiele ziehen nicht um
+    proxy.report("127.0.0.1:9003", b"-game-1")  # nur der Worker, der das Spiel hält, gibt es frei
+    assert proxy.route("game-1") == owner
+    proxy.report(owner, b"-game-1")
+    assert proxy.route("game-1") == proxy.ring.get("game-1")
+    assert {proxy.route() for _ in range(3)} == proxy.ring.nodes
+
+    head = b"GET /user HTTP/1.1\r\nHost: x\r\nConnection: keep-alive\r\n\r\n"
+    assert _close_after_response(head) == b"GET /user HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n"
+
+
+def test_handoff_serves_socket_with_head():
+    import asyncio
+    import socket
+    from util.handoff import CLAIMED, CONNECTION, WorkerChannel, send_message
+
+    async def run():
+        proxy_end, worker_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        proxy_end.setblocking(False)
+        channel = WorkerChannel(worker_end.detach())
+        received = []
+        done = asyncio.get_running_loop().create_future()
+
+        class Recorder(asyncio.Protocol):
+            def data_received(self, data):
+                received.append(data)
+                if b"".join(received).endswith(b"!") and not done.done():
+                    done.set_result(None)
+
+        channel.start(Recorder)
+        client, server_side = socket.socketpair()
+        await send_message(proxy_end, CONNECTION + b"GET / HTTP/1.1\r\n\r\n", [server_side.fileno()])
+        server_side.close()  # der Proxy ist danach raus
+        client.sendall(b"body!")
+        await asyncio.wait_for(done, 5)
+
+        channel.notify(CLAIMED, "game-1")
+        report = await asyncio.get_running_loop().sock_recv(proxy_end, 100)
+        for sock in (client, proxy_end, channel.sock):
+            sock.close()
+        return b"".join(received), report
+
+    assert asyncio.run(run()) == (b"GET / HTTP/1.1\r\n\r\nbody!", b"+game-1")
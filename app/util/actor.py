@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import os
+import time
+
+from util.metrics import ACTOR_QUEUE_WAIT
+
+# Seconds an actor without work stays alive before its task is stopped
+ACTOR_IDLE_TIMEOUT = float(os.getenv('GAME_ACTOR_IDLE_TIMEOUT', '60'))
+# Jobs that had to wait longer than this many seconds in the inbox are reported
+ACTOR_WAIT_WARNING = float(os.getenv('GAME_ACTOR_WAIT_WARNING', '0.5'))
+
+logger = logging.getLogger("app.actor")
+
+
+class GameActor:
+    """Inbox and statistics of one game. The jobs are processed by exactly one task in arrival order."""
+
+    def __init__(self, game_id):
+        self.game_id = game_id
+        self.inbox = asyncio.Queue()
+        self.task = None
+        self.processed = 0
+        self.last_wait = 0.0
+        self.max_wait = 0.0
+        self.total_wait = 0.0
+
+    @property
+    def queue_depth(self):
+        return self.inbox.qsize()
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue_depth,
+            "processed":   self.processed,
+            "last_wait":   self.last_wait,
+            "max_wait":    self.max_wait,
+            "avg_wait":    self.total_wait / self.processed if self.processed else 0.0
+        }
+
+
+class GameScheduler:
+    """
+    Serializes all work on a game (player actions and timer events) through a per-game actor.
+
+    Every game with pending work gets one asyncio task that drains its FIFO inbox, so actions are executed strictly
+    in the order they arrived and nobody has to poll for a lock. The task ends after ``idle_timeout`` seconds
+    without work and is recreated with the next job.
+    """
+
+    def __init__(self, idle_timeout=ACTOR_IDLE_TIMEOUT, wait_warning=ACTOR_WAIT_WARNING):
+        self.idle_timeout = idle_timeout
+        self.wait_warning = wait_warning
+        self.actors = {}  # {game_id: GameActor}
+
+    def _enqueue(self, game_id, job, future):
+        actor = self.actors.get(game_id)
+        if actor is None or (actor.task is not None and actor.task.get_loop().is_closed()):
+            actor = self.actors[game_id] = GameActor(game_id)
+        actor.inbox.put_nowait((job, future, time.monotonic()))
+        if actor.task is None or actor.task.done():
+            actor.task = asyncio.create_task(self._run(actor))
+
+    async def submit(self, game_id, job):
+        """Queues ``job`` (coroutine function without arguments) for the game and waits for its result."""
+        future = asyncio.get_running_loop().create_future()
+        self._enqueue(game_id, job, future)
+        return await future
+
+    def post(self, game_id, job):
+        """Queues ``job`` for the game without waiting for it (e.g. timer events)."""
+        self._enqueue(game_id, job, None)
+
+    def stats(self):
+        return {game_id: actor.stats() for game_id, actor in self.actors.items()}
+
+    async def _run(self, actor):
+        while True:
+            try:
+                job, future, enqueued = await asyncio.wait_for(actor.inbox.get(), self.idle_timeout)
+            except asyncio.TimeoutError:
+                if actor.inbox.empty():
+                    if self.actors.get(actor.game_id) is actor:
+                        del self.actors[actor.game_id]
+                    return
+                continue
+
+            wait = time.monotonic() - enqueued
+            actor.processed += 1
+            actor.last_wait = wait
+            actor.total_wait += wait
+            actor.max_wait = max(actor.max_wait, wait)
+            ACTOR_QUEUE_WAIT.observe(wait)
+            if wait > self.wait_warning:
+                logger.warning("slow job", extra={"fields": {
+                    "game_id": actor.game_id, "wait_ms": round(wait * 1000, 3), "queue_depth": actor.queue_depth
+                }})
+
+            if future is not None and future.done():
+                continue  # The submitter is gone (e.g. disconnected)
+            try:
+                result = await job()
+            except Exception as e:
+                if future is None:
+                    logger.exception("job failed", extra={"fields": {"game_id": actor.game_id}})
+                elif not future.done():
+                    future.set_exception(e)
+            else:
+                if future is not None and not future.done():
+                    future.set_result(result)
@@ -0,0 +1,82 @@
+import os
+import time
+from collections import OrderedDict
+
+# Maximum number of verified tokens kept in memory
+AUTH_CACHE_SIZE = int(os.getenv('AUTH_CACHE_SIZE', '10000'))
+# Seconds a verified token is trusted before the user is looked up in the database again
+AUTH_CACHE_TTL = float(os.getenv('AUTH_CACHE_TTL', '300'))
+
+
+class Principal:
+    """The authenticated user as far as most endpoints need it, without the database row (and its picture)."""
+
+    __slots__ = ("id", "username", "guest")
+
+    def __init__(self, user_id, username, guest):
+        self.id = user_id
+        self.username = username
+        self.guest = guest
+
+
+class PrincipalCache:
+    """
+    Verified tokens and their ``Principal``, evicted least recently used first.
+
+    An entry expires after ``ttl`` seconds, but never after the token itself (``exp``). ``invalidate_user`` drops all
+    tokens of a user, e.g. after a password change. Other processes are told through the broker
+    (``dependencies.invalidate_user``), about guests deleted by the cron job in ``app.py`` by its ``NOTIFY``.
+    """
+
+    def __init__(self, max_size=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # {token: (Principal, expires)}
+        self._tokens = {}  # {user_id: {token, ...}}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, token):
+        entry = self._entries.get(token)
+        if entry is None:
+            return None
+        principal, expires = entry
+        if time.monotonic() >= expires:
+            self._remove(token)
+            return None
+        self._entries.move_to_end(token)
+        return principal
+
+    def put(self, token, principal, exp=None):
+        """Caches a verified token, ``exp`` is the expiry claim of the token (Unix time)."""
+        if self.max_size <= 0 or self.ttl <= 0:
+            return
+        lifetime = self.ttl if exp is None else min(self.ttl, exp - time.time())
+        if lifetime <= 0:
+            return
+        if token in self._entries:
+            self._remove(token)
+        self._entries[token] = (principal, time.monotonic() + lifetime)
+        self._tokens.setdefault(principal.id, set()).add(token)
+        while len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries)))
+
+    def invalidate_user(self, user_id):
+        for token in self._tokens.pop(user_id, ()):
+            self._entries.pop(token, None)
+
+    def clear(self):
+        self._entries.clear()
+        self._tokens.clear()
+
+    def _remove(self, token):
+        principal, _ = self._entries.pop(token)
+        tokens = self._tokens.get(principal.id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens[principal.id]
+
+
+principal_cache = PrincipalCache()
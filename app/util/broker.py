@@ -0,0 +1,323 @@
+"""
+Forwards game events to the other worker processes, so every player receives them no matter which process holds the
+socket.
+
+The process that produces an event always delivers it to its own connections directly; the broker only carries it
+to the other processes, which deliver it to their connections of the game. Backends (``BROKER_URL``):
+
+- ``memory://``: single process, nothing is forwarded (default)
+- ``postgresql://...``: PostgreSQL ``LISTEN``/``NOTIFY`` (payloads up to 8000 bytes)
+- ``unix:///path/to/socket``: a ``SocketBrokerHub`` on a local socket, e.g. for tests
+
+A hub for the socket backend can be started with ``python -m util.broker /path/to/socket``.
+
+Besides game events the broker carries invalidations of cached tokens (``invalidate_user``), e.g. after a password
+change, so no process keeps trusting them until its cache entry expires.
+
+The broker only carries events, every process still keeps its own copy of the games it holds. Several processes need
+routing that sends all sockets of a game to the same process (``GAME_ROUTING``), ``check_routing`` refuses to start
+without it. ``util/game_store.py`` additionally makes sure that only one process holds a game at a time.
+"""
+import asyncio
+import logging
+import os
+import sys
+import uuid
+
+from sqlalchemy.engine import make_url
+
+from util.connection import Frame
+from util.replay import EventLog
+
+BROKER_URL = os.getenv('BROKER_URL', 'memory://')
+# How the sockets of a game reach the process that holds it: unset (a single process), "affinity" (set by affinity.py
+# for its workers) or "external" (a load balancer that routes /game/ws/{game_id} by the game id)
+GAME_ROUTING = os.getenv('GAME_ROUTING', '')
+# Name of the PostgreSQL notification channel
+BROKER_CHANNEL = os.getenv('BROKER_CHANNEL', 'game_events')
+# PostgreSQL rejects larger NOTIFY payloads
+MAX_NOTIFY_PAYLOAD = 7999
+# Longest line (one event) on the broker socket
+MAX_LINE_SIZE = 2 ** 20
+# Action of a message without a game: drop the cached tokens of the user
+INVALIDATE_USER = "invalidate_user"
+
+logger = logging.getLogger("app.broker")
+
+
+def _encode(origin, game_id, user_id, frame):
+    # IDs and action names never contain "|", the message itself comes last
+    return f"{origin}|{game_id}|{user_id or ''}|{frame.action or ''}|{frame.text}"
+
+
+def _decode(envelope):
+    origin, game_id, user_id, action, text = envelope.split("|", 4)
+    return origin, game_id, user_id or None, Frame.encoded(text, action or None)
+
+
+class Broker:
+    """In-process broker and interface of all backends: there are no other processes, nothing is forwarded."""
+
+    def __init__(self):
+        self.origin = uuid.uuid4().hex
+        self.deliver = None
+        self.invalidate = None
+
+    async def start(self, deliver, invalidate=None):
+        """
+        ``deliver(game_id, user_id, frame)`` is called for every event from another process, ``invalidate(user_id)``
+        for every user whose tokens another process invalidated.
+        """
+        self.deliver = deliver
+        self.invalidate = invalidate
+
+    def publish(self, game_id, frame, user_id=None):
+        """Forwards an event (``user_id``: only for this player) without waiting for the network."""
+
+    def invalidate_user(self, user_id):
+        """Tells the other processes to drop the cached tokens of the user."""
+        self.publish("", Frame.encoded("", INVALIDATE_USER), user_id)
+
+    async def stop(self):
+        pass
+
+    def _receive(self, envelope):
+        try:
+            origin, game_id, user_id, frame = _decode(envelope)
+        except ValueError:
+            logger.warning("invalid broker message")
+            return
+        if origin == self.origin:
+            return
+        if not game_id:
+            if frame.action == INVALIDATE_USER and self.invalidate is not None:
+                self.invalidate(user_id)
+        elif self.deliver is not None:
+            self.deliver(game_id, user_id, frame)
+
+
+class _QueuedBroker(Broker):
+    """Base for network backends: published events are sent by a background task in the order of publishing."""
+
+    def __init__(self):
+        super().__init__()
+        self._outbox = asyncio.Queue()
+        self._sender = None
+
+    async def start(self, deliver, invalidate=None):
+        await super().start(deliver, invalidate)
+        await self._connect()
+        self._sender = asyncio.create_task(self._send_loop())
+
+    def publish(self, game_id, frame, user_id=None):
+        self._outbox.put_nowait(_encode(self.origin, game_id, user_id, frame))
+
+    async def stop(self):
+        if self._sender is not None:
+            self._sender.cancel()
+            self._sender = None
+        await self._disconnect()
+
+    async def _send_loop(self):
+        while True:
+            envelopes = [await self._outbox.get()]
+            while not self._outbox.empty():
+                envelopes.append(self._outbox.get_nowait())
+            try:
+                await self._send(envelopes)
+            except Exception:
+                logger.exception("broker send failed", extra={"fields": {"events": len(envelopes)}})
+
+    async def _connect(self):
+        raise NotImplementedError
+
+    async def _disconnect(self):
+        raise NotImplementedError
+
+    async def _send(self, envelopes):
+        raise NotImplementedError
+
+
+class PostgresBroker(_QueuedBroker):
+    """Uses ``LISTEN``/``NOTIFY`` of the game database, no additional service is needed."""
+
+    def __init__(self, url, channel=BROKER_CHANNEL):
+        super().__init__()
+        # asyncpg expects a plain libpq URL without the SQLAlchemy driver name
+        self.dsn = make_url(url).set(drivername="postgresql").render_as_string(hide_password=False)
+        self.channel = channel
+        self._listen_conn = None
+        self._notify_conn = None
+
+    async def _connect(self):
+        import asyncpg
+
+        self._listen_conn = await asyncpg.connect(self.dsn)
+        self._notify_conn = await asyncpg.connect(self.dsn)
+        await self._listen_conn.add_listener(self.channel, self._on_notify)
+
+    async def _disconnect(self):
+        for conn in (self._listen_conn, self._notify_conn):
+            if conn is not None:
+                await conn.close()
+        self._listen_conn = self._notify_conn = None
+
+    def _on_notify(self, connection, pid, channel, payload):
+        self._receive(payload)
+
+    async def _send(self, envelopes):
+        args = []
+        for envelope in envelopes:
+            size = len(envelope.encode())
+            if size > MAX_NOTIFY_PAYLOAD:
+                logger.error("event too large for NOTIFY", extra={"fields": {"size": size}})
+            else:
+                args.append((self.channel, envelope))
+        if args:
+            await self._notify_conn.executemany("SELECT pg_notify($1, $2)", args)
+
+
+class SocketBroker(_QueuedBroker):
+    """Client of a ``SocketBrokerHub`` listening on a Unix socket, one event per line."""
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self._reader = None
+        self._writer = None
+        self._receiver = None
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_unix_connection(self.path, limit=MAX_LINE_SIZE)
+        self._receiver = asyncio.create_task(self._receive_loop())
+
+    async def _disconnect(self):
+        if self._receiver is not None:
+            self._receiver.cancel()
+            self._receiver = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    async def _receive_loop(self):
+        while line := await self._reader.readline():
+            self._receive(line.decode().rstrip("\n"))
+        logger.error("broker hub closed the connection")
+
+    async def _send(self, envelopes):
+        # Encoded JSON never contains a raw line break
+        self._writer.write("".join(envelope + "\n" for envelope in envelopes).encode())
+        await self._writer.drain()
+
+
+class SocketBrokerHub:
+    """Relays every line a client sends to all other clients."""
+
+    def __init__(self, path):
+        self.path = path
+        self.clients = set()
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_unix_server(self._handle, path=self.path, limit=MAX_LINE_SIZE)
+
+    async def stop(self):
+        for writer in list(self.clients):
+            writer.close()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    async def _handle(self, reader, writer):
+        self.clients.add(writer)
+        try:
+            while line := await reader.readline():
+                for client in list(self.clients):
+                    if client is not writer:
+                        client.write(line)
+        finally:
+            self.clients.discard(writer)
+            writer.close()
+
+
+class RemoteConnection:
+    """Stands in for a player without a connection to this process, messages are forwarded through the broker."""
+
+    def __init__(self, game_id, user_id, events=None):
+        self.game_id = game_id
+        self.user_id = user_id
+        self.events = events
+
+    async def send_json(self, message):
+        frame = Frame(message) if self.events is None else self.events.frame(message, self.user_id)
+        forward(self.game_id, frame, self.user_id)
+
+
+class GameConnections(dict):
+    """
+    Connections of one game in this process, ``{user_id: Connection}``.
+
+    Looking up a player who is connected to another process returns a ``RemoteConnection``, so the game logic can
+    address every player the same way. ``events`` numbers and records everything sent to the players of the game.
+    """
+
+    def __init__(self, game_id):
+        super().__init__()
+        self.game_id = game_id
+        self.events = EventLog()
+
+    def __missing__(self, user_id):
+        return RemoteConnection(self.game_id, user_id, self.events)
+
+
+def forward(game_id, frame, user_id=None):
+    """Sends an event to the other processes (``user_id``: only to this player)."""
+    broker.publish(game_id, frame, user_id)
+
+
+def invalidation_notify_sql(user_id_column="id", channel=BROKER_CHANNEL):
+    """
+    SQL expression that sends a user invalidation through ``PostgresBroker``, for deletions that happen in the database
+    itself (the cron job in ``app.py``). The message has no origin, so every process applies it.
+    """
+    channel = channel.replace("'", "''")
+    return f"pg_notify('{channel}', '||' || {user_id_column} || '|{INVALIDATE_USER}|')"
+
+
+def check_routing(url=BROKER_URL, routing=GAME_ROUTING):
+    """Raises if events are forwarded to other processes but nothing keeps the sockets of a game together."""
+    if url.split("://", 1)[0] != "memory" and routing not in ("affinity", "external"):
+        raise RuntimeError(
+            f"BROKER_URL={url} needs game affinity routing: start the workers with affinity.py, or set "
+            "GAME_ROUTING=external behind a load balancer that routes /game/ws/{game_id} by the game id"
+        )
+
+
+def create_broker(url=BROKER_URL):
+    scheme = url.split("://", 1)[0]
+    if scheme == "memory":
+        return Broker()
+    if scheme.startswith("postgresql"):
+        return PostgresBroker(url)
+    if scheme == "unix":
+        return SocketBroker(url[len("unix://"):])
+    raise ValueError(f"Unknown broker: {url}")
+
+
+broker = create_broker()
+
+
+async def _run_hub(path):
+    hub = SocketBrokerHub(path)
+    await hub.start()
+    print(f"Broker hub listening on {path}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await hub.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(_run_hub(sys.argv[1] if len(sys.argv) > 1 else "/tmp/pp-cga-broker.sock"))
@@ -0,0 +1,152 @@
+"""
+Internal card representation of the rules engines.
+
+A card is a small int ``suit << 4 | value`` (indices in ``SUITS`` and ``VALUES``), piles are lists of such ints and
+a hand is a count array with one slot per possible card (``HAND_SLOTS``), followed by the number of cards per value
+(``VALUE_SLOTS``, regardless of the suit) and the number of cards (``HAND_SIZE``), so membership, the count of one
+value and the hand size are O(1). After these counters (from ``HAND_LENGTH`` on) the same list holds the cards of the
+hand in order, because almost every action sends a hand, which would otherwise be rebuilt from the counters every
+time. Mau Mau needs none of the counters and keeps its hands as sorted card lists (``util/maumau.py``). Hands are only
+changed through ``add_card``, ``add_cards``, ``remove_card`` and ``remove_value``, which keep the counters and the card
+order up to date. Cards are only converted from and to ``{"suit": ..., "value": ...}`` at the protocol boundary
+(``from_wire``, ``to_wire``, ``hand_to_wire``).
+"""
+import random
+from bisect import bisect_left, insort
+
+SUITS = ("Hearts", "Diamonds", "Clubs", "Spades")
+VALUES = ("7", "8", "9", "10", "J", "Q", "K", "A", "2", "3", "4", "5", "6")
+
+VALUE_7, VALUE_8, VALUE_J, VALUE_A = (VALUES.index(value) for value in ("7", "8", "J", "A"))
+
+HAND_SLOTS = len(SUITS) << 4
+VALUE_SLOTS = HAND_SLOTS  # index of the number of cards of value 0, followed by the other values
+HAND_SIZE = VALUE_SLOTS + len(VALUES)  # index of the number of cards in a hand
+HAND_LENGTH = HAND_SIZE + 1  # index of the first card of a hand, the counters come before
+
+CARD_CODES = {(suit, value): s << 4 | v for s, suit in enumerate(SUITS) for v, value in enumerate(VALUES)}
+# Protocol form of every card, shared by all outgoing messages (they are only serialized, never modified)
+WIRE_CARDS = tuple({"suit": SUITS[card >> 4], "value": VALUES[card & 15]} if card & 15 < len(VALUES) else None
+                   for card in range(HAND_SLOTS))
+
+
+def suit_of(card: int) -> int:
+    return card >> 4
+
+
+def value_of(card: int) -> int:
+    return card & 15
+
+
+def generate_card_deck(size):
+    if size not in [32, 52, 64, 104]:
+        raise ValueError("Deck size must be one of 32, 52, 64, 104")
+    values = range(13 if size in [52, 104] else 8)
+    deck = [s << 4 | v for s in range(len(SUITS)) for v in values]
+    if size in [64, 104]:
+        deck = deck * 2
+    random.shuffle(deck)
+    return deck
+
+
+def new_hand(cards=()):
+    hand = [0] * HAND_LENGTH
+    add_cards(hand, list(cards))
+    return hand
+
+
+def hand_size(hand) -> int:
+    return hand[HAND_SIZE]
+
+
+def add_card(hand, card):
+    hand[card] += 1
+    hand[VALUE_SLOTS + (card & 15)] += 1
+    hand[HAND_SIZE] += 1
+    insort(hand, card, HAND_LENGTH)
+
+
+def add_cards(hand, cards):
+    for card in cards:
+        hand[card] += 1
+        hand[VALUE_SLOTS + (card & 15)] += 1
+    hand[HAND_SIZE] += len(cards)
+    # Zwei sortierte Läufe, sort fügt sie nur zusammen
+    hand[HAND_LENGTH:] = sorted(hand[HAND_LENGTH:] + sorted(cards))
+
+
+def remove_card(hand, card):
+    hand[card] -= 1
+    hand[VALUE_SLOTS + (card & 15)] -= 1
+    hand[HAND_SIZE] -= 1
+    del hand[bisect_left(hand, card, HAND_LENGTH)]
+
+
+def hand_cards(hand):
+    """The cards of a hand as a new list, ordered by suit and value."""
+    return hand[HAND_LENGTH:]
+
+
+def value_count(hand, value) -> int:
+    return hand[VALUE_SLOTS + value]
+
+
+def value_counts(hand):
+    """Number of cards per value (index in ``VALUES``), regardless of the suit."""
+    return hand[VALUE_SLOTS:HAND_SIZE]
+
+
+def remove_value(hand, value):
+    for suit in range(len(SUITS)):
+        hand[suit << 4 | value] = 0
+    hand[HAND_SIZE] -= hand[VALUE_SLOTS + value]
+    hand[VALUE_SLOTS + value] = 0
+    hand[HAND_LENGTH:] = [card for card in hand[HAND_LENGTH:] if card & 15 != value]
+
+
+def from_wire(card):
+    """The int of a ``{"suit": ..., "value": ...}`` card from a client, None if it is no valid card."""
+    if not isinstance(card, dict) or len(card) != 2:
+        return None
+    return CARD_CODES.get((card.get("suit"), card.get("value")))
+
+
+def to_wire(card: int):
+    return WIRE_CARDS[card]
+
+
+def cards_to_wire(cards):
+    return [WIRE_CARDS[card] for card in cards]
+
+
+def hand_to_wire(hand):
+    """The hand as ``{"suit": ..., "value": ...}`` cards, ordered by suit and value."""
+    return list(map(WIRE_CARDS.__getitem__, hand[HAND_LENGTH:]))
+
+
+def upgrade_legacy_state(state, players, card_lists=False):
+    """
+    Converts games saved with ``{"suit": ..., "value": ...}`` cards and card lists as hands or with count arrays
+    without value counters or without the cards in order (in place). With ``card_lists`` the hands become sorted card
+    lists instead of count arrays (Mau Mau).
+    """
+    for key in ("draw_pile", "discard_pile"):
+        pile = state.get(key)
+        if pile and isinstance(pile[0], dict):
+            state[key] = [CARD_CODES[card["suit"], card["value"]] for card in pile]
+    for player in players.values():
+        hand = player.get("hand")
+        if not isinstance(hand, list):
+            continue
+        if hand and isinstance(hand[0], dict):
+            cards = [CARD_CODES[card["suit"], card["value"]] for card in hand]
+        elif len(hand) > HAND_SLOTS and max(hand[:HAND_SLOTS]) <= 2:
+            # Zähl-Array: eine sortierte Kartenliste hat ab der siebten Karte Werte über 2
+            if not card_lists and len(hand) >= HAND_LENGTH and len(hand) == HAND_LENGTH + hand[HAND_SIZE]:
+                continue
+            cards = [card for card in range(HAND_SLOTS) for _ in range(hand[card])]
+        elif card_lists:
+            continue
+        else:
+            cards = hand
+        player["hand"] = sorted(cards) if card_lists else new_hand(cards)
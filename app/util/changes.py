@@ -0,0 +1,68 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+class ChangeSet:
+    """
+    Top-level keys of a game's ``state`` and ``players`` that were changed by one or more actions.
+
+    A key that was changed and no longer exists afterward counts as removed. ``full_state``/``full_players`` mean
+    that the whole dictionary was replaced.
+    """
+
+    def __init__(self):
+        self.state = set()
+        self.players = set()
+        self.full_state = False
+        self.full_players = False
+
+    def __bool__(self):
+        return bool(self.state or self.players or self.full_state or self.full_players)
+
+    def merge(self, other):
+        self.state |= other.state
+        self.players |= other.players
+        self.full_state = self.full_state or other.full_state
+        self.full_players = self.full_players or other.full_players
+
+    def clear(self):
+        self.state.clear()
+        self.players.clear()
+        self.full_state = False
+        self.full_players = False
+
+
+_current = ContextVar("changes", default=None)
+
+
+def state_changed(*keys):
+    """Reports changed keys of the game state to the running action (no keys: the whole state was replaced)."""
+    changes = _current.get()
+    if changes is None:
+        return
+    if keys:
+        changes.state.update(keys)
+    else:
+        changes.full_state = True
+
+
+def players_changed(*player_ids):
+    """Reports changed players to the running action (no ids: the whole players dict was replaced)."""
+    changes = _current.get()
+    if changes is None:
+        return
+    if player_ids:
+        changes.players.update(player_ids)
+    else:
+        changes.full_players = True
+
+
+@contextmanager
+def track_changes():
+    """Collects everything reported via ``state_changed``/``players_changed`` inside the block."""
+    changes = ChangeSet()
+    token = _current.set(changes)
+    try:
+        yield changes
+    finally:
+        _current.reset(token)
@@ -0,0 +1,48 @@
+import json
+import os
+
+try:
+    import orjson
+except ImportError:  # optional dependency, the standard library is used instead
+    orjson = None
+
+# Largest inbound WebSocket message (in characters) that is parsed at all
+MAX_FRAME_SIZE = int(os.getenv('WS_MAX_FRAME_SIZE', '65536'))
+
+
+class FrameTooLargeError(ValueError):
+    pass
+
+
+def _json_dumps(obj) -> str:
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+
+
+def _orjson_dumps(obj) -> str:
+    return orjson.dumps(obj).decode()
+
+
+# name -> (dumps, loads); dumps always returns str, loads accepts str and bytes
+BACKENDS = {"json": (_json_dumps, json.loads)}
+if orjson is not None:
+    BACKENDS["orjson"] = (_orjson_dumps, orjson.loads)
+
+BACKEND = os.getenv('JSON_BACKEND', "orjson" if orjson is not None else "json")
+
+dumps, loads = BACKENDS[BACKEND]
+
+
+def use_backend(name):
+    """Switches the JSON implementation used by the whole app (e.g. for tests or benchmarks)."""
+    global BACKEND, dumps, loads
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown JSON backend: {name} (available: {', '.join(BACKENDS)})")
+    BACKEND = name
+    dumps, loads = BACKENDS[name]
+
+
+def decode_frame(data, max_size=None):
+    """Parses an inbound WebSocket message, oversized messages are rejected before parsing."""
+    if len(data) > (max_size or MAX_FRAME_SIZE):
+        raise FrameTooLargeError(f"Frame exceeds {max_size or MAX_FRAME_SIZE} characters")
+    return loads(data)
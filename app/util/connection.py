@@ -0,0 +1,210 @@
+import asyncio
+import os
+from collections import deque
+from contextlib import contextmanager
+
+from util import codec, wire
+from util.metrics import BYTES_SENT, FRAMES_DROPPED, FRAMES_SENT
+
+# Maximum number of frames waiting for one connection before the slow consumer policy kicks in
+SEND_QUEUE_SIZE = int(os.getenv('WS_SEND_QUEUE_SIZE', '64'))
+# What to do with a connection whose queue is full: drop | coalesce | disconnect
+# (coalesce replaces an older frame of the same kind and disconnects if there is none)
+SLOW_CONSUMER_POLICY = os.getenv('WS_SLOW_CONSUMER_POLICY', 'coalesce')
+
+POLICY_DROP = "drop"
+POLICY_COALESCE = "coalesce"
+POLICY_DISCONNECT = "disconnect"
+
+# Messages that only describe the latest state, so an older queued one can be replaced by a newer one
+COALESCABLE_ACTIONS = {"card_count", "turn", "lobby_data", "game_data"}
+
+CLOSE_CODE_SLOW_CONSUMER = 1013
+
+
+class Frame:
+    """
+    A message that is encoded once and can be queued for any number of connections.
+
+    ``text`` is the JSON encoding. The MessagePack encoding (``binary``) is only made when a connection using the
+    binary protocol needs it, from ``text``, and then shared as well.
+    """
+
+    __slots__ = ("action", "text", "_binary", "_size")
+
+    def __init__(self, message):
+        self.action = message.get("action") if isinstance(message, dict) else None
+        self.text = codec.dumps(message)
+        self._binary = None
+        self._size = None
+
+    @classmethod
+    def encoded(cls, text, action=None):
+        """A frame for a message that is already encoded (e.g. received from another process)."""
+        frame = cls.__new__(cls)
+        frame.action = action
+        frame.text = text
+        frame._binary = None
+        frame._size = None
+        return frame
+
+    @property
+    def binary(self) -> bytes:
+        if self._binary is None:
+            self._binary = wire.packb(codec.loads(self.text))
+        return self._binary
+
+    @property
+    def size(self) -> int:
+        """Bytes of the JSON encoding (for the metrics), counted once for all recipients."""
+        if self._size is None:
+            self._size = len(self.text) if self.text.isascii() else len(self.text.encode())
+        return self._size
+
+    @classmethod
+    def batch(cls, frames):
+        """Combines already encoded frames into one ``{"events": [...]}`` frame without encoding them again."""
+        return cls.encoded('{"events":[' + ",".join(f.text for f in frames) + ']}')
+
+
+class Connection:
+    """
+    Outbound side of one WebSocket connection.
+
+    Frames are put into a bounded queue and written by a dedicated writer task, so sending never waits for the
+    network. A message is encoded when it is queued, later changes to the game state do not affect it. Broadcasts
+    queue the same pre-encoded ``Frame`` for every recipient. ``binary`` connections get MessagePack instead of JSON
+    (see ``util/wire.py``). With an ``EventLog`` (``events``) the messages sent to this player are numbered and
+    recorded for a later resume.
+    """
+
+    def __init__(self, websocket, max_queue=SEND_QUEUE_SIZE, policy=SLOW_CONSUMER_POLICY, batch=False, events=None,
+                 user_id=None, binary=False):
+        if policy not in (POLICY_DROP, POLICY_COALESCE, POLICY_DISCONNECT):
+            raise ValueError(f"Unknown slow consumer policy: {policy}")
+        self.websocket = websocket
+        self.max_queue = max_queue
+        self.policy = policy
+        self.queue = deque()  # [Frame, ...]
+        self.closed = False
+        self.dropped = 0
+        self.batch = batch
+        self.binary = binary
+        self.events = events
+        self.user_id = user_id
+        self._held = None
+        self._close_code = None
+        self._wakeup = asyncio.Event()
+        self._writer = None
+
+    def start(self):
+        self._writer = asyncio.create_task(self._write_loop())
+
+    async def send_json(self, message):
+        """Drop-in replacement for ``WebSocket.send_json`` that only queues the message."""
+        self.enqueue(message)
+
+    def enqueue(self, message) -> bool:
+        if self.events is None:
+            return self.enqueue_frame(Frame(message))
+        return self.enqueue_frame(self.events.frame(message, self.user_id))
+
+    def enqueue_frame(self, frame) -> bool:
+        if self.closed:
+            return False
+        if self._held is not None:
+            self._held.append(frame)
+            return True
+        if len(self.queue) >= self.max_queue and not self._make_room(frame.action):
+            self.dropped += 1
+            FRAMES_DROPPED.inc()
+            return False
+        self.queue.append(frame)
+        self._wakeup.set()
+        return True
+
+    def hold(self) -> bool:
+        """Starts collecting frames instead of queueing them (only for clients that opted into batching)."""
+        if not self.batch or self._held is not None:
+            return False
+        self._held = []
+        return True
+
+    def flush(self):
+        """Queues everything collected since ``hold`` as one batch frame."""
+        held, self._held = self._held, None
+        if held:
+            self.enqueue_frame(Frame.batch(held))
+
+    def _make_room(self, action) -> bool:
+        if self.policy == POLICY_COALESCE and action in COALESCABLE_ACTIONS:
+            # Remove the older frame of the same kind, the new one is appended behind all other frames
+            for i, queued in enumerate(self.queue):
+                if queued.action == action:
+                    del self.queue[i]
+                    return True
+        if self.policy != POLICY_DROP:
+            # Ohne den Frame wäre der Zustand des Clients falsch, er merkt es erst beim Fortsetzen mit last_seq
+            self.abort(CLOSE_CODE_SLOW_CONSUMER)
+        return False
+
+    def abort(self, code=1000):
+        """Discards everything queued and closes the connection."""
+        self.queue.clear()
+        self.close_nowait(code)
+
+    def close_nowait(self, code=1000):
+        """Closes the connection after all queued frames have been written."""
+        if self._close_code is None:
+            self._close_code = code
+        self.closed = True
+        self._wakeup.set()
+
+    async def close(self, code=1000):
+        self.close_nowait(code)
+        if self._writer is not None and not self._writer.done():
+            await asyncio.shield(self._writer)
+
+    def stop(self):
+        """Stops the writer immediately, e.g. after the client disconnected."""
+        self.closed = True
+        self.queue.clear()
+        if self._writer is not None:
+            self._writer.cancel()
+
+    async def _write_loop(self):
+        try:
+            while True:
+                while not self.queue:
+                    if self.closed:
+                        await self.websocket.close(code=self._close_code or 1000)
+                        return
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                frame = self.queue.popleft()
+                if self.binary:
+                    data = frame.binary
+                    await self.websocket.send_bytes(data)
+                    FRAMES_SENT.inc("msgpack")
+                    BYTES_SENT.inc("msgpack", amount=len(data))
+                else:
+                    await self.websocket.send_text(frame.text)
+                    FRAMES_SENT.inc("json")
+                    BYTES_SENT.inc("json", amount=frame.size)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # The socket is gone, the receive loop cleans up the connection
+            self.closed = True
+            self.queue.clear()
+
+
+@contextmanager
+def batched(connections):
+    """Everything sent to ``connections`` inside the block is delivered as one frame per batching client."""
+    held = [connection for connection in connections if connection.hold()]
+    try:
+        yield
+    finally:
+        for connection in held:
+            connection.flush()
@@ -0,0 +1,306 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+
+from database import async_engine
+from util import codec
+from util.cards import upgrade_legacy_state
+from util.changes import ChangeSet
+
+# Persist after this many actions on a game (1 = write-through like before)
+PERSIST_EVERY_N_ACTIONS = int(os.getenv('GAME_STORE_PERSIST_EVERY', '10'))
+# Games without any action for this many seconds are written back and dropped from memory
+IDLE_TIMEOUT = float(os.getenv('GAME_STORE_IDLE_TIMEOUT', '900'))
+# Minimum seconds between two sweeps for idle games
+SWEEP_INTERVAL = float(os.getenv('GAME_STORE_SWEEP_INTERVAL', '60'))
+# Seconds a process's claim on a game lasts, it is renewed every third of that. The games of a crashed process can be
+# taken over after this time.
+OWNER_LEASE = float(os.getenv('GAME_OWNER_LEASE', '30'))
+# This process as owner of games (affinity.py gives every worker its own)
+OWNER_ID = os.getenv('GAME_OWNER_ID') or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+logger = logging.getLogger("app.game_store")
+
+SELECT_GAME = text("SELECT type, state, players, settings FROM game WHERE id = :id")
+CLAIM_GAME = text("UPDATE game_owner SET owner = :owner, expires = :expires "
+                  "WHERE game_id = :id AND (owner = :owner OR expires < :now)")
+INSERT_CLAIM = text("INSERT INTO game_owner (game_id, owner, expires) VALUES (:id, :owner, :expires)")
+RELEASE_GAME = text("DELETE FROM game_owner WHERE game_id = :id AND owner = :owner")
+RENEW_CLAIMS = text("UPDATE game_owner SET expires = :expires WHERE owner = :owner")
+OWNED_GAMES = text("SELECT game_id FROM game_owner WHERE owner = :owner")
+RELEASE_ALL = text("DELETE FROM game_owner WHERE owner = :owner")
+# Only the owner may write a game, a process that lost its claim cannot overwrite the new owner's state
+OWNED_BY = "id IN (SELECT game_id FROM game_owner WHERE owner = :owner)"
+
+
+class GameOwnedElsewhere(Exception):
+    """Another process holds the game in memory, the sockets of the game have to go there."""
+
+
+def _from_db(value):
+    return codec.loads(value) if isinstance(value, str) else value
+
+
+class GameEntry:
+    """Live, authoritative copy of one game row."""
+
+    def __init__(self, game_id, game_type, state, players, settings):
+        self.game_id = game_id
+        self.type = game_type
+        self.state = state
+        self.players = players
+        self.settings = settings
+        self.started = bool(state.get("started"))
+        self.changes = ChangeSet()  # changed since the last write
+        self.pending_actions = 0
+        self.last_access = time.monotonic()
+        self.lock = asyncio.Lock()  # keeps the writes of one game in order
+
+    @property
+    def dirty(self):
+        return bool(self.changes)
+
+
+class GameStore:
+    """
+    Per-process cache of running games.
+
+    A game is loaded from the database on first access and afterwards only lives in memory. It is written back
+    every ``persist_every`` actions, when the game ends, when it is evicted for being idle and on shutdown.
+
+    Only what the engines reported as changed is written: on PostgreSQL the changed top-level keys are merged into
+    the JSONB columns (``-`` and ``||``), other databases rewrite only the columns that changed. Actions that changed
+    nothing (e.g. only sent an error) are not written at all.
+
+    With several worker processes only one of them may hold a game, otherwise they would apply actions to different
+    copies and overwrite each other. A process claims a game in ``game_owner`` before loading it and releases it when
+    the game is evicted; ``get`` raises ``GameOwnedElsewhere`` while another process holds the claim. Claims are
+    renewed in the background (``start``) and expire after ``lease`` seconds, writes of a process that lost its claim
+    are rejected. ``on_claim`` and ``on_release`` are called with the game id (``affinity.py`` routes by them).
+    """
+
+    def __init__(self, persist_every=PERSIST_EVERY_N_ACTIONS, idle_timeout=IDLE_TIMEOUT,
+                 sweep_interval=SWEEP_INTERVAL, owner=OWNER_ID, lease=OWNER_LEASE, on_claim=None, on_release=None):
+        self.persist_every = max(1, persist_every)
+        self.idle_timeout = idle_timeout
+        self.sweep_interval = sweep_interval
+        self.owner = owner
+        self.lease = lease
+        self.on_claim = on_claim
+        self.on_release = on_release
+        self.games = {}  # {game_id: GameEntry}
+        self._last_sweep = time.monotonic()
+        self._sweep = None
+        self._renewal = None
+
+    def start(self):
+        """Starts renewing the claims of this process."""
+        if self._renewal is None:
+            self._renewal = asyncio.create_task(self._renew_claims())
+
+    async def close(self):
+        """Writes every game back and releases all claims, other processes can take the games over right away."""
+        if self._renewal is not None:
+            self._renewal.cancel()
+            self._renewal = None
+        await self.flush()
+        async with async_engine.begin() as db_conn:
+            await db_conn.execute(RELEASE_ALL, {"owner": self.owner})
+        for game_id in list(self.games):
+            self._released(game_id)
+        self.games.clear()
+
+    def __contains__(self, game_id):
+        return game_id in self.games
+
+    async def get(self, game_id):
+        """Returns the live entry of a game, loading it from the database if necessary (None if it does not exist)."""
+        if time.monotonic() - self._last_sweep >= self.sweep_interval and (self._sweep is None or self._sweep.done()):
+            # Im Hintergrund, damit die aktuelle Aktion nicht auf das Schreiben anderer Spiele wartet
+            self._sweep = asyncio.create_task(self.evict_idle())
+        entry = self.games.get(game_id)
+        if entry is None:
+            await self._claim(game_id)
+            loaded = await self._load(game_id)
+            if loaded is None:
+                await self._release(game_id)
+                return None
+            # Ein paralleler Aufruf kann das Spiel inzwischen geladen haben
+            entry = self.games.setdefault(game_id, loaded)
+        entry.last_access = time.monotonic()
+        return entry
+
+    async def update(self, entry, state, players, changes=None):
+        """
+        Stores the result of an action and persists it if the policy says so.
+
+        ``changes`` is the ``ChangeSet`` reported by the engine, None means everything may have changed.
+        """
+        entry.last_access = time.monotonic()
+        if changes is None:
+            changes = ChangeSet()
+            changes.full_state = changes.full_players = True
+        if not changes:
+            return
+        game_ended = entry.started and not state.get("started")
+        entry.started = bool(state.get("started"))
+        entry.state = state
+        entry.players = players
+        entry.changes.merge(changes)
+        entry.pending_actions += 1
+        if game_ended or entry.pending_actions >= self.persist_every:
+            await self.persist(entry)
+
+    async def persist(self, entry, full=False):
+        """Writes the pending changes of a game (``full``: both columns completely)."""
+        async with entry.lock:
+            # The game can change while the statement runs, that is left for the next write
+            changes, entry.changes = entry.changes, ChangeSet()
+            pending_actions, entry.pending_actions = entry.pending_actions, 0
+            params = {"id": entry.game_id}
+            assignments = [
+                self._assignment("state", entry.state, changes.state, full or changes.full_state, params),
+                self._assignment("players", entry.players, changes.players, full or changes.full_players, params)
+            ]
+            assignments = [assignment for assignment in assignments if assignment]
+            if not assignments:
+                return
+            params["owner"] = self.owner
+            try:
+                async with async_engine.begin() as db_conn:
+                    result = await db_conn.execute(
+                        text(f"UPDATE game SET {', '.join(assignments)} WHERE id = :id AND {OWNED_BY}"), params
+                    )
+            except BaseException:
+                # Auch bei Abbruch (CancelledError), sonst gingen die Änderungen verloren
+                entry.changes.merge(changes)
+                entry.pending_actions += pending_actions
+                raise
+            if result.rowcount == 0:
+                # Die Sperre ist abgelaufen und ein anderer Prozess hat das Spiel übernommen, dieser Stand ist veraltet
+                self._lost(entry.game_id)
+                raise GameOwnedElsewhere(entry.game_id)
+
+    @staticmethod
+    def _assignment(column, value, keys, full, params):
+        if full:
+            params[column] = codec.dumps(value)
+            return f"{column} = :{column}"
+        if not keys:
+            return None
+        if async_engine.dialect.name != "postgresql":
+            # No partial JSON updates on this database, rewrite the column
+            params[column] = codec.dumps(value)
+            return f"{column} = :{column}"
+        removed = [key for key in keys if key not in value]
+        params[f"{column}_patch"] = codec.dumps({key: value[key] for key in keys if key in value})
+        expression = column
+        if removed:
+            params[f"{column}_removed"] = removed
+            expression = f"({column} - CAST(:{column}_removed AS text[]))"
+        return f"{column} = {expression} || CAST(:{column}_patch AS jsonb)"
+
+    async def evict(self, game_id):
+        entry = self.games.get(game_id)
+        if entry is None:
+            return
+        if entry.dirty:
+            await self.persist(entry, full=True)
+        # Während des Schreibens kann das Spiel wieder benutzt worden sein, dann bleibt es im Speicher
+        if not entry.dirty and self.games.get(game_id) is entry:
+            del self.games[game_id]
+            await self._release(game_id)
+
+    async def discard(self, game_id):
+        """
+        Drops the live copy of a game without writing it, the next ``get`` loads the last persisted state again
+        (actions since the last write are lost). For copies an engine may have left half changed.
+        """
+        if self.games.pop(game_id, None) is not None:
+            await self._release(game_id)
+
+    async def evict_idle(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_sweep < self.sweep_interval:
+            return
+        self._last_sweep = now
+        for game_id, entry in list(self.games.items()):
+            if now - entry.last_access > self.idle_timeout:
+                try:
+                    await self.evict(game_id)
+                except Exception:
+                    logger.exception("evict failed", extra={"fields": {"game_id": game_id}})
+
+    async def flush(self):
+        """Writes every game with unsaved actions back to the database (used on shutdown)."""
+        for entry in list(self.games.values()):
+            if entry.dirty:
+                try:
+                    await self.persist(entry, full=True)
+                except Exception:
+                    logger.exception("persist failed", extra={"fields": {"game_id": entry.game_id}})
+
+    async def _claim(self, game_id):
+        now = time.time()
+        params = {"id": game_id, "owner": self.owner, "expires": now + self.lease, "now": now}
+        try:
+            async with async_engine.begin() as db_conn:
+                if (await db_conn.execute(CLAIM_GAME, params)).rowcount == 0:
+                    await db_conn.execute(INSERT_CLAIM, params)
+        except IntegrityError:
+            raise GameOwnedElsewhere(game_id) from None
+        if self.on_claim is not None:
+            self.on_claim(game_id)
+
+    async def _release(self, game_id):
+        async with async_engine.begin() as db_conn:
+            await db_conn.execute(RELEASE_GAME, {"id": game_id, "owner": self.owner})
+        if game_id in self.games:
+            # Während des Freigebens wieder geladen, die Sperre muss bleiben
+            try:
+                await self._claim(game_id)
+            except GameOwnedElsewhere:
+                self._lost(game_id)
+            return
+        self._released(game_id)
+
+    def _released(self, game_id):
+        if self.on_release is not None:
+            self.on_release(game_id)
+
+    def _lost(self, game_id):
+        logger.error("game claimed by another process", extra={"fields": {"game_id": game_id, "owner": self.owner}})
+        self.games.pop(game_id, None)
+        self._released(game_id)
+
+    async def _renew_claims(self):
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            held = set(self.games)
+            try:
+                async with async_engine.begin() as db_conn:
+                    await db_conn.execute(RENEW_CLAIMS, {"owner": self.owner, "expires": time.time() + self.lease})
+                    owned = {row[0] for row in await db_conn.execute(OWNED_GAMES, {"owner": self.owner})}
+            except Exception:
+                logger.exception("renewing game claims failed", extra={"fields": {"owner": self.owner}})
+                continue
+            for game_id in held - owned:
+                if game_id in self.games:
+                    self._lost(game_id)
+
+    @staticmethod
+    async def _load(game_id):
+        async with async_engine.connect() as db_conn:
+            game_data = (await db_conn.execute(SELECT_GAME, {"id": game_id})).mappings().first()
+        if game_data is None:
+            return None
+        state, players = _from_db(game_data["state"]), _from_db(game_data["players"])
+        # Spiele von vor der Umstellung auf Int-Karten und Zähl-Arrays, Mau Mau hält Hände als sortierte Kartenlisten
+        upgrade_legacy_state(state, players, card_lists=game_data["type"] == "MAU_MAU")
+        return GameEntry(game_id, game_data["type"], state, players, _from_db(game_data["settings"]))
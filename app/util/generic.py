@@ -4,8 +4,12 @@ import string
 from datetime import datetime, timedelta, timezone
 
 import jwt
+from sqlalchemy import select
 
 from models.game import GameModel
+from util.broker import forward
+from util.changes import state_changed
+from util.connection import Frame
 
 SECRET_KEY = os.getenv('SECRET_KEY', 'default_secret_key')
 AUDIENCE = os.getenv('AUDIENCE', 'PP-CGA-BE')
@@ -19,18 +23,25 @@ def generate_random_number(length) -> str:
     return ''.join(random.choice(string.digits) for _ in range(length))
 
 
-def generate_random_number_and_check_if_exists(length, db):
+async def generate_random_number_and_check_if_exists(length, db):
     max_tries = 1000
     for _ in range(max_tries):
         code = generate_random_number(length)
-        if not db.query(GameModel).filter_by(code=code).first():
+        if (await db.execute(select(GameModel.id).filter_by(code=code))).first() is None:
             return code
     raise ValueError("Max tries exceeded while generating a unique code")
 
 
 async def send_to_all(websockets, message):
-    for ws in websockets.values():
-        await ws.send_json(message)
+    # Encodes the message once and only queues it, the writer task of each connection does the network I/O
+    events = getattr(websockets, "events", None)
+    frame = Frame(message) if events is None else events.frame(message)
+    for connection in websockets.values():
+        connection.enqueue_frame(frame)
+    # Spieler, die mit einem anderen Prozess verbunden sind
+    game_id = getattr(websockets, "game_id", None)
+    if game_id is not None:
+        forward(game_id, frame)
 
 
 def flip_pile_if_empty(state):
@@ -45,26 +56,10 @@ def flip_pile_if_empty(state):
         random.shuffle(new_draw_pile)
         state['draw_pile'] = new_draw_pile
         state['discard_pile'] = [top_card]
+        state_changed('draw_pile', 'discard_pile')
     return state
 
 
-class GameLock:
-    def __init__(self):
-        self.locks = {}
-
-    def acquire(self, game_id):
-        if game_id in self.locks:
-            return False
-        self.locks[game_id] = True
-        return True
-
-    def release(self, game_id):
-        if game_id in self.locks:
-            del self.locks[game_id]
-            return True
-        return False
-
-
 def gen_token(user):
     payload = {
         "aud":      AUDIENCE,
@@ -1,5 +1,7 @@
 import random
 
+from sqlalchemy import select
+
 from models.user import UserModel
 
 adjectives = [
@@ -49,10 +51,10 @@ def generate_guestname():
     return f"{adj_corrected}{animal}"
 
 
-def generate_random_name_and_check_if_exists(db):
+async def generate_random_name_and_check_if_exists(db):
     max_tries = 1000
     for _ in range(max_tries):
         name = generate_guestname()
-        if not db.query(UserModel.username).filter_by(username=name).first():
+        if (await db.execute(select(UserModel.username).filter_by(username=name))).first() is None:
             return name
     raise ValueError("Max tries exceeded while generating a unique guestname")
@@ -0,0 +1,135 @@
+"""
+Hands client connections from the proxy in ``affinity.py`` to its workers, so the proxy never relays their data.
+
+The proxy only reads the request head of a new connection. It sends the socket itself (``SCM_RIGHTS``) together with
+the bytes read so far to the chosen worker over a ``SOCK_SEQPACKET`` pair, whose worker end is passed in
+``AFFINITY_HANDOFF_FD``. The worker serves it like a connection it accepted itself, the proxy closes its copy. From
+then on client and worker talk directly, the proxy costs nothing per message.
+
+In the other direction every worker reports the games its ``GameStore`` holds: ``+game_id`` after claiming a game,
+``-game_id`` after saving and releasing it. The proxy keeps sending a game's sockets to the worker that reported it
+until the release, so a game only moves once it is written back.
+"""
+import asyncio
+import logging
+import os
+import socket
+
+import uvicorn
+
+# Worker end of the handoff socket, set by affinity.py
+HANDOFF_FD = os.getenv('AFFINITY_HANDOFF_FD')
+# Largest message on the handoff socket: request head plus whatever the client sent with it
+MAX_MESSAGE_SIZE = 128 * 1024
+
+CONNECTION = b"C"
+CLAIMED = b"+"
+RELEASED = b"-"
+
+logger = logging.getLogger("app.handoff")
+
+
+async def send_message(channel, data, fds=()):
+    """Sends one message (and file descriptors) over a non-blocking ``SOCK_SEQPACKET`` socket."""
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            socket.send_fds(channel, [data], fds)
+            return
+        except BlockingIOError:
+            writable = loop.create_future()
+            loop.add_writer(channel, lambda: writable.done() or writable.set_result(None))
+            try:
+                await writable
+            finally:
+                loop.remove_writer(channel)
+
+
+class WorkerChannel:
+    """The worker's end of the handoff socket."""
+
+    def __init__(self, fd):
+        self.sock = socket.socket(fileno=int(fd))
+        self.sock.setblocking(False)
+
+    def start(self, create_protocol):
+        """Serves every handed over connection with a protocol from ``create_protocol()``."""
+        asyncio.get_running_loop().add_reader(self.sock, self._receive, create_protocol)
+
+    def notify(self, kind, game_id):
+        try:
+            self.sock.send(kind + game_id.encode())
+        except OSError:
+            # Der Proxy routet dann nach dem Ring, im schlimmsten Fall schließt der Worker den Socket mit 1013
+            logger.warning("game report lost", extra={"fields": {"game_id": game_id, "kind": kind.decode()}})
+
+    def _receive(self, create_protocol):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                data, fds, _, _ = socket.recv_fds(self.sock, MAX_MESSAGE_SIZE, 1)
+            except BlockingIOError:
+                return
+            if not data:
+                loop.remove_reader(self.sock)
+                logger.error("proxy closed the handoff socket")
+                return
+            if data[:1] != CONNECTION or len(fds) != 1:
+                for fd in fds:
+                    os.close(fd)
+                continue
+            client = socket.socket(fileno=fds[0])
+            client.setblocking(False)
+            loop.create_task(_serve(client, data[1:], create_protocol))
+
+
+async def _serve(client, initial, create_protocol):
+    def factory():
+        protocol = create_protocol()
+        connection_made = protocol.connection_made
+
+        def replay(transport):
+            connection_made(transport)
+            # Was der Proxy schon gelesen hat, zuerst
+            protocol.data_received(initial)
+
+        protocol.connection_made = replay
+        return protocol
+
+    try:
+        await asyncio.get_running_loop().connect_accepted_socket(factory, client)
+    except Exception:
+        logger.exception("handed over connection failed")
+        client.close()
+
+
+channel = WorkerChannel(HANDOFF_FD) if HANDOFF_FD else None
+
+
+def report_claimed(game_id):
+    if channel is not None:
+        channel.notify(CLAIMED, game_id)
+
+
+def report_released(game_id):
+    if channel is not None:
+        channel.notify(RELEASED, game_id)
+
+
+class HandoffServer(uvicorn.Server):
+    """uvicorn server that also serves the connections handed over on ``channel``."""
+
+    def __init__(self, config, channel):
+        super().__init__(config)
+        self.channel = channel
+
+    async def startup(self, sockets=None):
+        await super().startup(sockets)
+        if self.should_exit or self.channel is None:
+            return
+
+        def create_protocol(_loop=None):
+            return self.config.http_protocol_class(config=self.config, server_state=self.server_state,
+                                                   app_state=self.lifespan.state, _loop=_loop)
+
+        self.channel.start(create_protocol)
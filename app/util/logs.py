@@ -0,0 +1,128 @@
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+from util import codec
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# json: one JSON object per line | text: human-readable lines for local development
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+# Share of actions (0.0 - 1.0) that additionally log the full game state. Contains the hands of all players!
+LOG_STATE_SAMPLE_RATE = float(os.getenv('LOG_STATE_SAMPLE_RATE', '0'))
+
+# All loggers of the app live below this name, so they share one non-blocking handler
+ROOT_LOGGER = "app"
+
+action_logger = logging.getLogger(f"{ROOT_LOGGER}.actions")
+state_logger = logging.getLogger(f"{ROOT_LOGGER}.state")
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record and its structured ``fields`` (passed via ``extra``) as one JSON line."""
+
+    def format(self, record):
+        entry = {
+            "time":    time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level":   record.levelname,
+            "logger":  record.name,
+            "message": record.getMessage()
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        try:
+            return codec.dumps(entry)
+        except TypeError:
+            return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """Appends the structured ``fields`` as ``key=value`` pairs to a classic log line."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """
+    Puts records into the queue without formatting them, formatting and writing happen in the listener thread.
+
+    Only the message itself is rendered right away, so later changes to its arguments do not end up in the log.
+    """
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+_listener = None
+
+
+def setup_logging(stream=None):
+    """Routes all ``app.*`` loggers through a queue to a background thread that does the actual I/O."""
+    global _listener
+    if _listener is not None:
+        return
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+    log_queue = queue.SimpleQueue()
+    _listener = QueueListener(log_queue, handler)
+
+    logger = logging.getLogger(ROOT_LOGGER)
+    logger.setLevel(LOG_LEVEL)
+    logger.handlers = [_NonBlockingQueueHandler(log_queue)]
+    logger.propagate = False
+    _listener.start()
+
+
+def shutdown_logging():
+    """Writes everything still queued and stops the background thread."""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    _listener = None
+    logger = logging.getLogger(ROOT_LOGGER)
+    logger.handlers = []
+    logger.propagate = True
+
+
+def log_action(game_id, user_id, action, duration, payload_size, **fields):
+    """One structured record per processed player action."""
+    if not action_logger.isEnabledFor(logging.INFO):
+        return
+    action_logger.info("action", extra={"fields": {
+        "game_id":      game_id,
+        "user_id":      user_id,
+        "action":       action,
+        "duration_ms":  round(duration * 1000, 3),
+        "payload_size": payload_size,
+        **fields
+    }})
+
+
+def log_state(game_id, state, players, settings, sample_rate=None):
+    """Logs the complete game, but only for a sampled share of the actions (off by default)."""
+    rate = LOG_STATE_SAMPLE_RATE if sample_rate is None else sample_rate
+    if rate <= 0 or random.random() >= rate or not state_logger.isEnabledFor(logging.INFO):
+        return
+    # Sofort serialisieren, der Zustand wird von der nächsten Aktion weiter verändert
+    state_logger.info("state", extra={"fields": {
+        "game_id":  game_id,
+        "state":    codec.dumps(state),
+        "players":  codec.dumps(players),
+        "settings": codec.dumps(settings)
+    }})
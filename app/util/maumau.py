@@ -1,48 +1,75 @@
-import random
+from bisect import bisect_left, insort
 
-VALUE = 'value'
-SUIT = 'suit'
+from util.cards import (  # noqa: F401
+    CARD_CODES,
+    SUITS,
+    VALUE_7,
+    VALUE_8,
+    VALUE_J,
+    cards_to_wire,
+    generate_card_deck,
+    suit_of,
+    value_of
+)
+from util.seating import get_next_player  # noqa: F401
 
 
-def can_place_card_on_stack(new_card, last_card, game_state_j_choice):
+# Mau-Mau-Hände halten nur wenige Karten und brauchen keine Zähler je Wert: eine sortierte Liste der Karten ist dafür
+# schneller als die Zähl-Arrays aus util/cards.py
+def new_hand(cards=()):
+    return sorted(cards)
+
+
+def add_card(hand, card):
+    insort(hand, card)
+
+
+def remove_card(hand, card):
+    del hand[bisect_left(hand, card)]
+
+
+def hand_to_wire(hand):
+    """The hand as ``{"suit": ..., "value": ...}`` cards, ordered by suit and value."""
+    return cards_to_wire(hand)
+
+
+def _can_place(new_card, last_card, game_state_j_choice):
     # No Jack on Jack action 😳
-    if new_card[VALUE] == 'J' and last_card[VALUE] == 'J':
+    if value_of(new_card) == VALUE_J and value_of(last_card) == VALUE_J:
         return False
 
     # Jack gets whatever he wants 😏
-    if last_card[VALUE] == 'J':
-        return new_card[SUIT] == game_state_j_choice
+    if value_of(last_card) == VALUE_J:
+        return SUITS[suit_of(new_card)] == game_state_j_choice
 
     # Cards are homo and need the same value or suit
-    return new_card[VALUE] == last_card[VALUE] or new_card[SUIT] == last_card[SUIT] or new_card[VALUE] == 'J'
+    return value_of(new_card) == value_of(last_card) or suit_of(new_card) == suit_of(last_card) \
+        or value_of(new_card) == VALUE_J
+
 
+# (oberste Karte, j_choice) -> Karten, die darauf gelegt werden dürfen
+PLAYABLE_CARDS = {
+    (last_card, j_choice): frozenset(card for card in CARD_CODES.values() if _can_place(card, last_card, j_choice))
+    for last_card in CARD_CODES.values() for j_choice in ("",) + SUITS
+}
 
-def generate_card_deck(size):
-    if size not in [32, 52, 64, 104]:
-        raise ValueError("Deck size must be one of 32, 52, 64, 104")
-    suits = ['Hearts', 'Diamonds', 'Clubs', 'Spades']
-    values = ['7', '8', '9', '10', 'J', 'Q', 'K', 'A']
-    if size in [52, 104]:
-        values += ['2', '3', '4', '5', '6']
 
-    deck = [{SUIT: suit, VALUE: value} for suit in suits for value in values]
-    if size in [64, 104]:
-        deck = deck * 2
-        # deck.extend(deck)
-    random.shuffle(deck)
-    return deck
+def can_place_card_on_stack(new_card, last_card, game_state_j_choice):
+    return new_card in PLAYABLE_CARDS.get((last_card, game_state_j_choice), ())
+
+
+def playable_cards(hand, last_card, game_state_j_choice, count_7=0):
+    """The cards of a hand that may be placed now, ordered by suit and value."""
+    cards = sorted(PLAYABLE_CARDS.get((last_card, game_state_j_choice), frozenset()).intersection(hand))
+    if count_7:
+        # Offene 7er: nur eine weitere 7 verhindert das Ziehen der Strafkarten
+        cards = [card for card in cards if value_of(card) == VALUE_7]
+    return cards
 
 
 def turn_first_card(game_state_draw_pile, game_state_discard_pile):
     game_state_discard_pile.append(game_state_draw_pile.pop())
-    if game_state_discard_pile[-1]["value"] in ['7', '8', 'J']:
+    if value_of(game_state_discard_pile[-1]) in (VALUE_7, VALUE_8, VALUE_J):
         return turn_first_card(game_state_draw_pile, game_state_discard_pile)
     return game_state_draw_pile, game_state_discard_pile
 
-
-def get_next_player(current_player_id, game_players, skip=0):
-    sorted_players = sorted(game_players.keys(), key=lambda pid: game_players[pid]['join_sequence'])
-    current_index = sorted_players.index(current_player_id)
-    next_index = (current_index + 1 + skip) % len(sorted_players)
-
-    return sorted_players[next_index]
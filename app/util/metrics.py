@@ -0,0 +1,266 @@
+"""
+Metrics of this process in the Prometheus text format (0.0.4), served at ``GET /metrics``.
+
+Counters and histograms are plain lists of numbers, updated in the event loop without locks (a histogram observation
+is one ``bisect`` and two additions). Nothing is formatted before a scrape, gauges are only read then. There is no
+client library, each worker process of ``affinity.py`` reports its own numbers and Prometheus adds them up.
+
+Labels whose values come from clients (``capped``, e.g. the action of a message) are limited per metric
+(``METRICS_MAX_SERIES``), further values are counted as ``other``. Labels set by the server (phase, status) are kept.
+"""
+import os
+import time
+from bisect import bisect_left
+
+from sqlalchemy import event
+
+# Serve GET /metrics and time the REST requests (the game socket is always measured, it costs next to nothing)
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# Label combinations per metric, a client inventing action names cannot blow up the memory this way
+METRICS_MAX_SERIES = int(os.getenv('METRICS_MAX_SERIES', '200'))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds, from a fast rules engine action up to a slow database
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0)
+OTHER = "other"
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, documentation, labelnames=(), max_series=None, registry=None, capped=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.capped = frozenset(capped)  # labels with values from clients
+        self.max_series = METRICS_MAX_SERIES if max_series is None else max_series
+        self.series = {}  # {label values: value(s)}
+        (_registry if registry is None else registry).append(self)
+
+    def _new_series(self, labels):
+        if self.capped and len(self.series) >= self.max_series:
+            labels = tuple(OTHER if name in self.capped else value for name, value in zip(self.labelnames, labels))
+            if labels in self.series:
+                return self.series[labels]
+        series = self.series[labels] = self._empty()
+        return series
+
+    def _empty(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines += self._samples()
+        return lines
+
+    def _samples(self):
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """A number that only goes up, e.g. sent frames."""
+
+    kind = "counter"
+
+    def _empty(self):
+        return [0]
+
+    def inc(self, *labels, amount=1):
+        series = self.series.get(labels)
+        if series is None:
+            series = self._new_series(labels)
+        series[0] += amount
+
+    def value(self, *labels):
+        series = self.series.get(labels)
+        return series[0] if series else 0
+
+    def _samples(self):
+        return [f"{self.name}{_labels(self.labelnames, labels)} {_number(series[0])}"
+                for labels, series in self.series.items()]
+
+
+class Histogram(_Metric):
+    """Distribution of durations in seconds, ``observe`` counts a value in its bucket."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, max_series=None, registry=None,
+                 capped=()):
+        super().__init__(name, documentation, labelnames, max_series, registry, capped)
+        self.buckets = tuple(sorted(buckets))
+
+    def _empty(self):
+        # Anzahl je Bucket (nicht kumuliert), dann +Inf, dann die Summe
+        return [0] * (len(self.buckets) + 2)
+
+    def observe(self, value, *labels):
+        series = self.series.get(labels)
+        if series is None:
+            series = self._new_series(labels)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def count(self, *labels):
+        series = self.series.get(labels)
+        return sum(series[:-1]) if series else 0
+
+    def _samples(self):
+        lines = []
+        for labels, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(series[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Gauge(_Metric):
+    """
+    A current value, read from ``collect`` at every scrape. ``collect`` returns a number, or ``{label values: number}``
+    for a gauge with labels.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, collect, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.collect = collect
+
+    def _samples(self):
+        values = self.collect()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}" for labels, value in values.items()]
+
+
+def render():
+    """All metrics of this process in the text format."""
+    lines = []
+    for metric in _registry:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+# ============================================================
+# Metrics of the app
+# ============================================================
+ACTION_SECONDS = Histogram(
+    "game_action_seconds",
+    "Time per phase of a WebSocket action: lock_wait (inbox of the game actor), load (game from memory or database), "
+    "decision (rules engine), broadcast (encoding and queueing the messages), persist (database write, if due).",
+    ("action", "phase"), capped=("action",)
+)
+FRAMES_SENT = Counter("ws_frames_sent_total", "WebSocket frames written to clients.", ("protocol",))
+BYTES_SENT = Counter("ws_bytes_sent_total", "Bytes of the WebSocket frames written to clients.", ("protocol",))
+FRAMES_DROPPED = Counter("ws_frames_dropped_total", "Frames not sent because the queue of a slow client was full.")
+TURN_TIMEOUTS = Counter("game_turn_timeouts_total", "Players removed because their turn time ran out.", ("game",))
+# Die Route ist das Template der App, die Methode kann ein Client frei wählen
+HTTP_SECONDS = Histogram("http_request_duration_seconds", "Duration of REST requests.", ("method", "route", "status"),
+                         capped=("method",))
+PASSWORD_SECONDS = Histogram(
+    "password_hash_seconds", "Time spent in bcrypt (register, password change: hash, login: verify).", ("operation",)
+)
+POOL_CHECKOUTS = Counter("db_pool_checkouts_total", "Connections taken from the SQLAlchemy pool.", ("engine",))
+POOL_HOLD_SECONDS = Histogram("db_pool_checkout_seconds", "How long a connection stayed checked out.", ("engine",))
+ACTOR_QUEUE_WAIT = Histogram(
+    "game_actor_queue_wait_seconds", "Time jobs (actions and timer events) waited in the inbox of their game actor."
+)
+_pools = {}  # {engine name: Pool}
+_schedulers = []  # GameScheduler (util/actor.py)
+
+
+def _pool_status():
+    values = {}
+    for name, pool in _pools.items():
+        # NullPool (SQLite) hat keine Größe
+        for stat in ("size", "checkedout", "overflow"):
+            function = getattr(pool, stat, None)
+            if callable(function):
+                values[(name, stat)] = function()
+    return values
+
+
+POOL_STATUS = Gauge("db_pool_connections", "State of the SQLAlchemy pools: size, checkedout, overflow.", _pool_status,
+                    ("engine", "state"))
+
+
+def _actor_queue_depth():
+    depths = [actor.queue_depth for scheduler in _schedulers for actor in scheduler.actors.values()]
+    return {("total",): sum(depths), ("max",): max(depths, default=0)}
+
+
+ACTOR_QUEUE_DEPTH = Gauge("game_actor_queue_depth", "Jobs waiting in the game actors' inboxes: total, max (one game).",
+                          _actor_queue_depth, ("stat",))
+
+
+def track_scheduler(scheduler):
+    """Reports the inbox depth of a scheduler's game actors."""
+    _schedulers.append(scheduler)
+
+
+def track_pool(engine, name):
+    """Counts checkouts of an engine's pool (async engines: their ``sync_engine``) and how long they last."""
+    pool = getattr(engine, "sync_engine", engine).pool
+    _pools[name] = pool
+
+    @event.listens_for(pool, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        POOL_CHECKOUTS.inc(name)
+        connection_record.info["metrics_checkout"] = time.perf_counter()
+
+    @event.listens_for(pool, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        start = connection_record.info.pop("metrics_checkout", None)
+        if start is not None:
+            POOL_HOLD_SECONDS.observe(time.perf_counter() - start, name)
+
+
+class HttpMetricsMiddleware:
+    """ASGI middleware: duration of every REST request by method, route template and status. WebSockets pass through."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # Die Vorlage (/game/{game_code}) statt des Pfads, sonst gäbe es eine Zeitreihe pro Spiel
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_SECONDS.observe(time.perf_counter() - start, scope["method"], route, str(status[0]))
@@ -0,0 +1,35 @@
+"""
+Messages produced by one action of a rules engine, delivered after the action.
+
+The engines (``logic/maumau.py``, ``logic/lügen.py``) only evaluate rules and append their messages to an ``Outbox``
+(``apply``), they never wait for the network. ``deliver`` sends them in order, so one action can be simulated,
+replayed or batched without any connection.
+"""
+from util.generic import send_to_all
+
+ALL = None  # every player of the game
+SENDER = ""  # the connection that sent the action (it may not have joined the game yet)
+
+
+class Outbox(list):
+    """``[(recipient, message), ...]`` in the order they have to be sent, recipient: ``ALL``, ``SENDER`` or a player id."""
+
+    def to_all(self, message):
+        self.append((ALL, message))
+
+    def to_player(self, player_id, message):
+        self.append((player_id, message))
+
+    def reply(self, message):
+        self.append((SENDER, message))
+
+
+async def deliver(outbox, websocket, websocket_connections):
+    """Sends the messages of an action, broadcasts are encoded once for all players (``send_to_all``)."""
+    for recipient, message in outbox:
+        if recipient is ALL:
+            await send_to_all(websocket_connections, message)
+        elif recipient == SENDER:
+            await websocket.send_json(message)
+        else:
+            await websocket_connections[recipient].send_json(message)
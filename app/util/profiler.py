@@ -0,0 +1,109 @@
+"""
+Sampling profiler for the event loop thread, started on demand (``GET /admin/profile``, see ``routers/admin.py``).
+
+A daemon thread looks at the stack of the profiled thread every ``interval`` seconds (``sys._current_frames``) and
+counts how often each stack occurs. The profiled code is not instrumented at all, its only cost is the GIL the
+sampler holds for a few microseconds per sample. A stack is kept as a tuple of code objects and turned into names only
+for the output:
+
+- collapsed stacks (``a;b;c 12`` per line) for ``flamegraph.pl``, speedscope or inferno
+- the speedscope JSON format (https://www.speedscope.app)
+
+``focus`` keeps only the frames of the rules engines (``logic/``) and of the game socket (``routers/game.py``), samples
+without such a frame (e.g. the idle event loop) are dropped.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# Seconds between two samples
+PROFILER_INTERVAL = float(os.getenv('PROFILER_INTERVAL', '0.005'))
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FOCUS_PATHS = (os.path.join(APP_DIR, "logic") + os.sep, os.path.join(APP_DIR, "routers", "game.py"))
+
+
+def frame_name(code):
+    """``function (file:line)``, files of the app relative to the ``app`` directory."""
+    filename = code.co_filename
+    if filename.startswith(APP_DIR + os.sep):
+        filename = filename[len(APP_DIR) + 1:]
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({filename}:{code.co_firstlineno})"
+
+
+def focused(stacks):
+    """Only the frames in ``FOCUS_PATHS``, stacks that have none are left out."""
+    result = Counter()
+    for stack, count in stacks.items():
+        kept = tuple(code for code in stack if code.co_filename.startswith(FOCUS_PATHS))
+        if kept:
+            result[kept] += count
+    return result
+
+
+class SamplingProfiler:
+    """Samples the stack of one thread from a background thread until ``stop``."""
+
+    def __init__(self, thread_id, interval=PROFILER_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()  # {(code, ...) from the outermost frame: samples}
+        self.duration = 0.0
+        self._started = None
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self._started
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            if stack:
+                stack.reverse()
+                self.stacks[tuple(stack)] += 1
+            del frame
+
+    def collapsed(self, focus=False):
+        stacks = focused(self.stacks) if focus else self.stacks
+        return "".join(f"{';'.join(frame_name(code) for code in stack)} {count}\n"
+                       for stack, count in stacks.most_common())
+
+    def speedscope(self, name, focus=False):
+        stacks = focused(self.stacks) if focus else self.stacks
+        frames, index = [], {}
+        samples, weights = [], []
+        for stack, count in stacks.most_common():
+            for code in stack:
+                if code not in index:
+                    index[code] = len(frames)
+                    frames.append({"name": getattr(code, "co_qualname", code.co_name), "file": code.co_filename,
+                                   "line": code.co_firstlineno})
+            samples.append([index[code] for code in stack])
+            weights.append(count * self.interval)
+        return {
+            "$schema":  "https://www.speedscope.app/file-format-schema.json",
+            "shared":   {"frames": frames},
+            "profiles": [{
+                "type":       "sampled",
+                "name":       name,
+                "unit":       "seconds",
+                "startValue": 0,
+                "endValue":   sum(weights),
+                "samples":    samples,
+                "weights":    weights,
+            }],
+            "exporter": "PP-CGA-BE util/profiler.py",
+        }
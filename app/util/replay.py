@@ -0,0 +1,38 @@
+import os
+import time
+from collections import deque
+
+from util.connection import Frame
+
+# Number of recent events per game kept for clients that reconnect
+REPLAY_BUFFER_SIZE = int(os.getenv('WS_REPLAY_BUFFER_SIZE', '256'))
+
+
+class EventLog:
+    """
+    Numbers the outbound events of one game (``"seq"``) and keeps the most recent ones.
+
+    Numbers increase by one per event. A new log (e.g. after the game was loaded again or moved to another process)
+    starts at the current time in microseconds, so its numbers are above all numbers of earlier logs and an old
+    ``last_seq`` is never mistaken for one of its events.
+    """
+
+    def __init__(self, size=REPLAY_BUFFER_SIZE):
+        self.seq = time.time_ns() // 1000
+        self.events = deque(maxlen=size)  # [(seq, user_id or None, Frame), ...]
+
+    def frame(self, message, user_id=None):
+        """Numbers a message and records it, ``user_id``: the message is only for this player."""
+        self.seq += 1
+        frame = Frame({**message, "seq": self.seq})
+        self.events.append((self.seq, user_id, frame))
+        return frame
+
+    def since(self, last_seq, user_id):
+        """The frames for a player after ``last_seq``, None if they are not all buffered anymore."""
+        if last_seq > self.seq:
+            return None
+        if last_seq < self.seq and (not self.events or self.events[0][0] > last_seq + 1):
+            return None
+        return [frame for seq, recipient, frame in self.events
+                if seq > last_seq and (recipient is None or recipient == user_id)]
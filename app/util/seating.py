@@ -0,0 +1,70 @@
+"""
+Seating order of a running game, kept in the game state as a ring.
+
+``state["seating"]`` is ``{"first": player_id, "seats": {player_id: [previous_id, next_id]}}``. The ring is built
+once when the game starts (players ordered by ``join_sequence``), afterward the next player, skipping players and
+removing a player who left, won or timed out are O(1). ``first`` is only used to list the players in seating order.
+Games saved without a ring get one the first time it is needed.
+"""
+from util.changes import state_changed
+
+SEATING = "seating"
+FIRST = "first"
+SEATS = "seats"
+
+
+def seat_players(state, players):
+    """Builds the ring from the players of the game, in the order they joined."""
+    player_ids = sorted(players, key=lambda pid: players[pid]['join_sequence'])
+    state[SEATING] = {
+        FIRST: player_ids[0] if player_ids else None,
+        SEATS: {pid: [player_ids[i - 1], player_ids[(i + 1) % len(player_ids)]] for i, pid in enumerate(player_ids)}
+    }
+    state_changed(SEATING)
+    return state[SEATING]
+
+
+def _seating(state, players):
+    seating = state.get(SEATING)
+    if seating is None:
+        # Spiel von vor der Sitzordnung, Ring einmalig aufbauen
+        seating = seat_players(state, players)
+    return seating
+
+
+def get_next_player(state, players, current_player_id, skip=0):
+    """The player after ``current_player_id``, ``skip`` further players are skipped."""
+    seats = _seating(state, players)[SEATS]
+    if current_player_id not in seats:
+        seats = seat_players(state, players)[SEATS]
+    player_id = seats[current_player_id][1]
+    for _ in range(skip):
+        player_id = seats[player_id][1]
+    return player_id
+
+
+def unseat_player(state, player_id):
+    """Takes a player out of the ring (left, won or timed out), a game without a ring is left unchanged."""
+    seating = state.get(SEATING)
+    if seating is None or player_id not in seating[SEATS]:
+        return
+    seats = seating[SEATS]
+    previous_id, next_id = seats.pop(player_id)
+    if seats:
+        seats[previous_id][1] = next_id
+        seats[next_id][0] = previous_id
+    if seating[FIRST] == player_id:
+        seating[FIRST] = next_id if seats else None
+    state_changed(SEATING)
+
+
+def seating_order(state, players):
+    """The seated players in seating order, starting with the first one who joined."""
+    seating = _seating(state, players)
+    seats = seating[SEATS]
+    order = []
+    player_id = seating[FIRST]
+    while player_id is not None and len(order) < len(seats):
+        order.append(player_id)
+        player_id = seats[player_id][1]
+    return order
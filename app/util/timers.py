@@ -0,0 +1,95 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+
+# Seconds a player has for a turn before the timeout penalty removes them from the game
+TURN_TIMEOUT = float(os.getenv('TURN_TIMEOUT', '45'))
+
+TURN_START_TIME = "turn_start_time"
+
+logger = logging.getLogger("app.timers")
+
+
+def turn_deadline(state):
+    """Unix time at which the current turn runs out, None if no turn is running."""
+    turn_start_time = state.get(TURN_START_TIME)
+    if not state.get("started") or not turn_start_time:
+        return None
+    return turn_start_time + TURN_TIMEOUT
+
+
+class TimerService:
+    """
+    One task for all timers of the process, ordered by deadline in a heap.
+
+    Every key (e.g. a game id) has at most one armed timer, arming it again replaces the old one. Replaced and
+    cancelled entries stay in the heap and are skipped once they come up. The task sleeps until the earliest deadline
+    and is only woken up early when an earlier timer is armed, nothing is polled. ``callback(key, payload)`` runs on
+    the event loop and must not block.
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+        self._heap = []  # [(deadline, seq, key), ...]
+        self._timers = {}  # {key: (deadline, seq, payload)}
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._task = None
+
+    def __len__(self):
+        return len(self._timers)
+
+    def arm(self, key, deadline, payload=None):
+        """Fires ``callback(key, payload)`` at ``deadline`` (Unix time) unless re-armed or cancelled before."""
+        current = self._timers.get(key)
+        if current is not None and current[0] == deadline and current[2] == payload:
+            return
+        seq = next(self._seq)
+        self._timers[key] = (deadline, seq, payload)
+        heapq.heappush(self._heap, (deadline, seq, key))
+        if self._heap[0][1] == seq:
+            self._ensure_running()
+            self._wakeup.set()
+
+    def cancel(self, key):
+        self._timers.pop(key, None)
+
+    def deadline(self, key):
+        timer = self._timers.get(key)
+        return timer[0] if timer else None
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done() or self._task.get_loop().is_closed():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    def _is_current(self, seq, key):
+        timer = self._timers.get(key)
+        return timer is not None and timer[1] == seq
+
+    async def _run(self):
+        while True:
+            while self._heap and not self._is_current(self._heap[0][1], self._heap[0][2]):
+                heapq.heappop(self._heap)
+            if not self._heap:
+                return  # Der nächste Timer startet die Task neu
+
+            deadline, seq, key = self._heap[0]
+            delay = deadline - time.time()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._heap)
+            _, _, payload = self._timers.pop(key)
+            try:
+                self.callback(key, payload)
+            except Exception:
+                logger.exception("timer callback failed", extra={"fields": {"key": key}})
@@ -0,0 +1,77 @@
+"""
+Binary wire format (MessagePack) for clients that ask for the ``msgpack`` WebSocket subprotocol.
+
+Messages have the same structure as in JSON, but cards are sent as MessagePack extension types instead of
+``{"suit": ..., "value": ...}`` objects:
+
+- ext type 1 (``EXT_CARD``): one card, a single byte ``suit << 4 | value``
+- ext type 2 (``EXT_CARDS``): a non-empty list of cards, one byte per card
+
+The byte is the same int the rules engines use internally (``util/cards.py``). Clients may send binary messages in
+the same format. Needs the ``msgpack`` package (``requirements.txt``), without it the subprotocol is not offered and
+JSON is used.
+"""
+from util import codec
+from util.cards import CARD_CODES, SUITS, VALUES  # noqa: F401
+
+try:
+    import msgpack
+except ImportError:  # optional dependency, clients fall back to JSON
+    msgpack = None
+
+SUBPROTOCOL = "msgpack"
+
+EXT_CARD = 1
+EXT_CARDS = 2
+
+CARDS_BY_CODE = {code: {"suit": suit, "value": value} for (suit, value), code in CARD_CODES.items()}
+
+
+def choose_subprotocol(requested):
+    """The subprotocol to accept from the client's ``Sec-WebSocket-Protocol`` list (None: JSON)."""
+    return SUBPROTOCOL if msgpack is not None and SUBPROTOCOL in requested else None
+
+
+def _card_code(obj):
+    if type(obj) is dict and len(obj) == 2:
+        return CARD_CODES.get((obj.get("suit"), obj.get("value")))
+    return None
+
+
+def _pack_cards(obj):
+    if type(obj) is dict:
+        code = _card_code(obj)
+        if code is not None:
+            return msgpack.ExtType(EXT_CARD, bytes((code,)))
+        return {key: _pack_cards(value) for key, value in obj.items()}
+    if type(obj) is list:
+        if obj:
+            codes = [_card_code(item) for item in obj]
+            if None not in codes:
+                return msgpack.ExtType(EXT_CARDS, bytes(codes))
+        return [_pack_cards(item) for item in obj]
+    return obj
+
+
+def _unpack_ext(code, data):
+    if code == EXT_CARD:
+        return dict(CARDS_BY_CODE[data[0]])
+    if code == EXT_CARDS:
+        return [dict(CARDS_BY_CODE[byte]) for byte in data]
+    return msgpack.ExtType(code, data)
+
+
+def packb(message) -> bytes:
+    return msgpack.packb(_pack_cards(message))
+
+
+def unpackb(data):
+    return msgpack.unpackb(data, ext_hook=_unpack_ext)
+
+
+def decode_frame(data, max_size=None):
+    """Parses an inbound binary WebSocket message, oversized messages are rejected before parsing."""
+    max_size = max_size or codec.MAX_FRAME_SIZE
+    if len(data) > max_size:
+        raise codec.FrameTooLargeError(f"Frame exceeds {max_size} bytes")
+    return unpackb(data)